@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+
+# The scripts run from a checkout, train_kick is imported from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+from train_kick.env.Robot import NeoRobot
+from train_kick.env.ActionEncoder import ActionEncoder
+
+"""
+Compare encoding effector commands by the ActionEncoder with the former
+string formatting of NeoRobot.actionToMessage on random actions.
+
+python benchmarks/action_throughput.py [robots] [repeat]
+"""
+
+robots = 32
+repeat = 200
+
+if (len(sys.argv) > 1):
+    robots = int(sys.argv[1])
+if (len(sys.argv) > 2):
+    repeat = int(sys.argv[2])
+
+
+def formatAction(robot, action):
+    effectors = [.0, .0]
+    effectors.extend(action)
+    effectors.extend([.0, .0])
+    return bytes(robot.actionToMessage(effectors), 'ascii')
+
+
+def throughput(encode, actions):
+    begin = time.perf_counter()
+    for i in range(repeat):
+        encode(actions)
+    return repeat * len(actions) / (time.perf_counter() - begin)
+
+
+rng = np.random.default_rng(0)
+actions = rng.uniform(-1, 1, (robots, 20))
+robot = NeoRobot("sydney1", 1)
+encoder = ActionEncoder(NeoRobot.EFFECTOR, NeoRobot.EFFECTOR_RANGE, NeoRobot.ACTION_COLUMNS)
+
+"""
+Both must send the same speeds, the encoder only writes 0.00 instead of -0.00.
+"""
+for action, message in zip(actions, encoder.encodeBatch(actions)):
+    if formatAction(robot, action).replace(b'-0.00', b'0.00') != message:
+        print("commands differ for action:" + str(action))
+        sys.exit(1)
+
+"""
+Slowly changing actions as in the reset poses, about half of the speeds stay the same.
+"""
+steady = np.repeat(actions[:1], robots, axis=0)
+steady[:, ::2] += rng.uniform(-0.1, 0.1, (robots, 10))
+last = np.full((1, len(NeoRobot.EFFECTOR)), -1, dtype=np.intp)
+full = sum(len(encoder.encode(action)) for action in steady)
+suppressed = sum(len(encoder.encodeBatch(action[None], last)[0]) for action in steady)
+
+formatRate = throughput(lambda batch: [formatAction(robot, action) for action in batch], actions)
+encodeRate = throughput(lambda batch: [encoder.encode(action) for action in batch], actions)
+batchRate = throughput(encoder.encodeBatch, actions)
+print("robots: %d, repeat: %d" % (robots, repeat))
+print("format:        %10.0f cmd/s %8.2f us/cmd" % (formatRate, 1e6 / formatRate))
+print("encode:        %10.0f cmd/s %8.2f us/cmd" % (encodeRate, 1e6 / encodeRate))
+print("encode batch:  %10.0f cmd/s %8.2f us/cmd" % (batchRate, 1e6 / batchRate))
+print("speedup: %.2fx, batch %.2fx" % (encodeRate / formatRate, batchRate / formatRate))
+print("bytes per command: %.1f, suppressed %.1f" % (full / robots, suppressed / robots))
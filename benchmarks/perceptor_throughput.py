@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+
+# The scripts run from a checkout, train_kick is imported from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+from train_kick.env.Robot import NeoRobot
+
+"""
+Compare the throughput of NeoRobot.update with the former regex parser
+on recorded perceptor messages, one message per line.
+
+python benchmarks/perceptor_throughput.py [messages.txt] [repeat]
+"""
+
+corpus = os.path.join(os.path.dirname(__file__), "data", "perceptor.txt")
+repeat = 20
+
+if (len(sys.argv) > 1):
+    corpus = sys.argv[1]
+if (len(sys.argv) > 2):
+    repeat = int(sys.argv[2])
+
+
+def loadMessages(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def throughput(update, messages):
+    begin = time.perf_counter()
+    for i in range(repeat):
+        for message in messages:
+            update(message)
+    return repeat * len(messages) / (time.perf_counter() - begin)
+
+
+messages = loadMessages(corpus)
+
+"""
+Both parsers must produce the same states for every message.
+"""
+regexRobot = NeoRobot("sydney1", 1)
+robot = NeoRobot("sydney1", 1)
+for message in messages:
+    regexRobot.updateRegex(message)
+    robot.update(message)
+    if not np.allclose(regexRobot.getAllStates(), robot.getAllStates()):
+        print("states differ for message:" + message)
+        sys.exit(1)
+
+regexRate = throughput(regexRobot.updateRegex, messages)
+rate = throughput(robot.update, messages)
+print("messages: %d, repeat: %d" % (len(messages), repeat))
+print("regex update:  %10.0f msg/s %8.2f us/msg" % (regexRate, 1e6 / regexRate))
+print("single pass:   %10.0f msg/s %8.2f us/msg" % (rate, 1e6 / rate))
+print("speedup: %.2fx" % (rate / regexRate))
@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+import time
+
+# The scripts run from a checkout, train_kick is imported from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from train_kick.env.Robot import NeoRobot
+from train_kick.env.StreamLog import StreamLog, STREAM_NAMES, AGENT, MONITOR
+
+"""
+Inspect, export or replay a stream log of StreamRecorder(TrainKick(recordDir=...)).
+
+python benchmarks/replay_log.py stats logs/streams/1_sydney1_1.tklog
+python benchmarks/replay_log.py dump --stream agent logs/streams/1_sydney1_1.tklog > perceptor.txt
+python benchmarks/replay_log.py replay [--speed 1] logs/streams/1_sydney1_1.tklog
+
+dump writes one frame per line, the corpus format of benchmarks/data.
+replay feeds the frames into a NeoRobot as fast as possible, or at speed times the recorded pace.
+"""
+
+parser = argparse.ArgumentParser(description="inspect, export or replay a stream log")
+parser.add_argument("command", choices=("stats", "dump", "replay"))
+parser.add_argument("log")
+parser.add_argument("--stream", choices=tuple(STREAM_NAMES), help="only the frames of this stream")
+parser.add_argument("--speed", type=float, help="multiple of the recorded pace, as fast as possible by default")
+args = parser.parse_args()
+log = StreamLog(args.log)
+
+if (args.command == "dump"):
+    for timestamp, stream, frame in log.frames(STREAM_NAMES.get(args.stream)):
+        print(bytes(frame).decode('ascii', 'replace'))
+elif (args.command == "stats"):
+    counts = [0, 0]
+    sizes = [0, 0]
+    last = None
+    duration = 0
+    for timestamp, stream, frame in log.frames(STREAM_NAMES.get(args.stream)):
+        counts[stream] += 1
+        sizes[stream] += len(frame)
+        # The gaps between appended runs aren't recorded time
+        if last is not None and 0 <= timestamp - last <= StreamLog.MAX_GAP * 1e9:
+            duration += (timestamp - last) / 1e9
+        last = timestamp
+    print("agent frames: %d, %d bytes" % (counts[AGENT], sizes[AGENT]))
+    print("monitor frames: %d, %d bytes" % (counts[MONITOR], sizes[MONITOR]))
+    print("recorded: %.1fs, file: %d bytes, ratio: %.1fx" % (
+        duration, os.path.getsize(args.log), sum(sizes) / max(os.path.getsize(args.log), 1)))
+else:
+    robot = NeoRobot("sydney1", 1)
+    begin = time.perf_counter()
+    count = log.replay(robot, args.speed)
+    elapsed = time.perf_counter() - begin
+    print("replayed %d frames in %.3fs, %.0f frames/s" % (count, elapsed, count / max(elapsed, 1e-9)))
+log.close()
@@ -0,0 +1,109 @@
+import os
+import re
+import sys
+import time
+
+# The scripts run from a checkout, train_kick is imported from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from train_kick.env.GrandEnvs import GrandEnvs
+
+"""
+Compare the throughput of GrandEnvs.updateGrandStates with the former regex parser
+on recorded (reqfullstate) monitor messages, one message per line.
+
+The deltas(RDS) of the same scenes are applied after the first full scene.
+
+python benchmarks/scene_throughput.py [monitor.txt] [repeat] [monitor_delta.txt]
+"""
+
+corpus = os.path.join(os.path.dirname(__file__), "data", "monitor.txt")
+deltaCorpus = os.path.join(os.path.dirname(__file__), "data", "monitor_delta.txt")
+repeat = 5
+
+if (len(sys.argv) > 1):
+    corpus = sys.argv[1]
+if (len(sys.argv) > 2):
+    repeat = int(sys.argv[2])
+if (len(sys.argv) > 3):
+    deltaCorpus = sys.argv[3]
+
+"""
+The patterns GrandEnvs used before the SceneParser.
+"""
+ballPattern = re.compile(r'\(nd\s([^n]*)\(nd\s([^n]*)soccerball\.obj')
+playerPattern = re.compile(r'\(nd ([^n]*)\(nd [^n]*\(nd [^n]*naobody\d\.obj[^r]*\(resetMaterials matNum(\w*) mat(\w*) matType(\d) naowhite\)\)\)\(nd TRF[^R]* TRF [^R]* ([^n]*)\(nd')
+
+
+def translation(location):
+    slist = location.strip()[8:-1].split()
+    return [float(slist[12]), float(slist[13]), float(slist[14])]
+
+
+def regexParse(message):
+    ball = translation(ballPattern.search(message).group(1))
+    players = {}
+    for match in playerPattern.finditer(message):
+        team = 0 if match.group(3) == 'Left' else 1
+        players[(team, int(match.group(2)))] = (translation(match.group(5)), translation(match.group(1)))
+    return ball, players
+
+
+def loadMessages(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def throughput(update, messages):
+    begin = time.perf_counter()
+    for i in range(repeat):
+        for message in messages:
+            update(message)
+    return repeat * len(messages) / (time.perf_counter() - begin)
+
+
+messages = loadMessages(corpus)
+grandEnvs = GrandEnvs()
+
+"""
+Both parsers must find the same locations for every message.
+"""
+for message in messages:
+    ball, players = regexParse(message)
+    grandEnvs.updateGrandStates(message.encode('ascii'))
+    if ball != grandEnvs.getBallLocation():
+        print("ball differs for message:" + message[:200])
+        sys.exit(1)
+    for (team, playerNumber), (head, body) in players.items():
+        if head != grandEnvs.getPlayerLocation(team, playerNumber):
+            print("player differs for message:" + message[:200])
+            sys.exit(1)
+
+frames = [message.encode('ascii') for message in messages]
+regexRate = throughput(regexParse, messages)
+rate = throughput(grandEnvs.updateGrandStates, frames)
+print("messages: %d, repeat: %d" % (len(messages), repeat))
+print("regex parse:   %10.0f msg/s %8.2f us/msg" % (regexRate, 1e6 / regexRate))
+print("scene parser:  %10.0f msg/s %8.2f us/msg" % (rate, 1e6 / rate))
+print("full parses: %d, fast parses: %d" % (grandEnvs.sceneParser.fullParses, grandEnvs.sceneParser.fastParses))
+print("speedup: %.2fx" % (rate / regexRate))
+
+"""
+Every delta must lead to the locations of the next full scene.
+"""
+deltas = [message.encode('ascii') for message in loadMessages(deltaCorpus)]
+deltaEnvs = GrandEnvs()
+deltaEnvs.updateGrandStates(frames[0])
+for frame, delta in zip(frames[1:], deltas):
+    grandEnvs.updateGrandStates(frame)
+    deltaEnvs.updateGrandStates(delta)
+    if (deltaEnvs.getBallLocation() != grandEnvs.getBallLocation() or
+            deltaEnvs.playersHeadLocations != grandEnvs.playersHeadLocations):
+        print("delta differs for message:" + delta[:200].decode('ascii'))
+        sys.exit(1)
+
+deltaRate = throughput(deltaEnvs.updateGrandStates, deltas)
+print("delta update:  %10.0f msg/s %8.2f us/msg" % (deltaRate, 1e6 / deltaRate))
+print("bytes per delta: %.0f, per full scene: %.0f" % (
+    sum(map(len, deltas)) / len(deltas), sum(map(len, frames)) / len(frames)))
+print("speedup against regex: %.2fx" % (deltaRate / regexRate))
@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+# The scripts run from a checkout, train_kick is imported from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+from train_kick.env.GrandEnvs import GrandEnvs
+from train_kick.env.Robot import NeoRobot
+from train_kick.env.TCPClient import AgentConnection
+
+"""
+Offline micro-benchmarks of the hot paths on the recorded corpus in benchmarks/data,
+compared against a stored baseline.
+
+Every case reports msg/s, us/op and the bytes allocated per op(peak of tracemalloc
+during the op, in a separate pass, so tracing doesn't slow down the timed pass).
+A case regresses if its us/op exceeds the baseline by more than threshold.
+
+python benchmarks/suite.py [--repeat 20] [--threshold 0.2] [--only update,step]
+                           [--output results.json] [--baseline benchmarks/baseline.json] [--save-baseline]
+Exit code 1 if a case regressed.
+"""
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def loadMessages(name):
+    with open(os.path.join(DATA, name)) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class FakeSocket:
+    """
+    Socket which accepts everything, for the framing of AgentConnection.
+    """
+
+    def send(self, data):
+        return len(data)
+
+
+class ReplayConnection:
+    """
+    Connection in sync mode which replays the corpus instead of talking to simspark:
+    every cycle feeds the next perceptor and monitor message to the robot.
+    """
+    syncMode = True
+
+    def __init__(self, robot, perceptors, scenes):
+        self.robot = robot
+        self.perceptors = perceptors
+        self.scenes = scenes
+        self.messageCount = 0
+        self.lastReceived = time.time()
+        self.send_buffer = b""
+
+    def connectServers(self, ip, port, mport, retries=None):
+        return True
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    def isDead(self):
+        return False
+
+    def observationAge(self):
+        return time.time() - self.lastReceived
+
+    def sendMessage(self, message):
+        self.send_buffer = message
+
+    def sendMonitorMessage(self, message):
+        pass
+
+    def syncCycle(self, timeout=1.0):
+        self.robot.update(self.perceptors[self.messageCount % len(self.perceptors)])
+        self.robot.updateGrandStates(self.scenes[self.messageCount % len(self.scenes)])
+        self.messageCount += 1
+        self.lastReceived = time.time()
+        return True
+
+    def waitMessage(self, count, timeout):
+        return self.syncCycle(timeout)
+
+
+class ReplayGroup:
+    """
+    Group of TrainKick(group=...) which creates ReplayConnections.
+    """
+
+    def __init__(self, perceptors, scenes):
+        self.perceptors = perceptors
+        self.scenes = scenes
+
+    def createConnection(self, threadName, robot, syncMode=True, latestOnly=False):
+        return ReplayConnection(robot, self.perceptors, self.scenes)
+
+
+def caseUpdate(corpus):
+    robot = NeoRobot("sydney1", 1)
+    return robot.update, corpus["perceptors"]
+
+
+def caseGetAllStates(corpus):
+    robot = NeoRobot("sydney1", 1)
+    robot.update(corpus["perceptors"][0])
+    robot.grandEnvs.updateGrandStates(corpus["scenes"][0])
+    out = np.empty(len(robot.getAllStates()))
+    return lambda reset: robot.getAllStates(reset, out), [0, 1] * 50
+
+
+def caseActionToMessage(corpus):
+    robot = NeoRobot("sydney1", 1)
+    return robot.actionToMessage, corpus["effectors"]
+
+
+def caseEncode(corpus):
+    robot = NeoRobot("sydney1", 1)
+    return robot.encoder.encode, corpus["actions"]
+
+
+def caseFullScene(corpus):
+    grandEnvs = GrandEnvs()
+    return grandEnvs.updateGrandStates, corpus["scenes"]
+
+
+def caseDeltaScene(corpus):
+    grandEnvs = GrandEnvs()
+    grandEnvs.updateGrandStates(corpus["scenes"][0])
+    return grandEnvs.updateGrandStates, corpus["deltas"]
+
+
+def caseFraming(corpus):
+    robot = NeoRobot("sydney1", 1)
+    con = AgentConnection(1, "benchmark", robot)
+    con.sock = FakeSocket()
+    return con._AgentConnection__socketSend, corpus["commands"]
+
+
+def caseStep(corpus):
+    from train_kick.TrainKick import TrainKick
+    group = ReplayGroup(corpus["perceptors"], corpus["scenes"])
+    env = TrainKick(1, "127.0.0.1", 3100, 3200, "sydney1", 1, 0, 0, 0, 10 ** 9, 'kick', syncMode=True, group=group)
+    env.reset()
+    """
+    Skip the reset frames, then every step applies an action.
+    """
+    for i in range(TrainKick.RESETSTEP):
+        env.step(np.zeros(20))
+    return env.step, corpus["actions"]
+
+
+CASES = {
+    "update": caseUpdate,
+    "getAllStates": caseGetAllStates,
+    "actionToMessage": caseActionToMessage,
+    "encode": caseEncode,
+    "fullScene": caseFullScene,
+    "deltaScene": caseDeltaScene,
+    "framing": caseFraming,
+    "step": caseStep,
+}
+
+
+def loadCorpus():
+    rng = np.random.default_rng(0)
+    actions = rng.uniform(-1, 1, (100, 20))
+    effectors = np.zeros((100, 24))
+    effectors[:, 2:22] = actions
+    robot = NeoRobot("sydney1", 1)
+    return {
+        "perceptors": [message.encode('ascii') for message in loadMessages("perceptor.txt")],
+        "scenes": [message.encode('ascii') for message in loadMessages("monitor.txt")],
+        "deltas": [message.encode('ascii') for message in loadMessages("monitor_delta.txt")],
+        "actions": list(actions),
+        "effectors": [list(row) for row in effectors],
+        "commands": [robot.encoder.encode(action) + b"(syn)" for action in actions],
+    }
+
+
+def measure(op, items, repeat):
+    """
+    Return msg/s, us/op and the mean peak of bytes allocated per op.
+    """
+    for item in items:
+        op(item)
+    begin = time.perf_counter()
+    for i in range(repeat):
+        for item in items:
+            op(item)
+    elapsed = time.perf_counter() - begin
+    count = repeat * len(items)
+
+    allocated = 0
+    tracemalloc.start()
+    for item in items:
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        op(item)
+        allocated += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return {"msgPerSec": round(count / elapsed, 1), "usPerOp": round(1e6 * elapsed / count, 3),
+            "allocBytesPerOp": round(allocated / len(items), 1)}
+
+
+def compare(results, baseline, threshold):
+    """
+    Print every case against the baseline, return the names of the regressed cases.
+    """
+    regressed = []
+    print("%-16s %12s %10s %12s %10s" % ("case", "msg/s", "us/op", "alloc B/op", "vs base"))
+    for name, result in results.items():
+        base = baseline.get(name)
+        change = ""
+        if base is not None:
+            ratio = result["usPerOp"] / base["usPerOp"]
+            change = "%+.1f%%" % (100 * (ratio - 1))
+            if ratio > 1 + threshold:
+                change += " REGRESSED"
+                regressed.append(name)
+        print("%-16s %12.0f %10.3f %12.1f %10s" % (name, result["msgPerSec"], result["usPerOp"],
+                                                   result["allocBytesPerOp"], change))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline micro-benchmarks against a stored baseline")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown of us/op, 0.2 is 20%%")
+    parser.add_argument("--only", help="comma separated cases of " + ",".join(CASES))
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args()
+
+    names = list(CASES) if args.only is None else args.only.split(",")
+    corpus = loadCorpus()
+    results = {}
+    for name in names:
+        op, items = CASES[name](corpus)
+        results[name] = measure(op, items, args.repeat)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["cases"]
+    regressed = compare(results, baseline, args.threshold)
+
+    report = {"python": platform.python_version(), "machine": platform.machine(), "repeat": args.repeat,
+              "cases": results}
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print("baseline saved to " + args.baseline)
+    if regressed:
+        print("regressed over %.0f%%: %s" % (100 * args.threshold, ", ".join(regressed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
-import time
+import atexit
 import sys
 import os
-import subprocess
+import shutil
 import numpy as np
 
 from stable_baselines import PPO2, TRPO
@@ -9,9 +9,15 @@ from stable_baselines.common.policies import MlpPolicy, MlpLnLstmPolicy
 from stable_baselines.common.vec_env import SubprocVecEnv, VecNormalize
 from stable_baselines.common import set_global_seeds
 from stable_baselines.bench import Monitor
-from stable_baselines.results_plotter import load_results, ts2xy
 
 from train_kick import TrainKick
+from train_kick.TrainKickVecEnv import TrainKickVecEnv
+from train_kick.SharedMemoryVecEnv import SharedMemoryVecEnv
+from train_kick.VecRewardTracker import VecRewardTracker
+from train_kick.CheckpointManager import CheckpointManager
+from train_kick.env.AsyncClient import AgentLoop
+from train_kick.env.MonitorFeed import MonitorFeed
+from train_kick.env.ServerPool import ServerPool
 from train_kick.env.Logger import Logger
 
 # IP = "localhost"
@@ -28,6 +34,29 @@ env_id = "TrainKick-v0"
 # loadFile = "SaveModel/model5.pkl"
 loadFile = "SaveModel/kicksave3.pkl"
 trainType = "kick"
+# Step in lockstep with the server, simspark must run in agent sync mode
+syncMode = False
+# Run all actors in this process with one selector instead of SubprocVecEnv workers
+singleProcess = False
+# Exchange observations and actions with the SubprocVecEnv workers through shared memory instead of pipes
+sharedMemory = False
+# Serve the connections of each worker by one asyncio loop instead of three threads
+asyncTransport = False
+# One monitor client per server shared by all actors through shared memory
+sharedMonitor = False
+# Parse only the newest perceptor message when an actor falls behind the server
+latestOnly = False
+# Only send the effectors whose speed changed since the last command
+suppressEffectors = False
+# Reset the episodes by trainer commands on the monitor connection instead of servoing the first steps
+resetMode = 'servo'
+# Export p50/p99 latencies of the hot paths of every actor to this directory, e.g. "./logs/metrics/"
+metricsDir = None
+# Record the received frames of every actor to this directory for offline replay, e.g. "./logs/streams/"
+recordDir = None
+# Checkpoints are written in the background, keep the last periodic ones and the best scored ones
+keepLast = 3
+keepBest = 3
 
 # Create log dir
 log_dir = "./logs/"
@@ -40,25 +69,35 @@ if (len(sys.argv) == 3):
     logger.info("server_num:" + str(server_num) + " num_actors:" + str(num_actors))
 
 
-def startServers():
-    cmd = "rm -rf ./logs/*"
-    logger.info(cmd)
-    subprocess.Popen(cmd, shell=True)
+def cleanLogs():
+    for name in os.listdir(log_dir):
+        path = os.path.join(log_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
 
-    for j in range(server_num):
-        port1_n = port + j
-        port2_n = mport + j
-        cmd = "simspark --agent-port " + str(port1_n) + " --server-port " + str(port2_n) + " > logs/server" + str(
-            j) + ".log 2>&1"
-        logger.info(cmd)
-        subprocess.Popen(cmd, shell=True)
-        time.sleep(2)
+
+def startServers():
+    """
+    Start all servers at once and wait until their ports accept connections.
+    """
+    cleanLogs()
+    pool = ServerPool(server_num, IP, port, mport, log_dir)
+    atexit.register(pool.close)
+    pool.start()
+    if not pool.waitReady(timeout=120):
+        logger.error("simspark servers are not ready")
+        sys.exit(1)
+    pool.startWatcher()
+    return pool
 
 
 monList = []
 
 
-def get_env(rank, teamname, playerNumber, portj, mportj, sleepTime, max_episode_steps, trainType="kick", seed=0):
+def get_env(rank, teamname, playerNumber, portj, mportj, sleepTime, max_episode_steps, trainType="kick", seed=0,
+            syncMode=False):
     """
     Because the server can accept agent connecting at same time,
     SleepTime makes the init become in order.
@@ -67,17 +106,27 @@ def get_env(rank, teamname, playerNumber, portj, mportj, sleepTime, max_episode_
                 playerNumber=0, locationX=10, locationY=10, sleep_time=0, max_episode_steps=1000):
     """
 
-    def _get():
+    def _get(group=None):
         locationX = -playerNumber * 1.5
         locationY = -6 + playerNumber * 1.5
         set_global_seeds(seed + rank)
 
+        transport = group
+        if group is None and asyncTransport:
+            transport = AgentLoop.get()
+
         env = TrainKick(rank, IP, portj, mportj,
                           teamname, playerNumber,
                           locationX, locationY,
-                          sleepTime, max_episode_steps=500, trainType=trainType)
+                          sleepTime, max_episode_steps=500, trainType=trainType, syncMode=syncMode,
+                          group=transport, sharedMonitor=sharedMonitor, latestOnly=latestOnly,
+                          suppressEffectors=suppressEffectors, resetMode=resetMode, metricsDir=metricsDir,
+                          recordDir=recordDir)
 
         env.seed(seed + rank)
+        if group is not None:
+            # TrainKickVecEnv writes the monitor file itself
+            return env
         logdir = os.path.join(log_dir, str(rank))
         env = Monitor(env, str(logdir), allow_early_resets=True)
 
@@ -90,9 +139,13 @@ def get_env(rank, teamname, playerNumber, portj, mportj, sleepTime, max_episode_
 Due to the number 5 of each type of robots in each team,
 Using two teams could help the number reach to 10.
 """
-startServers()
-if (server_num > 1):
-    time.sleep(120)
+serverPool = startServers()
+
+if sharedMonitor:
+    for j in range(server_num):
+        feed = MonitorFeed(IP, mport + j)
+        feed.start()
+        atexit.register(feed.close)
 
 envlist = []
 for j in range(server_num):
@@ -107,7 +160,7 @@ for j in range(server_num):
                         playerNumber=i + 1,
                         portj=j + port,
                         mportj=j + mport,
-                        sleepTime=i + 1, max_episode_steps=250, trainType=trainType))
+                        sleepTime=0, max_episode_steps=250, trainType=trainType, syncMode=syncMode))
         else:
             envlist.append(
                 get_env(rank,
@@ -115,9 +168,9 @@ for j in range(server_num):
                         playerNumber=i + 1 - 5,
                         portj=j + port,
                         mportj=j + mport,
-                        sleepTime=i + 1, max_episode_steps=250, trainType=trainType))
+                        sleepTime=0, max_episode_steps=250, trainType=trainType, syncMode=syncMode))
 
-best_mean_reward, n_steps = 0, 0
+best_mean_reward, n_steps, last_episodes = 0, 0, 0
 
 
 def callback(_locals, _globals):
@@ -126,21 +179,17 @@ def callback(_locals, _globals):
     :param _locals: (dict)
     :param _globals: (dict)
     """
-    global n_steps, best_mean_reward
+    global n_steps, best_mean_reward, last_episodes
     # Print stats every 1000 calls
     if n_steps % 5 == 0:
         """
-        # Evaluate policy training performance
-        • timesteps – (Pandas DataFrame) the input data
-        • xaxis – (str) the axis for the x and y output (can be X_TIMESTEPS=’timesteps’,
-        X_EPISODES=’episodes’ or X_WALLTIME=’walltime_hrs’)
+        Evaluate policy training performance by the rolling mean of the last 100 episodes of every actor,
+        which the VecRewardTracker keeps while the envs step, instead of re-reading the monitor files.
         """
-        # for ldir in monList:
-
-        x, y = ts2xy(load_results(log_dir), 'episodes')
-        if len(x) > 0:
-            lines = server_num * num_actors * -100
-            mean_reward = round(np.mean(y[lines:]), 2)
+        tracker = rewardTracker.tracker
+        if tracker.episodes > last_episodes:
+            last_episodes = tracker.episodes
+            mean_reward = round(tracker.mean(), 2)
 
             logger.info(
                 "Best mean reward: {:.2f} - Last mean reward per episode: {:.2f}".format(best_mean_reward, mean_reward))
@@ -149,16 +198,26 @@ def callback(_locals, _globals):
             if mean_reward - best_mean_reward > 1:
                 best_mean_reward = mean_reward
                 # Example for saving best model
-                savename = 'Model' + str(int(mean_reward)) + '.pkl'
+                savename = 'Model' + str(int(mean_reward))
                 logger.info("Saving new best model:" + savename)
-                _locals['self'].save('SaveModel/' + savename)
+                checkpoints.save(_locals['self'], savename, score=mean_reward, normalizer=env)
     n_steps += 1
     # Returning False will stop training early
     return True
 
 
-env = SubprocVecEnv(envlist)
+if singleProcess:
+    env = TrainKickVecEnv(envlist, log_dir)
+elif sharedMemory:
+    env = SharedMemoryVecEnv(envlist)
+else:
+    env = SubprocVecEnv(envlist)
+rewardTracker = VecRewardTracker(env, window=server_num * num_actors * 100)
+env = rewardTracker
 env = VecNormalize(env, norm_obs=True, norm_reward=True, clip_obs=10.0, clip_reward=0.51)
+# Each checkpoint name.pkl has the VecNormalize statistics in name.vecnormalize.pkl,
+# restore them with CheckpointManager.loadNormalization(loadFile, env) when resuming
+checkpoints = CheckpointManager('SaveModel/', keepLast, keepBest)
 # env = VecCheckNan(env, raise_exception=True)
 model = PPO2(MlpPolicy, env, verbose=1)  #PPO2.load(loadFile, env, learning_rate=1e-6)
 # print(model.get_parameters())
@@ -177,5 +236,6 @@ model = PPO2(MlpPolicy, env, verbose=1)  #PPO2.load(loadFile, env, learning_rate
 
 for index in range(500):
     model.learn(total_timesteps=int(1e6), log_interval=100, tb_log_name='tb.log', callback=callback)
-    model.save('SaveModel/kicksave' + str(index))
+    checkpoints.save(model, 'kicksave' + str(index), normalizer=env)
     logger.info('SaveModel/kicksave' + str(index))
+checkpoints.close()
@@ -0,0 +1,61 @@
+import asyncio
+import threading
+import time
+
+from train_kick.env.AsyncClient import AgentLoop
+from train_kick.env.Robot import NeoRobot
+
+from test_StandInServer import freePort, startServer
+
+
+def joinedRobot(server):
+    robot = NeoRobot("sydney1", 1)
+    assert robot.joinGame("127.0.0.1", server.port, server.mport, syncMode=True, group=AgentLoop.get())
+    return robot
+
+
+def testWaitMessageWakesWhenTheServerCloses():
+    server = startServer(cycle=0, syncMode=True)
+    robot = joinedRobot(server)
+    try:
+        server.close()
+        begin = time.time()
+        assert not robot.con.waitMessage(robot.con.messageCount, timeout=5)
+        assert time.time() - begin < 1
+        assert robot.con.isDead()
+    finally:
+        robot.close()
+
+
+def testWaitMessageWakesWhenTheConnectionIsClosed():
+    server = startServer(cycle=0, syncMode=True)
+    robot = joinedRobot(server)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(robot.con.waitMessage(robot.con.messageCount, 5)))
+    try:
+        waiter.start()
+        time.sleep(0.05)
+        robot.close()
+        waiter.join(1)
+        assert results == [False]
+    finally:
+        server.close()
+
+
+def testFailedMonitorConnectClosesTheAgentStream():
+    server = startServer(cycle=0, syncMode=True)
+    agentLoop = AgentLoop.get()
+
+    async def receiving():
+        return [task for task in asyncio.all_tasks() if "__receive" in repr(task)]
+
+    con = agentLoop.createConnection("sydney1", NeoRobot("sydney1", 1), syncMode=True)
+    try:
+        assert not con.connectServers("127.0.0.1", server.port, freePort(), retries=1)
+        assert con.tasks == []
+        assert not hasattr(con, 'writer')
+        time.sleep(0.05)
+        assert agentLoop.run(receiving()) == []
+    finally:
+        con.close()
+        server.close()
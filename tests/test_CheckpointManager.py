@@ -0,0 +1,90 @@
+import os
+import pickle
+
+import numpy as np
+
+from train_kick.CheckpointManager import CheckpointManager
+
+
+class FakeModel:
+    """
+    The part of a stable-baselines model which the CheckpointManager uses.
+    """
+    failing = False
+
+    def __init__(self):
+        self.weights = np.zeros(3)
+
+    def save(self, save_path, cloudpickle=False):
+        self._save_to_file(save_path, data={"gamma": 0.99}, params={"weights": self.weights.copy()})
+
+    @classmethod
+    def _save_to_file(cls, save_path, data=None, params=None, cloudpickle=False):
+        with open(save_path, "wb") as f:
+            f.write(pickle.dumps((data, params))[:10])
+            if cls.failing:
+                raise OSError("disk full")
+            f.seek(0)
+            pickle.dump((data, params), f)
+
+
+class RunningMeanStd:
+    def __init__(self, mean):
+        self.mean = mean
+
+
+class FakeNormalizer:
+    def __init__(self, mean):
+        self.obs_rms = RunningMeanStd(np.full(2, mean))
+        self.ret_rms = RunningMeanStd(mean)
+
+
+def load(manager, name):
+    with open(manager.path(name), "rb") as f:
+        return pickle.load(f)[1]["weights"].tolist()
+
+
+def testRetentionKeepsTheLastAndTheBestCheckpoints(tmp_path):
+    manager = CheckpointManager(str(tmp_path), keepLast=2, keepBest=2)
+    model = FakeModel()
+    try:
+        for i in range(4):
+            model.weights[:] = i
+            manager.save(model, "kicksave" + str(i), normalizer=FakeNormalizer(i))
+        for score in (3, 7, 5, 1):
+            model.weights[:] = score
+            manager.save(model, "Model" + str(score), score=score, normalizer=FakeNormalizer(score))
+        # The parameters are snapshotted by save(), not when they are written
+        model.weights[:] = -1
+        manager.wait()
+        names = ["kicksave2", "kicksave3", "Model5", "Model7"]
+        assert sorted(os.listdir(str(tmp_path))) == sorted(
+            [name + ".pkl" for name in names] + [name + CheckpointManager.NORMALIZATION_SUFFIX for name in names])
+        assert load(manager, "kicksave3") == [3, 3, 3] and load(manager, "Model7") == [7, 7, 7]
+        normalizer = FakeNormalizer(0)
+        assert CheckpointManager.loadNormalization(manager.path("Model5"), normalizer)
+        assert normalizer.obs_rms.mean.tolist() == [5, 5] and normalizer.ret_rms.mean == 5
+    finally:
+        manager.close()
+
+
+def testFailedWriteLeavesTheLastCheckpoint(tmp_path, monkeypatch):
+    manager = CheckpointManager(str(tmp_path))
+    model = FakeModel()
+    replaced = []
+    replace = os.replace
+    monkeypatch.setattr(os, "replace", lambda source, target: (replaced.append((source, target)),
+                                                                replace(source, target)))
+    try:
+        model.weights[:] = 1
+        manager.save(model, "kicksave")
+        manager.wait()
+        assert replaced == [(manager.path("kicksave") + ".tmp", manager.path("kicksave"))]
+        monkeypatch.setattr(FakeModel, "failing", True)
+        model.weights[:] = 2
+        manager.save(model, "kicksave")
+        manager.wait()
+        assert len(replaced) == 1
+        assert load(manager, "kicksave") == [1, 1, 1]
+    finally:
+        manager.close()
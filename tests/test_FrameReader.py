@@ -0,0 +1,26 @@
+import socket
+import struct
+
+from train_kick.env.FrameReader import FrameReader
+
+
+def frame(message):
+    return struct.pack("!I", len(message)) + message
+
+
+def testLatestFrameDoesNotWaitForAPartialFrame():
+    sock, peer = socket.socketpair()
+    # A read which blocked would time out instead of hanging the test
+    sock.settimeout(2)
+    reader = FrameReader(sock)
+    try:
+        third = frame(b"(time (now 0.06))")
+        peer.sendall(frame(b"(time (now 0.02))") + frame(b"(time (now 0.04))") + third[:6])
+        assert bytes(reader.readLatestFrame()) == b"(time (now 0.04))"
+        assert reader.framesSkipped == 1
+        peer.sendall(third[6:])
+        assert bytes(reader.readLatestFrame()) == b"(time (now 0.06))"
+        assert reader.framesSkipped == 1
+    finally:
+        sock.close()
+        peer.close()
@@ -0,0 +1,50 @@
+import time
+
+from train_kick.env.GrandEnvs import GrandEnvs
+from train_kick.env.MultiplexClient import AgentGroup
+from train_kick.env.Robot import NeoRobot
+
+from test_StandInServer import startServer
+
+
+def testPlayerWhoLeftTheSceneIsNoLongerValid():
+    server = startServer(cycle=0, syncMode=True)
+    group = AgentGroup()
+    robots = [NeoRobot("sydney1", unum) for unum in (1, 2)]
+    try:
+        for robot in robots:
+            assert robot.joinGame("127.0.0.1", server.port, server.mport, syncMode=True, group=group)
+        observer = robots[0]
+        assert observer.grandEnvs.hasPlayer(0, 2)
+        robots[1].close()
+        for cycle in range(20):
+            if not observer.grandEnvs.hasPlayer(0, 2):
+                break
+            group.syncCycle()
+        assert not observer.grandEnvs.hasPlayer(0, 2)
+        assert observer.grandEnvs.hasPlayer(0, 1)
+    finally:
+        group.close()
+        server.close()
+
+
+def testPlayerIsOnlyAcknowledgedFromScenesReadSince():
+    server = startServer(cycle=0, syncMode=True)
+    robot = NeoRobot("sydney1", 1)
+    try:
+        assert robot.joinGame("127.0.0.1", server.port, server.mport, syncMode=True)
+        grandEnvs = robot.grandEnvs
+        assert grandEnvs.hasPlayer(0, 1, grandEnvs.lastReadTime)
+        assert not grandEnvs.hasPlayer(0, 1, time.time() + 1)
+    finally:
+        robot.close()
+        server.close()
+
+
+def testClearPlayersRequestsAFullState():
+    grandEnvs = GrandEnvs()
+    grandEnvs.valid[0, 0] = True
+    grandEnvs.takeFullStateRequest()
+    grandEnvs.clearPlayers()
+    assert not grandEnvs.hasPlayer(0, 1)
+    assert grandEnvs.takeFullStateRequest()
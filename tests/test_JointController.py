@@ -0,0 +1,37 @@
+import numpy as np
+
+from train_kick.env.JointController import JointController, actionJoints, pose
+from train_kick.env.PerceptorParser import STATE_SIZE
+
+"""
+One action parameter turns a joint by about 8 degrees per cycle.
+"""
+DEGREES_PER_ACTION = 8
+
+
+def testJointsConvergeToThePoseWithoutOvershooting():
+    controller = JointController()
+    target = controller.target('kickReady')
+    joints = pose(laj1=40, llj4=20, rlj3=-70, raj3=100)
+    errors = []
+    for cycle in range(60):
+        joints = joints + DEGREES_PER_ACTION * controller.action(joints, 'kickReady')
+        errors.append(np.abs(joints - target).max())
+    assert controller.reached(joints, 'kickReady')
+    assert errors[-1] < 0.1
+    # Every joint approaches its target from one side
+    assert all(later <= earlier + 1e-9 for earlier, later in zip(errors, errors[1:]))
+
+
+def testBatchActionMatchesSingleActionsAndIsClipped():
+    controller = JointController(kd=0.05)
+    states = np.zeros((3, STATE_SIZE))
+    actionJoints(states)[:] = [pose(), pose(laj1=-90, raj1=-90), pose(llj4=200, rlj4=-200)]
+    speeds = np.ones((3, 20))
+    out = np.empty((3, 20))
+    actions = controller.action(actionJoints(states), 'stand', speeds, out=out)
+    assert actions is out
+    for joints, action in zip(actionJoints(states), actions):
+        assert np.allclose(controller.action(joints, 'stand', np.ones(20)), action)
+    assert actions.min() >= -1 and actions.max() <= 1 and (np.abs(actions[2]) == 1).any()
+    assert controller.reached(actionJoints(states), 'stand').tolist() == [False, True, False]
@@ -0,0 +1,55 @@
+import time
+
+import numpy as np
+
+from train_kick.env.MonitorFeed import MonitorFeed
+from train_kick.env.Robot import NeoRobot
+from train_kick.env.SharedWorld import SharedWorld
+from train_kick.env.StandInServer import StandInServer
+
+from test_StandInServer import freePort
+from test_TrainKick import waitFor
+
+
+def testSharedWorldReadsPlayerAndFlagTogether():
+    world = SharedWorld("trainkick_test_" + str(freePort()), create=True)
+    try:
+        players = np.zeros((world.TEAMS, world.UNUMS, 2, 3))
+        valid = np.zeros((world.TEAMS, world.UNUMS), dtype=bool)
+        players[0, 1] = [[1, 2, 3], [4, 5, 6]]
+        world.publish(players, valid, np.zeros(3), 1.0)
+        assert world.getPlayer(0, 2) is None
+        valid[0, 1] = True
+        world.publish(players, valid, np.zeros(3), 2.0)
+        assert world.getPlayer(0, 2) == ([1, 2, 3], [4, 5, 6])
+        locations, flag = world.read(world.players[0, 1], world.valid[0, 1:2])
+        assert flag[0] == 1 and locations[1].tolist() == [4, 5, 6]
+    finally:
+        world.close()
+        world.unlink()
+
+
+def testFeedReconnectsToARestartedServer():
+    port, mport = freePort(), freePort()
+    # The feed is forked before the server listens, or it would inherit the listening sockets
+    feed = MonitorFeed("127.0.0.1", mport)
+    feed.start()
+    server = StandInServer(port, mport, cycle=0.01)
+    server.start()
+    robot = NeoRobot("sydney1", 1)
+    try:
+        assert robot.joinGame("127.0.0.1", port, mport, sharedMonitor=True, timeout=5)
+        robot.close()
+        server.close()
+        assert waitFor(lambda: not robot.grandEnvs.hasPlayer(0, 1), 5)
+
+        server = StandInServer(port, mport, cycle=0.01)
+        server.start()
+        robot = NeoRobot("sydney1", 1)
+        begin = time.time()
+        assert robot.joinGame("127.0.0.1", port, mport, sharedMonitor=True, timeout=10)
+        assert time.time() - begin < 5
+    finally:
+        robot.close()
+        feed.close()
+        server.close()
@@ -0,0 +1,40 @@
+import socket
+import struct
+import threading
+
+from train_kick.env.MultiplexClient import AgentGroup
+from train_kick.env.Robot import NeoRobot
+
+
+def testFramesLargerThanTheSendBufferAreSentWhenThePeerReads():
+    listener = socket.create_server(("127.0.0.1", 0))
+    group = AgentGroup()
+    con = group.createConnection("sydney1", NeoRobot("sydney1", 1))
+    try:
+        assert con.connectServers("127.0.0.1", listener.getsockname()[1], None, retries=1)
+        peer, _ = listener.accept()
+        message = b"(say x)" * 1000000
+        con.sendMessage(message)
+        con.flush()
+        assert not con.isDead() and len(con.outgoing_buffer) > 0
+
+        received = bytearray()
+
+        def receive():
+            while len(received) < len(message) + 2 * len(struct.pack("!I", 5) + b"(syn)"):
+                received.extend(peer.recv(1 << 20))
+        receiver = threading.Thread(target=receive)
+        receiver.start()
+        # The second frame is queued behind the rest of the first one
+        con.flush()
+        while con.outgoing_buffer:
+            group.poll(1)
+        receiver.join(5)
+        length = struct.unpack_from("!I", received)[0]
+        assert received[4:4 + length] == message + b"(syn)"
+        assert received[4 + length:] == struct.pack("!I", 5) + b"(syn)"
+        assert not con.isDead()
+        peer.close()
+    finally:
+        group.close()
+        listener.close()
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from train_kick.env.RewardTracker import RewardTracker
+
+
+def testMeanIsTheMeanOfTheLastWindowEpisodes():
+    tracker = RewardTracker(window=7)
+    assert np.isnan(tracker.mean()) and np.isnan(tracker.meanLength())
+    random = np.random.RandomState(0)
+    rewards = random.normal(100, 50, 50)
+    lengths = random.randint(1, 300, 50)
+    for episode, (reward, length) in enumerate(zip(rewards, lengths)):
+        tracker.add(reward, length)
+        begin = max(0, episode - 6)
+        assert tracker.count() == episode + 1 - begin
+        assert tracker.mean() == pytest.approx(rewards[begin:episode + 1].mean())
+        assert tracker.meanLength() == pytest.approx(lengths[begin:episode + 1].mean())
+    assert tracker.episodes == 50 and tracker.steps == lengths.sum()
+
+
+def testSumsDontDriftOverManyLaps():
+    tracker = RewardTracker(window=10)
+    for episode in range(100000):
+        tracker.add(1e8 if episode % 2 else 1e-3, 1)
+    assert tracker.mean() == pytest.approx((1e8 + 1e-3) / 2, rel=1e-12)
+
+
+def testOnlyInfosOfEndedEpisodesAreAdded():
+    tracker = RewardTracker()
+    tracker.addInfos([{}, {'episode': {'r': 3.0, 'l': 10, 't': 1.0}}, {'terminal_observation': None}])
+    tracker.addInfos([{'episode': {'r': 5.0, 'l': 30, 't': 2.0}}])
+    assert tracker.count() == 2 and tracker.mean() == 4.0 and tracker.meanLength() == 20
+
+
+def testVecRewardTrackerFollowsTheEpisodesOfTheEnvs():
+    pytest.importorskip("stable_baselines")
+    gym = pytest.importorskip("gym")
+    from stable_baselines.common.vec_env import DummyVecEnv
+    from train_kick.VecRewardTracker import VecRewardTracker
+
+    class EpisodeEnv(gym.Env):
+        observation_space = gym.spaces.Box(-1, 1, (1,), np.float64)
+        action_space = gym.spaces.Box(-1, 1, (1,), np.float64)
+
+        def __init__(self, length):
+            self.length = length
+            self.steps = 0
+
+        def reset(self):
+            self.steps = 0
+            return np.zeros(1)
+
+        def step(self, action):
+            self.steps += 1
+            done = self.steps == self.length
+            info = {'episode': {'r': float(self.length), 'l': self.length}} if done else {}
+            return np.zeros(1), 1.0, done, info
+
+    venv = VecRewardTracker(DummyVecEnv([lambda: EpisodeEnv(2), lambda: EpisodeEnv(3)]), window=3)
+    venv.reset()
+    for step in range(6):
+        venv.step(np.zeros((2, 1)))
+    # Episodes of 2, 3, 2, 2, 3 steps ended, the window keeps the last three
+    assert venv.tracker.episodes == 5 and venv.tracker.count() == 3
+    assert venv.tracker.meanLength() == pytest.approx(7 / 3)
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+
+from train_kick.env.AsyncClient import AgentLoop
+from train_kick.env.MultiplexClient import AgentGroup
+from train_kick.env.PerceptorParser import STATE_SIZE
+from train_kick.env.Robot import NeoRobot
+from train_kick.env.StandInServer import AgentClient
+
+from test_StandInServer import startServer
+
+
+@pytest.mark.parametrize("group", [None, AgentGroup(), AgentLoop.get()], ids=["threads", "multiplex", "asyncio"])
+def testSuppressedEffectorsOfAnUnsentCommandAreNotLost(group):
+    """
+    The second action leaves lae1 out because the first one already set it,
+    both are sent in the same cycle.
+    """
+    server = startServer(cycle=0, syncMode=True)
+    robot = NeoRobot("sydney1", 1, suppressEffectors=True)
+    try:
+        assert robot.joinGame("127.0.0.1", server.port, server.mport, syncMode=True, group=group)
+        first = np.zeros(20)
+        first[0] = 0.5
+        second = first.copy()
+        second[1] = 0.2
+        robot.action(first)
+        robot.action(second)
+        assert robot.con.syncCycle()
+        speeds = server.agents[0].speeds
+        assert speeds[AgentClient.EFFECTORS['lae1']] == pytest.approx(3.5)
+        assert speeds[AgentClient.EFFECTORS['lae2']] == pytest.approx(1.4)
+    finally:
+        robot.close()
+        server.close()
+
+
+def testMalformedMessageLeavesTheStatesUntouched():
+    robot = NeoRobot("sydney1", 1)
+    robot.update("(time (now 1.00))(HJ (n hj1) (ax 1.50))(HJ (n hj2) (ax 2.00))(FRP (n lf) (c 0 0 0) (f 1 2 3))")
+    states = robot.getAllStates().copy()
+    robot.update("(time (now 1.02))(HJ (n hj1) (ax 1.5.0))(FRP (n rf) (c 0 0 0) (f 4 5 6))")
+    robot.update("(time (now 1.04))(FRP (n rf) (c 0 0 0) (f 4 5 6))")
+    assert np.array_equal(robot.getAllStates(), states)
+    assert robot.simTime == pytest.approx(1.0)
+    robot.update("(time (now 1.06))(HJ (n hj1) (ax 2.50))(HJ (n hj2) (ax 2.00))")
+    assert robot.neckYaw == pytest.approx(2.5) and robot.speedNeckYaw == pytest.approx(1.0)
+    assert robot.leftForceResistance.tolist() == [0] * 6
+
+
+def testParserMatchesTheRegexParser():
+    corpus = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "data", "perceptor.txt")
+    with open(corpus) as f:
+        messages = [line.strip() for line in f if line.strip()]
+    regexRobot = NeoRobot("sydney1", 1)
+    robot = NeoRobot("sydney1", 1)
+    bytesRobot = NeoRobot("sydney1", 1)
+    for message in messages:
+        regexRobot.updateRegex(message)
+        robot.update(message)
+        bytesRobot.update(memoryview(message.encode('ascii')))
+        assert np.allclose(robot.getAllStates(), regexRobot.getAllStates())
+        assert np.array_equal(bytesRobot.getAllStates(), robot.getAllStates())
+    out = np.empty(STATE_SIZE)
+    assert robot.getAllStates(out=out) is out and np.array_equal(out, robot.getAllStates())
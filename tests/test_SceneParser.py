@@ -0,0 +1,45 @@
+import os
+
+from train_kick.env.GrandEnvs import GrandEnvs
+from train_kick.env.SceneParser import SceneParser
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "data")
+
+
+def loadFrames(name):
+    with open(os.path.join(DATA, name)) as f:
+        return [line.strip().encode('ascii') for line in f if line.strip()]
+
+
+def testDeltasLeadToTheLocationsOfTheNextFullScene():
+    frames = loadFrames("monitor.txt")
+    deltas = loadFrames("monitor_delta.txt")
+    fullEnvs = GrandEnvs()
+    deltaEnvs = GrandEnvs()
+    deltaEnvs.updateGrandStates(frames[0])
+    # A new GrandEnvs requests the full state once
+    deltaEnvs.takeFullStateRequest()
+    for frame, delta in zip(frames[1:], deltas):
+        fullEnvs.updateGrandStates(frame)
+        deltaEnvs.updateGrandStates(memoryview(delta))
+        assert deltaEnvs.getBallLocation() == fullEnvs.getBallLocation()
+        assert (deltaEnvs.players == fullEnvs.players).all() and (deltaEnvs.valid == fullEnvs.valid).all()
+    assert deltaEnvs.sceneParser.deltas == len(deltas) and deltaEnvs.sceneParser.fullParses == 1
+    assert not deltaEnvs.takeFullStateRequest()
+
+
+def testDeltaOfAnotherLayoutIsRefused():
+    frames = loadFrames("monitor.txt")
+    delta = loadFrames("monitor_delta.txt")[0]
+    parser = SceneParser()
+    assert not parser.applyDelta(delta)
+    parser.parse(frames[0])
+    ball = parser.ball
+    assert not parser.applyDelta(delta.replace(b'(nd', b'(nd(nd))', 1))
+    assert parser.ball == ball and parser.deltas == 0
+    parser.reset()
+    assert not parser.applyDelta(delta)
+
+    grandEnvs = GrandEnvs()
+    grandEnvs.updateGrandStates(delta)
+    assert grandEnvs.takeFullStateRequest()
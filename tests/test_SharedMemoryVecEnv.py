@@ -0,0 +1,51 @@
+import gym
+import numpy as np
+import pytest
+
+pytest.importorskip("stable_baselines")
+
+from train_kick.SharedMemoryVecEnv import SharedMemoryVecEnv
+
+
+class CountingEnv(gym.Env):
+    """
+    Observes its step count, is done every 3 steps and pads its info to bigger than a pipe buffer.
+    """
+    observation_space = gym.spaces.Box(-np.inf, np.inf, (3,), np.float64)
+    action_space = gym.spaces.Box(-1, 1, (2,), np.float64)
+
+    def __init__(self, offset):
+        self.offset = offset
+        self.steps = 0
+
+    def reset(self):
+        self.steps = 0
+        return np.full(3, self.offset, dtype=np.float64)
+
+    def step(self, action):
+        self.steps += 1
+        observation = np.array([self.offset, self.steps, action.sum()])
+        info = {"simTime": 0.02 * self.steps, "missedCycles": 1}
+        if self.steps % 3 == 0:
+            info["padding"] = b"x" * 1000000
+        return observation, float(self.steps), self.steps % 3 == 0, info
+
+
+def testStepsAndResetsRoundTrip():
+    vecEnv = SharedMemoryVecEnv([lambda offset=offset: CountingEnv(offset) for offset in (10, 20)],
+                                observationSize=3, actionSize=2, timeout=10)
+    try:
+        assert vecEnv.reset()[:, 0].tolist() == [10, 20]
+        for steps in (1, 2):
+            observations, rewards, dones, infos = vecEnv.step(np.array([[0.1, 0.2], [0.3, 0.4]]))
+            assert observations.tolist() == [[10, steps, pytest.approx(0.3)], [20, steps, pytest.approx(0.7)]]
+            assert rewards.tolist() == [steps, steps] and not dones.any()
+            assert infos == [{"simTime": pytest.approx(0.02 * steps), "missedCycles": 1}] * 2
+        # The padded infos of the episode ends don't fit the pipes before the learner reads them
+        observations, rewards, dones, infos = vecEnv.step(np.zeros((2, 2)))
+        assert dones.all() and observations.tolist() == [[10, 10, 10], [20, 20, 20]]
+        assert [info["terminal_observation"].tolist() for info in infos] == [[10, 3, 0], [20, 3, 0]]
+        assert all(len(info["padding"]) == 1000000 for info in infos)
+        assert vecEnv.get_attr("steps") == [0, 0]
+    finally:
+        vecEnv.close()
@@ -0,0 +1,54 @@
+import socket
+import time
+
+from train_kick.env.MultiplexClient import AgentGroup
+from train_kick.env.Robot import NeoRobot
+from train_kick.env.StandInServer import StandInServer
+
+
+def freePort():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def startServer(**kwargs):
+    server = StandInServer(freePort(), freePort(), **kwargs)
+    server.start()
+    return server
+
+
+def testSyncJoinIsAcknowledgedWithinCycles():
+    """
+    The client sends (scene ...), (init ...) and (syn) in one frame, a sync server must step on it.
+    """
+    server = startServer(cycle=0, syncMode=True)
+    robot = NeoRobot("sydney1", 1)
+    try:
+        begin = time.time()
+        joined = robot.joinGame("127.0.0.1", server.port, server.mport, syncMode=True, timeout=10)
+        elapsed = time.time() - begin
+        assert joined
+        assert elapsed < 2, "sync join took " + str(round(elapsed, 3)) + "s"
+        assert ("Left", 1) in server.players
+    finally:
+        robot.con.close()
+        server.close()
+
+
+def testSyncJoinOfAGroupDoesNotStallTheJoinedRobots():
+    """
+    A robot joins while the robots of its AgentGroup already step, all (syn) are sent in one batch.
+    """
+    server = startServer(cycle=0, syncMode=True)
+    group = AgentGroup()
+    try:
+        for unum in (1, 2, 3):
+            robot = NeoRobot("sydney1", unum)
+            begin = time.time()
+            assert robot.joinGame("127.0.0.1", server.port, server.mport, syncMode=True, group=group, timeout=10)
+            assert time.time() - begin < 2
+        assert len(server.players) == 3
+    finally:
+        group.close()
+        server.close()
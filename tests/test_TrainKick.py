@@ -0,0 +1,33 @@
+import time
+
+import pytest
+
+from train_kick.TrainKick import TrainKick
+from train_kick.env.MultiplexClient import AgentGroup
+
+from test_StandInServer import startServer
+
+
+def waitFor(condition, timeout=2.0):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.mark.parametrize("group", [None, AgentGroup()], ids=["threads", "multiplex"])
+def testTrainerResetPlacesBallWhenPoseIsAlreadyReached(group):
+    """
+    The final move of the reset is queued in the same cycle as the move with the ball,
+    both must reach the server.
+    """
+    server = startServer(cycle=0, syncMode=True)
+    env = TrainKick(1, "127.0.0.1", server.port, server.mport, "sydney1", 1, 1, 1, 0, 10, 'kick',
+                    syncMode=True, group=group, resetMode='trainer')
+    try:
+        env.controller.reached = lambda joints, pose: True
+        env.reset()
+        assert waitFor(lambda: server.ball.location == tuple(env.init_ball_location)), server.ball.location
+    finally:
+        env.close()
+        server.close()
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("stable_baselines")
+
+from train_kick.TrainKick import TrainKick
+from train_kick.TrainKickVecEnv import TrainKickVecEnv
+
+from test_StandInServer import startServer
+
+
+def testTrainerResetsOfDoneEnvsShareTheirCycles():
+    server = startServer(cycle=0, syncMode=True)
+    envFns = [lambda group, unum=unum: TrainKick(unum, "127.0.0.1", server.port, server.mport, "sydney1", unum,
+                                                 unum, 1, 0, 3, 'kick', syncMode=True, group=group,
+                                                 resetMode='trainer')
+              for unum in (1, 2, 3)]
+    vecEnv = TrainKickVecEnv(envFns)
+    try:
+        vecEnv.reset()
+        dones = np.zeros(3, dtype=bool)
+        while not dones.any():
+            cycles = server.cycles
+            vecEnv.step_async(np.full((3, 20), 0.3))
+            observations, rewards, dones, infos = vecEnv.step_wait()
+        assert dones.all()
+        # One cycle of the step, then the resets servo together and stand still in one more cycle
+        assert server.cycles - cycles == 2 + max(env.resetCount for env in vecEnv.envs)
+        assert not any(env.resetting for env in vecEnv.envs)
+    finally:
+        vecEnv.close()
+        server.close()
@@ -0,0 +1,35 @@
+import pytest
+
+from train_kick.env.AsyncClient import AgentLoop
+from train_kick.env.Logger import Logger
+from train_kick.env.MultiplexClient import AgentGroup
+from train_kick.env.Robot import NeoRobot
+from train_kick.env.Watchdog import MIN_BACKOFF, Watchdog, backoffDelay, connectWithBackoff
+
+from test_StandInServer import freePort
+
+
+def testBackoffDoublesUpToTheMaximum():
+    assert [backoffDelay(failures) for failures in range(1, 7)] == [0.5, 1, 2, 4, 8, 8]
+    watchdog = Watchdog()
+    assert [watchdog.failed() for i in range(6)] == [backoffDelay(failures) for failures in range(1, 7)]
+
+
+def testConnectWithBackoffGivesUpAfterRetries(monkeypatch):
+    sleeps = []
+    cleanups = []
+    monkeypatch.setattr("train_kick.env.Watchdog.time.sleep", sleeps.append)
+
+    def refuse():
+        raise ConnectionRefusedError()
+
+    assert not connectWithBackoff(refuse, lambda: cleanups.append(1), 3, Logger.getLogger("test"), "nowhere:0")
+    assert sleeps == [MIN_BACKOFF, 2 * MIN_BACKOFF]
+    assert len(cleanups) == 3
+
+
+@pytest.mark.parametrize("group", [None, AgentGroup(), AgentLoop.get()], ids=["threads", "multiplex", "asyncio"])
+def testTransportsGiveUpOnARefusedPort(group, monkeypatch):
+    monkeypatch.setattr("train_kick.env.Watchdog.time.sleep", lambda delay: None)
+    robot = NeoRobot("sydney1", 1)
+    assert not robot.joinGame("127.0.0.1", freePort(), freePort(), syncMode=True, group=group, retries=2)
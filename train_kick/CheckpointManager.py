@@ -0,0 +1,150 @@
+import atexit
+import copy
+import os
+import pickle
+import queue
+import threading
+
+from train_kick.env.Logger import Logger
+
+
+class CheckpointManager:
+    """
+    Saves checkpoints of a stable-baselines model without blocking the learner.
+    save() only snapshots the parameters(model.get_parameters(), called by model.save) and the
+    VecNormalize statistics in memory, a background thread serializes them to a temporary file
+    and renames it, so a crash never leaves a half written checkpoint.
+
+    Periodic checkpoints(score None) keep the last keepLast, scored checkpoints keep the
+    keepBest with the highest score, older or worse ones are deleted with their statistics.
+    The statistics of name.pkl are written to name.vecnormalize.pkl, see loadNormalization().
+    """
+    logger = Logger.getLogger("CheckpointManager")
+    NORMALIZATION_SUFFIX = ".vecnormalize.pkl"
+
+    def __init__(self, directory, keepLast=3, keepBest=3, maxPending=2):
+        self.directory = directory
+        self.keepLast = keepLast
+        self.keepBest = keepBest
+        os.makedirs(directory, exist_ok=True)
+        self.periodic = []
+        self.best = []
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxPending)
+        self.writer = threading.Thread(target=self.__write, name="CheckpointWriter", daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def path(self, name):
+        return os.path.join(self.directory, name + ".pkl")
+
+    def save(self, model, name, score=None, normalizer=None):
+        """
+        Snapshot model and the statistics of normalizer(VecNormalize) and queue them for writing.
+        If maxPending snapshots are still waiting, this blocks until one is written.
+        """
+        data, params = self.__snapshot(model)
+        statistics = None
+        if normalizer is not None:
+            statistics = {"obs_rms": copy.deepcopy(normalizer.obs_rms), "ret_rms": copy.deepcopy(normalizer.ret_rms)}
+        self.queue.put((type(model), name, score, data, params, statistics))
+
+    @staticmethod
+    def __snapshot(model):
+        """
+        model.save() gathers the parameters and hyperparameters and hands them to _save_to_file,
+        which is intercepted to keep them in memory instead of pickling them here.
+        """
+        snapshot = {}
+
+        def capture(save_path, data=None, params=None, cloudpickle=False):
+            snapshot["data"] = data
+            snapshot["params"] = params
+
+        model._save_to_file = capture
+        try:
+            model.save("snapshot")
+        finally:
+            del model._save_to_file
+        return snapshot["data"], snapshot["params"]
+
+    def __write(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self.__writeCheckpoint(*item)
+            except Exception as e:
+                self.logger.error("checkpoint " + str(item[1]) + " failed " + repr(e))
+            finally:
+                self.queue.task_done()
+
+    def __writeCheckpoint(self, modelClass, name, score, data, params, statistics):
+        path = self.path(name)
+        """
+        The temporary name keeps an extension, or stable-baselines would append .zip
+        """
+        temporary = path + ".tmp"
+        modelClass._save_to_file(temporary, data=data, params=params)
+        os.replace(temporary, path)
+        if statistics is not None:
+            with open(temporary, "wb") as f:
+                pickle.dump(statistics, f)
+            os.replace(temporary, os.path.join(self.directory, name + self.NORMALIZATION_SUFFIX))
+        self.logger.info("saved checkpoint " + path + ("" if score is None else " score:" + str(score)))
+        self.__retain(name, score)
+
+    def __retain(self, name, score):
+        with self.lock:
+            if score is None:
+                if name in self.periodic:
+                    self.periodic.remove(name)
+                self.periodic.append(name)
+                expired = self.periodic[:-self.keepLast] if self.keepLast > 0 else list(self.periodic)
+                self.periodic = self.periodic[len(expired):]
+            else:
+                self.best = [entry for entry in self.best if entry[1] != name]
+                self.best.append((score, name))
+                self.best.sort(reverse=True)
+                expired = [entry[1] for entry in self.best[self.keepBest:]]
+                self.best = self.best[:self.keepBest]
+            kept = set(self.periodic) | set(entry[1] for entry in self.best)
+        for name in expired:
+            if name not in kept:
+                self.__remove(name)
+
+    def __remove(self, name):
+        for path in (self.path(name), os.path.join(self.directory, name + self.NORMALIZATION_SUFFIX)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.logger.info("removed checkpoint " + self.path(name))
+
+    def wait(self):
+        """
+        Block until all queued checkpoints are written.
+        """
+        self.queue.join()
+
+    def close(self):
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+
+    @classmethod
+    def loadNormalization(cls, path, normalizer):
+        """
+        Restore the statistics of the checkpoint path(name.pkl) into normalizer(VecNormalize).
+        Return False if the checkpoint has none.
+        """
+        statistics = path[:-len(".pkl")] + cls.NORMALIZATION_SUFFIX if path.endswith(".pkl") else \
+            path + cls.NORMALIZATION_SUFFIX
+        if not os.path.exists(statistics):
+            return False
+        with open(statistics, "rb") as f:
+            saved = pickle.load(f)
+        normalizer.obs_rms = saved["obs_rms"]
+        normalizer.ret_rms = saved["ret_rms"]
+        return True
@@ -0,0 +1,245 @@
+import multiprocessing
+
+import numpy as np
+from stable_baselines.common.vec_env import VecEnv
+from stable_baselines.common.vec_env.base_vec_env import CloudpickleWrapper
+
+from train_kick.env.Logger import Logger
+from train_kick.env.PerceptorParser import STATE_SIZE
+
+"""
+Commands of the learner to the workers, in the shared command slot.
+"""
+STEP = 0
+PIPE = 1
+CLOSE = 2
+"""
+Step infos of TrainKick which are passed in the shared info array instead of the pipe.
+"""
+SHARED_INFO_KEYS = ("observationAge", "simTime", "gameTime", "missedCycles")
+INT_INFO_KEYS = ("missedCycles",)
+
+
+def stepWorker(index, remote, parentRemote, envFn, arrays, start, done):
+    """
+    Step one env on the shared arrays. When its start semaphore is released the worker reads the command slot:
+    STEP reads its action row, steps and writes observation, reward, done and the shared infos in place.
+    The rest of the info dict(episode, terminal_observation, ...) and errors are sent through the pipe,
+    flagged in hasInfo, after the done semaphore is released.
+    PIPE handles the command in the pipe if there is one, like SubprocVecEnv.
+    Both release the done semaphore, so the learner only changes the command after every worker read it.
+    CLOSE ends the worker.
+    """
+    parentRemote.close()
+    command, actions, observations, rewards, dones, infos, hasInfo = sharedViews(arrays)
+    env = envFn.var()
+    remote.send((env.observation_space, env.action_space))
+    while True:
+        start.acquire()
+        if command[0] == CLOSE:
+            env.close()
+            remote.close()
+            return
+        if command[0] == PIPE:
+            if remote.poll():
+                handlePipeCommand(env, remote, observations[index])
+            done.release()
+            continue
+
+        try:
+            observation, reward, isDone, info = env.step(actions[index])
+            if isDone:
+                info['terminal_observation'] = observation
+                observation = env.reset()
+            observations[index] = observation
+            rewards[index] = reward
+            dones[index] = isDone
+            for column, key in enumerate(SHARED_INFO_KEYS):
+                infos[index, column] = info.pop(key, np.nan)
+            hasInfo[index] = len(info) > 0
+            message = info
+        except Exception as e:
+            hasInfo[index] = True
+            message = e
+        # The learner only reads the pipes after all workers are done, a large info would block the send before
+        done.release()
+        if hasInfo[index]:
+            remote.send(message)
+
+
+def handlePipeCommand(env, remote, observation):
+    cmd, data = remote.recv()
+    try:
+        if cmd == 'reset':
+            observation[:] = env.reset()
+            remote.send(None)
+        elif cmd == 'get_attr':
+            remote.send(getattr(env, data))
+        elif cmd == 'set_attr':
+            remote.send(setattr(env, data[0], data[1]))
+        elif cmd == 'env_method':
+            method = getattr(env, data[0])
+            remote.send(method(*data[1], **data[2]))
+        else:
+            raise NotImplementedError("unknown command " + str(cmd))
+    except Exception as e:
+        remote.send(e)
+
+
+def sharedArrays(numEnvs, observationSize, actionSize, context):
+    """
+    Unlocked shared arrays, every row is only written by its worker or by the learner between barriers.
+    """
+    return (context.RawArray('i', 1), context.RawArray('d', numEnvs * actionSize),
+            context.RawArray('d', numEnvs * observationSize), context.RawArray('d', numEnvs),
+            context.RawArray('b', numEnvs), context.RawArray('d', numEnvs * len(SHARED_INFO_KEYS)),
+            context.RawArray('b', numEnvs), numEnvs, observationSize, actionSize)
+
+
+def sharedViews(arrays):
+    command, actions, observations, rewards, dones, infos, hasInfo, numEnvs, observationSize, actionSize = arrays
+    return (np.frombuffer(command, dtype=np.int32),
+            np.frombuffer(actions).reshape(numEnvs, actionSize),
+            np.frombuffer(observations).reshape(numEnvs, observationSize),
+            np.frombuffer(rewards),
+            np.frombuffer(dones, dtype=np.int8).view(bool),
+            np.frombuffer(infos).reshape(numEnvs, len(SHARED_INFO_KEYS)),
+            np.frombuffer(hasInfo, dtype=np.int8).view(bool))
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """
+    SubprocVecEnv for TrainKick which exchanges the steps through shared memory instead of pipes.
+    The (N, obs) observations, (N,) rewards and dones, (N, 20) actions and the float step infos
+    are preallocated shared arrays which the workers write in place. The learner and the workers
+    meet like at a barrier, but on semaphores, which are cheaper than multiprocessing.Barrier:
+    the learner writes the actions and releases the start semaphore of every worker, every worker
+    steps and releases the done semaphore, which the learner acquires N times.
+    Nothing is pickled unless an env has an exceptional info, e.g. an episode end.
+    Like SubprocVecEnv every worker runs one env and resets it when it is done.
+    """
+    logger = Logger.getLogger("SharedMemoryVecEnv")
+
+    def __init__(self, env_fns, start_method=None, observationSize=STATE_SIZE, actionSize=20, timeout=60):
+        self.timeout = timeout
+        self.waiting = False
+        self.closed = False
+        numEnvs = len(env_fns)
+        if start_method is None:
+            forkserver = 'forkserver' in multiprocessing.get_all_start_methods()
+            start_method = 'forkserver' if forkserver else 'spawn'
+        context = multiprocessing.get_context(start_method)
+
+        arrays = sharedArrays(numEnvs, observationSize, actionSize, context)
+        self.command, self.actions, self.observations, self.rewards, self.dones, self.infos, self.hasInfo = \
+            sharedViews(arrays)
+        self.starts = [context.Semaphore(0) for _ in range(numEnvs)]
+        self.done = context.Semaphore(0)
+        self.remotes, self.workRemotes = zip(*[context.Pipe() for _ in range(numEnvs)])
+        self.processes = []
+        for index, (workRemote, remote, envFn) in enumerate(zip(self.workRemotes, self.remotes, env_fns)):
+            args = (index, workRemote, remote, CloudpickleWrapper(envFn), arrays, self.starts[index], self.done)
+            process = context.Process(target=stepWorker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            workRemote.close()
+
+        spaces = [remote.recv() for remote in self.remotes]
+        observation_space, action_space = spaces[0]
+        if observation_space.shape != (observationSize,) or action_space.shape != (actionSize,):
+            raise ValueError("spaces " + str(observation_space.shape) + " " + str(action_space.shape) +
+                             " don't fit the shared arrays " + str((observationSize, actionSize)))
+        VecEnv.__init__(self, numEnvs, observation_space, action_space)
+
+    def __start(self, command):
+        self.command[0] = command
+        for start in self.starts:
+            start.release()
+
+    def __waitDone(self):
+        for i in range(self.num_envs):
+            if not self.done.acquire(timeout=self.timeout):
+                dead = [i for i, process in enumerate(self.processes) if not process.is_alive()]
+                raise RuntimeError("workers didn't finish in " + str(self.timeout) + "s, dead workers:" + str(dead))
+
+    def __pipeCommand(self, indices, cmd, data=None):
+        """
+        Send cmd to the workers of indices through their pipes and return their answers.
+        """
+        indices = self._get_indices(indices)
+        for i in indices:
+            self.remotes[i].send((cmd, data))
+        self.__start(PIPE)
+        results = [self.remotes[i].recv() for i in indices]
+        # Every worker has read the command before the next one is set
+        self.__waitDone()
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def step_async(self, actions):
+        self.actions[:] = actions
+        self.__start(STEP)
+        self.waiting = True
+
+    def step_wait(self):
+        self.__waitDone()
+        self.waiting = False
+        infos = []
+        error = None
+        for i in range(self.num_envs):
+            info = {key: value for key, value in zip(SHARED_INFO_KEYS, self.infos[i].tolist()) if value == value}
+            for key in INT_INFO_KEYS:
+                if key in info:
+                    info[key] = int(info[key])
+            if self.hasInfo[i]:
+                # All pipes are read before an error is raised, so none is left with a stale info
+                extra = self.remotes[i].recv()
+                if isinstance(extra, Exception):
+                    error = error or extra
+                else:
+                    info.update(extra)
+            infos.append(info)
+        if error is not None:
+            raise error
+        return self.observations.copy(), self.rewards.copy(), self.dones.copy(), infos
+
+    def reset(self):
+        self.__pipeCommand(None, 'reset')
+        return self.observations.copy()
+
+    def close(self):
+        if self.closed:
+            return
+        if self.waiting:
+            self.__waitDone()
+        self.__start(CLOSE)
+        for process in self.processes:
+            process.join(self.timeout)
+            if process.is_alive():
+                process.terminate()
+        self.closed = True
+
+    def get_attr(self, attr_name, indices=None):
+        return self.__pipeCommand(indices, 'get_attr', attr_name)
+
+    def set_attr(self, attr_name, value, indices=None):
+        self.__pipeCommand(indices, 'set_attr', (attr_name, value))
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self.__pipeCommand(indices, 'env_method', (method_name, method_args, method_kwargs))
+
+    def get_images(self):
+        return self.env_method('render', 'rgb_array')
+
+    def seed(self, seed=None):
+        return [self.env_method('seed', seed + i if seed is not None else None, indices=i)[0]
+                for i in range(self.num_envs)]
+
+    def _get_indices(self, indices):
+        if indices is None:
+            indices = range(self.num_envs)
+        elif isinstance(indices, int):
+            indices = [indices]
+        return indices
@@ -1,6 +1,7 @@
 import gym
 from gym import spaces
 import numpy as np
+import threading
 import time
 
 from train_kick.env.Robot import NeoRobot
@@ -8,6 +9,10 @@ from train_kick.env.Logger import Logger
 from train_kick.env.GrandEnvs import GrandEnvs
 from train_kick.env.GrandEnvs import NotFoundPlayerException
 from train_kick.env.TCPClient import AgentConnection
+from train_kick.env.Watchdog import Watchdog
+from train_kick.env.JointController import JointController, actionJoints
+from train_kick.env.Metrics import Metrics
+from train_kick.env.StreamLog import StreamRecorder
 
 
 class TrainKick(gym.Env):
@@ -15,11 +20,26 @@ class TrainKick(gym.Env):
     logger = Logger.getLogger("TrainKick")
     metadata = {'render.modes': ['human']}
     trainTypes = {'standup', 'kick'}
+    resetModes = {'servo', 'trainer'}
     STEPWAIT = 1
     RESETSTEP = 30
+    """
+    Seconds to wait for the perceptor message of a step
+    """
+    WAIT_TIMEOUT = 1.0
+    """
+    Pose preset of the JointController at the beginning of every episode
+    """
+    RESET_POSE = 'stand'
+    """
+    The torso is moved a little above its standing height, then the robot drops onto its feet.
+    """
+    RESET_HEIGHT = 0.4
 
     def __init__(self, env_id=1, serverIp="192.168.0.16", serverPort=3100, monitorPort=3200, team="sydney1",
-                 playerNumber=0, locationX=10, locationY=10, sleep_time=1, max_episode_steps=200, trainType='kick'):
+                 playerNumber=0, locationX=10, locationY=10, sleep_time=0, max_episode_steps=200, trainType='kick',
+                 syncMode=False, group=None, sharedMonitor=False, latestOnly=False, suppressEffectors=False,
+                 resetMode='servo', metricsDir=None, recordDir=None):
         super(TrainKick, self).__init__()
         self.env_id = env_id
         self.sum_rewards = 0
@@ -33,15 +53,90 @@ class TrainKick(gym.Env):
         self.playerNumber = playerNumber
         self.max_episode_steps = max_episode_steps
         self.trainType = trainType
+        """
+        syncMode needs simspark running in agent sync mode($agentSyncMode = true in spark.rb),
+        then every step waits for the perceptor message of its cycle instead of sleeping.
+        """
+        self.syncMode = syncMode
+        """
+        group(AgentGroup) lets many envs share one selector in one process, see TrainKickVecEnv,
+        group(AgentLoop) serves the connection by the asyncio loop of the process instead of threads.
+        """
+        self.group = group
+        """
+        sharedMonitor reads the locations from the MonitorFeed of the server, which must be started before.
+        """
+        self.sharedMonitor = sharedMonitor
+        """
+        latestOnly skips the perceptor messages which are outdated by a newer one when the robot lags,
+        see robot.con.skippedFrames and robot.con.observationAge().
+        """
+        self.latestOnly = latestOnly
+        """
+        suppressEffectors only sends the effectors whose speed changed, see ActionEncoder.
+        """
+        self.suppressEffectors = suppressEffectors
+        """
+        resetMode 'servo' spends the first RESETSTEP steps of every episode on beaming and servoing the robot.
+        resetMode 'trainer' resets in reset() by trainer commands on the monitor connection,
+        which moves the robot upright and places the ball at once, then it only waits until the pose is reached.
+        """
+        if resetMode not in self.resetModes:
+            self.logger.error("reset mode error!!!")
+            exit(1)
+        if resetMode == 'trainer' and sharedMonitor:
+            self.logger.warning("trainer reset needs an own monitor connection, use servo reset")
+            resetMode = 'servo'
+        self.resetMode = resetMode
+        self.resetSteps = self.RESETSTEP if resetMode == 'servo' else 0
+        """
+        metricsDir enables the latency histograms of the process, see Metrics.
+        """
+        if metricsDir is not None:
+            Metrics.startExport(metricsDir)
+        """
+        recordDir records the received perceptor and monitor frames of every actor, see StreamRecorder.
+        """
+        if recordDir is not None:
+            StreamRecorder.startRecording(recordDir)
+        """
+        The watchdog detects dead or silent connections after every step, then the episode is
+        truncated and the robot is reconnected in the background while the other actors keep stepping.
+        """
+        self.watchdog = Watchdog()
+        self.reconnecting = False
+        self.reconnectThread = None
         self.rewards_list = []
-        self.robot = NeoRobot(self.team, self.playerNumber, self.env_id, self.locationX, self.locationY)
+        self.controller = JointController()
+        self.pendingAction = None
+        """
+        resetting is True while a trainer reset is servoing the joints, see beginTrainerReset.
+        """
+        self.resetting = False
+        self.resetCount = 0
+        """
+        Simulation time of the last observation, the next step waits for the cycles after it.
+        missedCycles are the cycles the last step lagged behind the simulation.
+        """
+        self.observedSimTime = -1
+        self.missedCycles = 0
+        self.robot = NeoRobot(self.team, self.playerNumber, self.env_id, self.locationX, self.locationY,
+                              suppressEffectors=self.suppressEffectors)
+        """
+        The join waits for the acknowledgements of the server, so the actors can join at once,
+        sleep_time only staggers them.
+        """
         time.sleep(sleep_time)
-        self.robot.joinGame(self.serverIp, self.serverPort, self.monitorPort)
+        if not self.robot.joinGame(self.serverIp, self.serverPort, self.monitorPort, self.syncMode, self.group,
+                                   self.sharedMonitor, self.latestOnly):
+            self.logger.error(self.robot.name + " joined without all acknowledgements")
         self.init_ball_location = self.set_ball_nearby()
         action_dim = 20
         high = np.ones([action_dim])
         self.action_space = spaces.Box(-high, high, dtype=np.float64)
-        high = 10 * np.ones(len(self.robot.getAllStates()))
+        self.resetStates = self.robot.getAllStates()
+        self.lastStates = self.resetStates.copy()
+        high = 10 * np.ones(len(self.resetStates))
         self.observation_space = spaces.Box(-high, high, dtype=np.float64)
         self.frame = 0
         self.done = False
@@ -55,27 +150,130 @@ class TrainKick(gym.Env):
         self.monitorLastTime = -1
 
     def step(self, actionParameters):
+        if self.reconnecting:
+            self.pollReconnect()
+            if self.reconnecting:
+                time.sleep(0.02 * TrainKick.STEPWAIT)
+                return self.lastStates.copy(), 0, True, {"TimeLimit.truncated": True, "reconnecting": True}
+        reward = 0
+        if self.applyAction(actionParameters):
+            reward = self.reward()
+        self.wait(since=self.observedSimTime)
+        if not self.checkConnection():
+            return self.lastStates.copy(), reward, True, {"TimeLimit.truncated": True, "reconnecting": True}
+        states = self.observe()
+        return states, reward, self.done, self.stepInfo()
+
+    def applyAction(self, actionParameters, batched=False):
+        """
+        First half of step() before waiting for the next cycle.
+        Return True if the action was applied, False during the reset frames.
+        If batched, the joint action(or None) is left in pendingAction for the caller,
+        which sends the actions of many robots at once, see NeoRobot.actionBatch.
+        """
         self.frame += 1
         if self.frame >= self.max_episode_steps:
             self.episode_over()
-        reward = 0
-        if self.frame > self.RESETSTEP:
-            self.robot.action(actionParameters)
-            reward = self.__reward()
+        action = None
+        learning = self.frame > self.resetSteps
+        if learning:
+            action = actionParameters
         elif self.frame == self.RESETSTEP - 12:
             self.__sendResetCommand()
         else:
-            states = self.robot.getAllStates(1)
-            self.__resetAction(states)
-        self.wait()
-        states = self.robot.getAllStates(1)
+            action = self.__resetAction(self.robot.getAllStates(1, self.resetStates))
+        if batched:
+            self.pendingAction = action
+        elif action is not None:
+            self.robot.action(action)
+        return learning
+
+    def observe(self, out=None):
+        """
+        Second half of step() after waiting for the next cycle.
+        """
+        states = self.robot.getAllStates(1, out)
         if np.any(np.isnan(states)):
             self.logger.error("There is a Nan in states. " + str(states))
-        return states, reward, self.done, {}
+        self.lastStates[:] = states
+        simTime = self.robot.simTime
+        if self.observedSimTime >= 0 and simTime >= self.observedSimTime:
+            self.missedCycles = max(0, round((simTime - self.observedSimTime) / NeoRobot.CYCLE) - self.STEPWAIT)
+        self.observedSimTime = simTime
+        return states
+
+    def stepInfo(self):
+        """
+        observationAge: seconds since the perceptor message of the observation was received.
+        missedCycles: cycles the step lagged behind the simulation, the observation is that much newer
+        than the cycle the action was meant for.
+        """
+        return {"observationAge": self.robot.con.observationAge(), "simTime": self.robot.simTime,
+                "gameTime": self.robot.gameTime, "missedCycles": self.missedCycles}
+
+    def checkConnection(self):
+        """
+        Check the connection after waiting for the cycle.
+        Return False if it is dead, silent or being reconnected, then the episode is over.
+        """
+        if self.reconnecting:
+            return False
+        if self.watchdog.isHealthy(self.robot.con):
+            return True
+        self.logger.error(self.robot.name + " connection is unhealthy")
+        self.__reconnect()
+        return False
+
+    def __reconnect(self):
+        """
+        Close the robot and join a new one, in a background thread with backoff
+        or by pollReconnect() if the group must not be used from another thread.
+        """
+        self.episode_over()
+        if self.reconnecting:
+            return
+        self.reconnecting = True
+        self.robot.close()
+        if getattr(self.group, 'threadSafe', True):
+            self.reconnectThread = threading.Thread(target=self.__reconnectLoop,
+                                                    name=self.robot.name + "_reconnect", daemon=True)
+            self.reconnectThread.start()
+
+    def pollReconnect(self):
+        """
+        Try to reconnect in the calling thread if no background thread does and the backoff is over.
+        """
+        if self.reconnecting and self.reconnectThread is None and self.watchdog.due():
+            self.__tryReconnect()
+
+    def __reconnectLoop(self):
+        while not self.__tryReconnect():
+            time.sleep(max(0, self.watchdog.nextAttempt - time.time()))
+        self.reconnectThread = None
+
+    def __tryReconnect(self):
+        robot = NeoRobot(self.team, self.playerNumber, self.env_id, self.locationX, self.locationY,
+                         suppressEffectors=self.suppressEffectors)
+        if robot.joinGame(self.serverIp, self.serverPort, self.monitorPort, self.syncMode, self.group,
+                          self.sharedMonitor, self.latestOnly, timeout=1, retries=1):
+            self.robot = robot
+            self.observedSimTime = -1
+            self.init_ball_location = self.set_ball_nearby()
+            self.watchdog.succeeded()
+            self.logger.info(robot.name + " reconnected, reconnects:" + str(self.watchdog.reconnects))
+            self.reconnecting = False
+            return True
+        robot.close()
+        delay = self.watchdog.failed()
+        self.logger.error(robot.name + " reconnect failed, next attempt in " + str(delay) + "s")
+        return False
+
+    def ball_nearby(self):
+        return [self.locationX + 0.1, self.locationY + 0.1, 0]
 
     def set_ball_nearby(self):
         print("set ball near the robot")
-        ball_loc = [self.locationX + 0.1, self.locationY + 0.1, 0]
+        ball_loc = self.ball_nearby()
         self.robot.con.sendMessage("(ball (pos " + str(ball_loc[0])+" "+str(ball_loc[1])+" "+str(ball_loc[2])+")(vel 0 0 0))")
         return ball_loc
 
@@ -93,7 +291,7 @@ class TrainKick(gym.Env):
                 location = self.robot.grandEnvs.getPlayerLocation(team, self.playerNumber)
             except NotFoundPlayerException as e:
                 self.logger.exception("NotFoundPlayerException" + repr(e))
-                self.__rebootRobot()
+                self.__reconnect()
                 return None
             if location is not None:
                 return location
@@ -102,26 +300,23 @@ class TrainKick(gym.Env):
         else:
             return None
 
-    def __rebootRobot(self):
-        self.robot.close()
-        self.episode_over()
-
-        time.sleep(10)
-        self.robot = NeoRobot(self.team, self.playerNumber, self.env_id)
-        self.robot.joinGame(self.serverIp, self.serverPort, self.monitorPort)
-        self.init_ball_location = self.set_ball_nearby()
-
-    def __reward(self):
+    def reward(self):
         if self.trainType not in self.trainTypes:
             self.logger.error("train type error!!!")
             exit(1)
 
-        live_reward = self.__liveReward()
         if self.trainType == 'kick':
             action_reward = self.__rewardKick()
         elif self.trainType == 'standup':
             action_reward = self.__rewardStandUp()
 
+        return self.addReward(action_reward)
+
+    def addReward(self, action_reward):
+        """
+        Add the live reward to action_reward and count it into the episode.
+        """
+        live_reward = self.__liveReward()
         reward = live_reward + action_reward
         self.sum_action_rewards += action_reward
         self.sum_rewards += reward
@@ -136,11 +331,15 @@ class TrainKick(gym.Env):
         return reward
 
     def __rewardKick(self):
-        if np.sum(self.robot.grandEnvs.getBallLocation()) - np.sum(self.init_ball_location) > 0.1:
-            reward = np.sum(self.robot.grandEnvs.getBallLocation()) - np.sum(self.init_ball_location)
-        else:
-            reward = -1
-        return reward
+        return float(self.kickRewards(self.robot.grandEnvs.getBallLocation(), self.init_ball_location))
+
+    @staticmethod
+    def kickRewards(ballLocations, initBallLocations):
+        """
+        Kick rewards of a batch of robots, the locations are (N, 3) or (3,) arrays.
+        """
+        distance = np.sum(ballLocations, axis=-1) - np.sum(initBallLocations, axis=-1)
+        return np.where(distance > 0.1, distance, -1)
 
     def __rewaredStandUp(self):
         height = self.__getRobotHeight()
@@ -161,7 +360,11 @@ class TrainKick(gym.Env):
             reward += 1
         return reward
 
-    def reset(self):
+    def reset(self, batched=False):
+        """
+        If batched, a trainer reset is only begun and the caller runs its cycles
+        together with those of other robots, see TrainKickVecEnv.
+        """
         self.frame = 0
         self.epstart = False
         self.done = False
@@ -176,6 +379,16 @@ class TrainKick(gym.Env):
         self.lastWalkTime = 0
         self.lastWalkPlace = None
         self.twolegs = 1
+        if self.reconnecting:
+            self.pollReconnect()
+            if self.reconnecting:
+                return self.lastStates.copy()
+        if self.resetMode == 'trainer':
+            if batched:
+                self.beginTrainerReset()
+                return None
+            self.__trainerReset()
+            return self.observe()
         self.init_ball_location = self.set_ball_nearby()
         if self.RESETSTEP < 2:
             self.__doReset()
@@ -185,70 +398,124 @@ class TrainKick(gym.Env):
         states = self.robot.getAllStates(1)
         if np.any(np.isnan(states)):
             self.logger.error("There is a Nan in states. "+ str(states))
+        self.observedSimTime = self.robot.simTime
         return states
 
     def __doReset(self):
-        states = self.robot.getAllStates()
+        states = self.robot.getAllStates(0, self.resetStates)
         count = 0
-        while self.__checkResetAction(states) and count < 100:
-            self.__resetAction(states)
+        while not self.__poseReached(states) and count < 100:
+            self.robot.action(self.__resetAction(states))
             self.wait()
-            states = self.robot.getAllStates()
+            states = self.robot.getAllStates(0, self.resetStates)
             count += 1
         actionParameters = np.zeros(20)
         self.robot.action(actionParameters)
         self.wait()
         self.logger.debug("reset count:" + str(count))
 
+    def __trainerReset(self):
+        self.beginTrainerReset()
+        while self.resetting:
+            self.robot.action(self.trainerResetAction())
+            self.wait()
+
+    def beginTrainerReset(self):
+        """
+        One cycle sends the trainer commands, which move the robot upright to its location
+        and the ball next to it, together with the first joint command towards RESET_POSE.
+        The joints are servoed until they are within the tolerance of the JointController, at most RESETSTEP cycles,
+        then the robot is moved again to stand still at its location.
+        Every cycle of the reset sends trainerResetAction() until resetting is False.
+        Trainer commands are appended to the pending monitor message, if the pose was already reached
+        the final move is sent together with the ball in the same cycle.
+        """
+        self.resetMove = self.__moveCommand()
+        self.init_ball_location = self.ball_nearby()
+        self.robot.con.sendMonitorMessage(self.resetMove + "(ball (pos " +
+                                          " ".join(str(v) for v in self.init_ball_location) + ")(vel 0 0 0))")
+        self.resetCount = 0
+        self.resetting = True
+        self.observedSimTime = -1
+
+    def trainerResetAction(self):
+        """
+        Joint action of the next cycle of the trainer reset.
+        The last one stands still and queues the final move, which ends the reset after its cycle.
+        """
+        states = self.robot.getAllStates(0, self.resetStates)
+        if self.resetCount < self.RESETSTEP and not self.__poseReached(states):
+            self.resetCount += 1
+            return self.__resetAction(states)
+        self.robot.con.sendMonitorMessage(self.resetMove)
+        self.resetting = False
+        self.logger.debug("trainer reset count:" + str(self.resetCount))
+        return np.zeros(20)
+
+    def __moveCommand(self):
+        if self.robot.team == 'sydney1':
+            side = 'Left'
+        else:
+            side = 'Right'
+        return ("(agent (unum " + str(self.playerNumber) + ")(team " + side + ")(move " + str(self.locationX) + " " +
+                str(self.locationY) + " " + str(self.RESET_HEIGHT) + " 0))")
+
+    def __poseReached(self, states):
+        return bool(self.controller.reached(actionJoints(states), self.RESET_POSE))
+
     def __sendResetCommand(self):
         self.robot.con.sendMessage("(beam " + str(self.locationX) + " " + str(self.locationY) + " 0.0)")
         self.init_ball_location = self.set_ball_nearby()
 
-    def __checkResetAction(self, states):
-        def __checkResetAction(self, states):
-            for i in range(20):
-                pstate = states[i + 8]
-                if (i == 0 or i == 16) and (pstate < -95 or pstate > -85):
-                    # print(str(i) + "pstate" + str(pstate))
-                    return True
-                elif (i == 6 or i == 12) and (pstate < -1.84 or pstate > 4.84):
-                    # print(str(i) + "pstate" + str(pstate))
-                    return True
-                elif i != 6 and i != 12 and i != 0 and i != 16 and (pstate > 3 or pstate < -3):
-                    # print(str(i) + "pstate" + str(pstate))
-                    return True
-            return False
-
     def __resetAction(self, states):
-        actionParameters = np.zeros(20)
-        # self.logger.info("reset body:" + str(states))
-        for i in range(20):
-            pstate = states[i+8]
-            if i == 0 or i == 16:
-                pstate += 90
-            if i == 6 or i == 12:
-                pstate -= 1.84
-
-            if pstate != 0:
-                if pstate >= 30:
-                    action = -1
-                elif pstate <= -30:
-                    action = 1
-                elif pstate >= 10 and pstate < 30:
-                    action = -1/3
-                elif pstate > 0 and pstate < 10:
-                    action = -pstate/70
-                elif pstate < -10 and pstate > -30:
-                    action = 1/3
-                elif pstate < 0 and pstate > -10:
-                    action = -pstate/70
-                else:
-                    action = 0
+        """
+        Action parameters which servo the joints towards RESET_POSE.
+        """
+        return self.controller.action(actionJoints(states), self.RESET_POSE)
 
-                actionParameters[i] = action
-        self.robot.action(actionParameters)
+    def wait(self, loop=1, since=None):
+        """
+        Wait for the perceptor message STEPWAIT * loop cycles after the simulation time since,
+        the one of the current states by default. Steps are aligned to the simulation cycles
+        instead of the wall clock, which is only used if the messages carry no time.
+        Return False if the perceptor message didn't arrive in time.
+        """
+        con = self.robot.con
+        metrics = self.robot.metrics
+        begin = time.perf_counter_ns() if metrics else 0
+        if con.syncMode:
+            received = True
+            for i in range(loop):
+                received = con.syncCycle() and received
+            if metrics:
+                metrics.record("wait", begin)
+            return received
+        if self.robot.simTime < 0:
+            return self.__waitClock(loop)
+
+        if since is None or since < 0:
+            since = self.robot.simTime
+        target = since + (TrainKick.STEPWAIT * loop - 0.5) * NeoRobot.CYCLE
+        deadline = time.time() + self.WAIT_TIMEOUT * loop
+        while True:
+            count = con.messageCount
+            simTime = self.robot.simTime
+            # The simulation time goes back if the server was restarted
+            if simTime >= target or simTime < since:
+                if metrics:
+                    metrics.record("wait", begin)
+                    """
+                    Oversleep is the time from the arrival of the message until the step goes on
+                    """
+                    metrics.recordDuration("oversleep", int(con.observationAge() * 1e9))
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0 or not con.waitMessage(count, remaining):
+                self.logger.warning("id:" + str(self.env_id) + " no perceptor message of simulation time " +
+                                    str(round(target, 2)) + " in " + str(self.WAIT_TIMEOUT * loop) + "s")
+                return False
 
-    def wait(self, loop=1):
+    def __waitClock(self, loop):
         for i in range(loop):
             self.after_action = time.time()
             self.next_time += 0.02 * TrainKick.STEPWAIT
@@ -263,7 +530,13 @@ class TrainKick(gym.Env):
                 sleepTime = 0.02 * TrainKick.STEPWAIT - 0.005
             self.logger.debug("id:" + str(self.env_id) + " " + str(time.time()) + " next time:" + str(
                 self.next_time) + " sleep time:" + str(sleepTime))
+            metrics = self.robot.metrics
+            begin = time.perf_counter_ns() if metrics else 0
             time.sleep(sleepTime)
+            if metrics:
+                slept = time.perf_counter_ns() - begin - int(sleepTime * 1e9)
+                metrics.recordDuration("oversleep" if slept >= 0 else "undersleep", abs(slept))
+        return True
 
     def render(self, mode='human', close=False):
         pass
\ No newline at end of file
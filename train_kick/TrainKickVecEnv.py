@@ -0,0 +1,211 @@
+import json
+import os
+import time
+
+import numpy as np
+from stable_baselines.common.vec_env import VecEnv
+
+from train_kick.TrainKick import TrainKick
+from train_kick.env.Logger import Logger
+from train_kick.env.Robot import NeoRobot
+from train_kick.env.MultiplexClient import AgentGroup
+
+
+class TrainKickVecEnv(VecEnv):
+    """
+    Vectorized TrainKick which runs all robots in one process.
+    The sockets of all robots are multiplexed by one AgentGroup, every step sends the
+    actions as one batch, waits for the next perceptor message of every robot and
+    gathers the observations into one (N, obs_dim) array.
+
+    env_fns are called with the group and must return TrainKick envs created with it.
+    Because Monitor can't wrap the envs here, episodes are written to log_dir
+    in the same monitor.csv format if it is given.
+
+    An env whose connection died is reported as truncated(done) every step
+    until it is reconnected, the others keep stepping.
+
+    Trainer resets(resetMode 'trainer') of all envs which are done in a step run as one phase
+    in the same cycles, see __resetBatch. The simulation doesn't stop for them, the other robots
+    keep their last action during the phase and are observed again after it, those cycles are no transitions.
+    """
+    logger = Logger.getLogger("TrainKickVecEnv")
+
+    def __init__(self, env_fns, log_dir=None, timeout=1.0):
+        self.group = AgentGroup()
+        self.envs = [fn(self.group) for fn in env_fns]
+        self.timeout = timeout
+        env = self.envs[0]
+        VecEnv.__init__(self, len(self.envs), env.observation_space, env.action_space)
+
+        self.observations = np.zeros((self.num_envs,) + env.observation_space.shape)
+        self.rewards = np.zeros(self.num_envs)
+        self.dones = np.zeros(self.num_envs, dtype=bool)
+        self.actions = None
+
+        self.episode_rewards = np.zeros(self.num_envs)
+        self.episode_lengths = np.zeros(self.num_envs, dtype=int)
+        self.t_start = time.time()
+        self.monitor_files = []
+        if log_dir is not None:
+            for env in self.envs:
+                f = open(os.path.join(log_dir, str(env.env_id)) + ".monitor.csv", "wt")
+                f.write('#%s\n' % json.dumps({"t_start": self.t_start, "env_id": None}))
+                f.write('r,l,t\n')
+                f.flush()
+                self.monitor_files.append(f)
+
+    def reset(self):
+        self.__resetBatch(range(self.num_envs))
+        self.episode_rewards[:] = 0
+        self.episode_lengths[:] = 0
+        return self.observations.copy()
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        reconnected = []
+        for i, env in enumerate(self.envs):
+            if env.reconnecting:
+                env.pollReconnect()
+                if not env.reconnecting:
+                    reconnected.append(i)
+        self.__resetBatch(reconnected)
+        reconnecting = [env.reconnecting for env in self.envs]
+        learning = np.array([not skip and env.applyAction(action, batched=True)
+                             for env, action, skip in zip(self.envs, self.actions, reconnecting)])
+        acting = [i for i in range(self.num_envs) if not reconnecting[i] and self.envs[i].pendingAction is not None]
+        if acting:
+            NeoRobot.actionBatch([self.envs[i].robot for i in acting],
+                                 np.array([self.envs[i].pendingAction for i in acting]))
+        self.rewards[:] = 0
+        self.__batchRewards(np.flatnonzero(learning))
+
+        self.group.syncCycle(self.timeout)
+
+        infos = [{} for i in range(self.num_envs)]
+        done = []
+        for i in range(self.num_envs):
+            env = self.envs[i]
+            if not env.checkConnection():
+                self.dones[i] = True
+                infos[i]['TimeLimit.truncated'] = True
+                infos[i]['reconnecting'] = True
+                infos[i]['terminal_observation'] = self.observations[i].copy()
+                if not reconnecting[i]:
+                    self.episode_rewards[i] += self.rewards[i]
+                    self.episode_lengths[i] += 1
+                    infos[i]['episode'] = self.__episodeOver(i)
+                continue
+            env.observe(self.observations[i])
+            infos[i].update(env.stepInfo())
+            self.dones[i] = env.done
+            self.episode_rewards[i] += self.rewards[i]
+            self.episode_lengths[i] += 1
+            if env.done:
+                infos[i]['terminal_observation'] = self.observations[i].copy()
+                infos[i]['episode'] = self.__episodeOver(i)
+                done.append(i)
+        self.__resetBatch(done)
+
+        return self.observations.copy(), self.rewards.copy(), self.dones.copy(), infos
+
+    def __resetBatch(self, indices):
+        """
+        Reset the envs of indices and observe them. Their trainer resets are begun together,
+        then every cycle sends the next trainerResetAction() of each env which is still resetting
+        and the last action of every other robot, until all are done.
+        If a phase ran, the other robots moved on and are observed again.
+        """
+        resetting = []
+        for i in indices:
+            env = self.envs[i]
+            if env.reset(batched=True) is None:
+                resetting.append(i)
+            else:
+                env.observe(self.observations[i])
+        if not resetting:
+            return
+        cycles = 0
+        while any(self.envs[i].resetting for i in resetting):
+            acting = []
+            actions = []
+            for i, env in enumerate(self.envs):
+                if env.reconnecting:
+                    continue
+                if env.resetting:
+                    acting.append(i)
+                    actions.append(env.trainerResetAction())
+                elif env.pendingAction is not None and i not in resetting:
+                    acting.append(i)
+                    actions.append(env.pendingAction)
+            if acting:
+                NeoRobot.actionBatch([self.envs[i].robot for i in acting], np.array(actions))
+            self.group.syncCycle(self.timeout)
+            cycles += 1
+            for i in resetting:
+                if self.envs[i].resetting and not self.envs[i].checkConnection():
+                    self.envs[i].resetting = False
+        self.logger.debug("reset " + str(len(resetting)) + " envs in " + str(cycles) + " cycles")
+        for i, env in enumerate(self.envs):
+            if not env.reconnecting:
+                env.observe(self.observations[i])
+
+    def __batchRewards(self, indices):
+        """
+        Kick rewards are computed for the whole batch at once, other train types per env.
+        """
+        if len(indices) == 0:
+            return
+        kicks = [i for i in indices if self.envs[i].trainType == 'kick']
+        if kicks:
+            balls = np.array([self.envs[i].robot.grandEnvs.getBallLocation() for i in kicks])
+            inits = np.array([self.envs[i].init_ball_location for i in kicks])
+            action_rewards = TrainKick.kickRewards(balls, inits)
+            for i, action_reward in zip(kicks, action_rewards):
+                self.rewards[i] = self.envs[i].addReward(float(action_reward))
+        for i in indices:
+            if self.envs[i].trainType != 'kick':
+                self.rewards[i] = self.envs[i].reward()
+
+    def __episodeOver(self, i):
+        episode = {"r": round(float(self.episode_rewards[i]), 6), "l": int(self.episode_lengths[i]),
+                   "t": round(time.time() - self.t_start, 6)}
+        if self.monitor_files:
+            self.monitor_files[i].write("%s,%s,%s\n" % (episode["r"], episode["l"], episode["t"]))
+            self.monitor_files[i].flush()
+        self.episode_rewards[i] = 0
+        self.episode_lengths[i] = 0
+        return episode
+
+    def close(self):
+        for env in self.envs:
+            env.robot.close()
+        self.group.close()
+        for f in self.monitor_files:
+            f.close()
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self.envs[i], attr_name) for i in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        for i in self._get_indices(indices):
+            setattr(self.envs[i], attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self.envs[i], method_name)(*method_args, **method_kwargs)
+                for i in self._get_indices(indices)]
+
+    def get_images(self):
+        return [env.render(mode='rgb_array') for env in self.envs]
+
+    def seed(self, seed=None):
+        return [env.seed(seed + i if seed is not None else None) for i, env in enumerate(self.envs)]
+
+    def _get_indices(self, indices):
+        if indices is None:
+            indices = range(self.num_envs)
+        elif isinstance(indices, int):
+            indices = [indices]
+        return indices
@@ -0,0 +1,23 @@
+from stable_baselines.common.vec_env import VecEnvWrapper
+
+from train_kick.env.RewardTracker import RewardTracker
+
+
+class VecRewardTracker(VecEnvWrapper):
+    """
+    Feed the episodes ending in the envs into a RewardTracker, read from the 'episode' infos
+    which Monitor(SubprocVecEnv) and TrainKickVecEnv report.
+    It must wrap the envs below VecNormalize, so the returns are the raw ones of the monitor files.
+    """
+
+    def __init__(self, venv, window=100):
+        VecEnvWrapper.__init__(self, venv)
+        self.tracker = RewardTracker(window)
+
+    def reset(self):
+        return self.venv.reset()
+
+    def step_wait(self):
+        observations, rewards, dones, infos = self.venv.step_wait()
+        self.tracker.addInfos(infos)
+        return observations, rewards, dones, infos
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+import threading
+
+import numpy as np
+
+
+class ActionEncoder:
+    """
+    Encoder of effector commands (lae1 -0.35)(lae2 1.20)... from action vectors.
+    The speed of every effector is quantized to hundredths like '%.2f', and the
+    command of every possible speed is prebuilt as bytes, so encoding is one
+    vectorized quantization, one table lookup per effector and one join.
+    The tables only depend on the effectors and their ranges and are shared by all encoders.
+
+    With last, effectors whose quantized speed didn't change since the last sent command
+    are omitted, because simspark keeps the speed of a hinge until it gets a new one.
+    last holds the table indices of the encoded speeds and is updated in place,
+    -1 forces an effector to be sent. It is updated when encoding, not when sending,
+    so the connections append the messages of a cycle instead of replacing an unsent one.
+    """
+    SCALE = 100
+    tables = {}
+    tablesLock = threading.Lock()
+
+    def __init__(self, effectors, ranges, actionColumns=None):
+        """
+        actionColumns are the effectors driven by the action vector,
+        the speed of the others is always zero.
+        """
+        self.effectors = list(effectors)
+        ranges = np.asarray(ranges, dtype=float)
+        if actionColumns is None:
+            actionColumns = range(len(self.effectors))
+        self.actionColumns = np.asarray(actionColumns, dtype=np.intp)
+        self.limit = int(np.ceil(ranges.max() * self.SCALE))
+        width = 2 * self.limit + 1
+        self.commands = self.__table(width)
+        self.offsets = np.arange(len(self.effectors), dtype=np.intp) * width + self.limit
+        self.actionScale = ranges[self.actionColumns] * self.SCALE
+        self.actionOffsets = self.offsets[self.actionColumns]
+
+    def __table(self, width):
+        key = (tuple(self.effectors), self.limit)
+        with self.tablesLock:
+            if key not in self.tables:
+                commands = np.empty(len(self.effectors) * width, dtype=object)
+                speeds = np.arange(-self.limit, self.limit + 1) / self.SCALE
+                for i, name in enumerate(self.effectors):
+                    commands[i * width:(i + 1) * width] = [('(%s %.2f)' % (name, speed)).encode('ascii')
+                                                           for speed in speeds]
+                self.tables[key] = commands
+            return self.tables[key]
+
+    def indices(self, actions):
+        """
+        Table indices of the commands of actions(A,) or (N, A), speeds out of range are clipped.
+        """
+        quantized = np.rint(np.asarray(actions, dtype=float) * self.actionScale)
+        """
+        maximum and minimum are faster than np.clip for the small arrays of one robot
+        """
+        np.minimum(np.maximum(quantized, -self.limit, out=quantized), self.limit, out=quantized)
+        indices = np.empty(quantized.shape[:-1] + (len(self.effectors),), dtype=np.intp)
+        indices[...] = self.offsets
+        indices[..., self.actionColumns] = quantized.astype(np.intp) + self.actionOffsets
+        return indices
+
+    def encode(self, actions, last=None):
+        """
+        Encode the action(A,) of one robot to bytes.
+        """
+        indices = self.indices(actions)
+        if last is not None:
+            changed = indices != last
+            last[changed] = indices[changed]
+            indices = indices[changed]
+        commands = self.commands
+        return b''.join([commands[i] for i in indices.tolist()])
+
+    def encodeBatch(self, actions, last=None):
+        """
+        Encode the actions(N, A) of N robots at once, return a list of N bytes.
+        last is (N, effectors) if given.
+        """
+        indices = self.indices(actions)
+        commands = self.commands[indices]
+        if last is None:
+            return [b''.join(row) for row in commands]
+        changed = indices != last
+        last[changed] = indices[changed]
+        return [b''.join(row[mask]) for row, mask in zip(commands, changed)]
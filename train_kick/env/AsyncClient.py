@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+
+import asyncio
+import struct
+import threading
+import time
+
+from train_kick.env.Logger import Logger
+from train_kick.env.FrameReader import frameBytes
+from train_kick.env.Watchdog import connectWithBackoff
+
+
+class AgentLoop:
+    """
+    One asyncio event loop in one thread, shared by all AsyncAgentConnections of the process.
+    """
+    logger = Logger.getLogger("AgentLoop")
+    instance = None
+    instanceLock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="AgentLoop", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def get(cls):
+        with cls.instanceLock:
+            if cls.instance is None:
+                cls.instance = AgentLoop()
+            return cls.instance
+
+    def createConnection(self, threadName, robot, syncMode=False, latestOnly=False):
+        return AsyncAgentConnection(threadName, robot, self, syncMode, latestOnly)
+
+    def run(self, coroutine, timeout=None):
+        """
+        Run coroutine on the loop and wait for its result from another thread.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def call(self, callback, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
+
+
+class AsyncAgentConnection:
+    """
+    This class has the surface of AgentConnection, but both streams are served by an AgentLoop.
+    Messages are sent as soon as they are submitted instead of by a timer,
+    in agent sync mode they are buffered and sent by syncCycle().
+    """
+    logger = Logger.getLogger("AsyncAgentConnection")
+
+    serverDefaultIP = "127.0.0.1"
+    agentDefaultPort = 3100
+    monitorDefaultPort = 3200
+
+    def __init__(self, threadName, robot, agentLoop, syncMode=False, latestOnly=False):
+        self.threadName = threadName
+        self.robot = robot
+        self.agentLoop = agentLoop
+        self.syncMode = syncMode
+        """
+        In latest only mode a perceptor message is parsed when the loop gets idle,
+        so the messages which arrived together only leave the newest one.
+        """
+        self.latestOnly = latestOnly
+        self.latestMessage = None
+        self.latestCount = 0
+        self.skippedFrames = 0
+        self.send_buffer = b""
+        self.isStopped = False
+        self.error = None
+        self.tasks = []
+        self.messageCount = 0
+        self.messageCondition = threading.Condition()
+        self.lastReadTime = time.time()
+
+    def __str__(self):
+        return "Server IP:" + self.server + " Server agent port:" + str(
+            self.port)
+
+    def connectServers(self,
+                       server=serverDefaultIP,
+                       port=agentDefaultPort,
+                       mport=monitorDefaultPort,
+                       retries=None):
+        """
+        Try to connect retries times(forever if None) with exponential backoff.
+        Return True if connected.
+        """
+        self.server = server
+        self.port = port
+        self.mport = mport
+
+        return connectWithBackoff(lambda: self.agentLoop.run(self.__connect()),
+                                  lambda: self.agentLoop.run(self.__close()), retries, self.logger,
+                                  str(self.server) + ":" + str(self.port))
+
+    async def __connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.server, self.port)
+        self.tasks = [asyncio.ensure_future(self.__receive(self.reader, self.__updateRobot))]
+        if (self.mport is not None):
+            self.mreader, self.mwriter = await asyncio.open_connection(self.server, self.mport)
+            self.tasks.append(asyncio.ensure_future(self.__receive(self.mreader, self.__updateGrandStates)))
+
+    def start(self):
+        """
+        Nothing to start, the AgentLoop serves the streams.
+        """
+        pass
+
+    def close(self):
+        self.isStopped = True
+        self.__wakeWaiters()
+        self.agentLoop.run(self.__close())
+
+    async def __close(self):
+        """
+        Also the cleanup of a failed connect, which may have opened only the agent stream.
+        """
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        for name in ('writer', 'mwriter'):
+            if (hasattr(self, name)):
+                getattr(self, name).close()
+                delattr(self, name)
+
+    def sendMessage(self, message):
+        if (self.syncMode):
+            # Appended until syncCycle, like the buffers of the other transports
+            self.send_buffer += frameBytes(message)
+        else:
+            self.agentLoop.call(self.__write, frameBytes(message) + b"(syn)", self.__fullStateRequest())
+
+    def sendMonitorMessage(self, message):
+        self.agentLoop.call(self.__write, None, frameBytes(message))
+
+    def syncCycle(self, timeout=1.0):
+        """
+        Send the buffered message with (syn) and block until the perceptor message
+        of the next cycle arrives. Return False if nothing came within timeout.
+        """
+        count = self.messageCount
+        self.agentLoop.call(self.__write, self.send_buffer + b"(syn)", self.__fullStateRequest())
+        self.send_buffer = b""
+        with self.messageCondition:
+            self.messageCondition.wait_for(lambda: self.messageCount > count or self.__isEnded(), timeout)
+            if (self.messageCount <= count):
+                self.logger.warning("no perceptor message in " + str(timeout) + "s")
+                return False
+        return True
+
+    def __fullStateRequest(self):
+        """
+        The monitor sends deltas of the scene, the full state is only requested after a desync.
+        """
+        if (self.mport is not None and self.robot.grandEnvs.takeFullStateRequest()):
+            return b"(reqfullstate)"
+        return None
+
+    def waitMessage(self, count, timeout=None):
+        """
+        Block until more than count perceptor messages have been received or the connection failed or was closed.
+        """
+        with self.messageCondition:
+            self.messageCondition.wait_for(lambda: self.messageCount > count or self.__isEnded(), timeout)
+            return self.messageCount > count
+
+    def __write(self, message, monitorMessage):
+        if (self.isStopped or self.error is not None):
+            return
+        metrics = self.robot.metrics
+        begin = time.perf_counter_ns() if metrics else 0
+        if (message is not None):
+            self.logger.debug("Send content:%s", message)
+            self.writer.write(struct.pack("!I", len(message)) + message)
+        if (monitorMessage is not None and self.mport is not None):
+            self.mwriter.write(struct.pack("!I", len(monitorMessage)) + monitorMessage)
+        if metrics:
+            metrics.record("send", begin)
+
+    async def __receive(self, reader, update):
+        try:
+            while (not self.isStopped):
+                length_no = await reader.readexactly(4)
+                length = struct.unpack("!I", length_no)
+                msg = await reader.readexactly(length[0])
+                update(msg)
+        except (asyncio.IncompleteReadError, OSError) as e:
+            if (not self.isStopped):
+                self.logger.error(self.threadName + " connection closed by server" + repr(e))
+                self.error = e
+                self.__wakeWaiters()
+        except asyncio.CancelledError:
+            pass
+
+    def __updateRobot(self, message):
+        if (self.latestOnly):
+            if (self.latestMessage is not None):
+                self.skippedFrames += 1
+            else:
+                self.agentLoop.loop.call_soon(self.__updateLatest)
+            self.latestMessage = message
+            self.latestCount += 1
+            return
+        self.robot.update(message)
+        self.__received(1)
+
+    def __updateLatest(self):
+        message, count = self.latestMessage, self.latestCount
+        self.latestMessage = None
+        self.latestCount = 0
+        self.robot.update(message)
+        self.__received(count)
+
+    def __received(self, count):
+        self.lastReadTime = time.time()
+        with self.messageCondition:
+            self.messageCount += count
+            self.messageCondition.notify_all()
+
+    def isDead(self):
+        return self.error is not None
+
+    def __isEnded(self):
+        return self.isStopped or self.error is not None
+
+    def __wakeWaiters(self):
+        with self.messageCondition:
+            self.messageCondition.notify_all()
+
+    def observationAge(self):
+        """
+        Seconds since the perceptor message of the current robot states was received.
+        """
+        return time.time() - self.lastReadTime
+
+    def __updateGrandStates(self, message):
+        self.robot.updateGrandStates(message)
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+import fcntl
+import socket
+import struct
+import termios
+
+
+class FrameReader:
+    """
+    Read the 4-byte length prefixed frames of a blocking socket with recv_into
+    into one reusable buffer, which only grows when a frame doesn't fit.
+    """
+
+    def __init__(self, sock, size=16384):
+        self.sock = sock
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.bytesReceived = 0
+        self.framesReceived = 0
+        self.bufferGrows = 0
+        self.framesSkipped = 0
+
+    def readFrame(self):
+        """
+        Return a memoryview of the next frame, it's only valid until the next call.
+        """
+        self.__readInto(4)
+        length = struct.unpack_from("!I", self.buffer)[0]
+        if length > len(self.buffer):
+            self.__grow(length)
+        self.__readInto(length)
+        self.framesReceived += 1
+        return self.view[:length]
+
+    def readLatestFrame(self):
+        """
+        Read the next frame and every complete frame which already waits in the socket behind it,
+        return only the newest. The older ones are counted as skipped.
+        """
+        frame = self.readFrame()
+        while self.__frameWaiting():
+            frame = self.readFrame()
+            self.framesSkipped += 1
+        return frame
+
+    def __frameWaiting(self):
+        """
+        A readable socket may only hold part of the next frame, reading it would block until the rest arrives.
+        """
+        available = struct.unpack("i", fcntl.ioctl(self.sock.fileno(), termios.FIONREAD, b"\0\0\0\0"))[0]
+        if available < 4:
+            return False
+        header = self.sock.recv(4, socket.MSG_PEEK)
+        return len(header) == 4 and available >= 4 + struct.unpack("!I", header)[0]
+
+    def __readInto(self, length):
+        view = self.view
+        received = 0
+        while received < length:
+            count = self.sock.recv_into(view[received:length], length - received)
+            if count == 0:
+                raise ConnectionError("connection closed by server")
+            received += count
+        self.bytesReceived += length
+
+    def __grow(self, length):
+        size = len(self.buffer)
+        while size < length:
+            size *= 2
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.bufferGrows += 1
+
+    def stats(self):
+        return {"bytesReceived": self.bytesReceived, "framesReceived": self.framesReceived,
+                "bufferGrows": self.bufferGrows, "bufferSize": len(self.buffer),
+                "framesSkipped": self.framesSkipped}
+
+
+def frameBytes(message):
+    """
+    Encode a message for sending, effector commands of the ActionEncoder are bytes already.
+    """
+    if isinstance(message, str):
+        return message.encode('ascii')
+    return message
+
+
+def frameText(frame):
+    """
+    Decode a frame for logging, frames are parsed as bytes.
+    """
+    if isinstance(frame, str):
+        return frame
+    return bytes(frame).decode('ascii', 'replace')
@@ -1,126 +1,258 @@
 #!/usr/bin/python3
 
-import copy
 import re
 import time
 import math
 import numpy as np
 
 from train_kick.env.Logger import Logger
+from train_kick.env.FrameReader import frameText
+from train_kick.env.SceneParser import SceneParser
+from train_kick.env.SharedWorld import SharedWorld
 
 
 class GrandEnvs:
     """
     The class dosen't need to be instanced, because only one object is needed.
+
+    The world is kept in arrays with the layout of the SharedWorld:
+    players (2 teams, 11 unums, head/body, xyz), valid (2, 11) and ball xyz.
+    team zero means leftTeam, while one means rightTeam, unum n is at index n - 1.
     """
     logger = Logger.getLogger("GrandEnvs")
 
-    def __init__(self):
-        self.playersHeadLocations = {}
-        self.playersBodyLocations = {}
-        self.ballLocation = [.0, .0, .0]
-        self.lastReadTime = -1
-
+    TEAMS = SharedWorld.TEAMS
+    UNUMS = SharedWorld.UNUMS
+    HEAD = SharedWorld.HEAD
+    BODY = SharedWorld.BODY
     """
-    (nd TRF (SLT 1 0 0 0 0 1 0 0 0 0 1 0 0 0 0.0417605 1)(nd StaticMesh (setVisible 1) (load models/soccerball.obj) (sSc 0.042 0.042 0.042)(resetMaterials soccerball_rcs-soccerball.png)))
+    Distance between head and body of a lying robot
     """
-    ballPattern = re.compile(r'\(nd\s([^n]*)\(nd\s([^n]*)soccerball\.obj')
+    HEAD_LENGTH = 0.165
+
+    def __init__(self, sharedName=None):
+        self.players = np.zeros((self.TEAMS, self.UNUMS, 2, 3))
+        self.valid = np.zeros((self.TEAMS, self.UNUMS), dtype=bool)
+        self.ball = np.zeros(3)
+        self.localReadTime = -1
+        self.sceneParser = SceneParser()
+        self.needFullState = True
+        """
+        If sharedName is given, the locations are read from the SharedWorld
+        published by a MonitorFeed instead of own monitor messages.
+        """
+        self.sharedName = sharedName
+        self.sharedWorld = None
+
+    @property
+    def lastReadTime(self):
+        if self.sharedName is None:
+            return self.localReadTime
+        world = self.__getSharedWorld()
+        if world is None:
+            return -1
+        return world.getReadTime()
+
+    def __getSharedWorld(self):
+        """
+        The block is attached when it's needed first, the MonitorFeed may start later.
+        """
+        if self.sharedWorld is None:
+            try:
+                self.sharedWorld = SharedWorld(self.sharedName)
+            except FileNotFoundError:
+                return None
+        return self.sharedWorld
+
     """
-    (1) body location (2) num (3) team (4) type (5) head location
+    (RSG 0 1) starts a full scene, (RDS 0 1) a delta of the last one.
     """
-    playerPattern = re.compile(r'\(nd ([^n]*)\(nd [^n]*\(nd [^n]*naobody\d\.obj[^r]*\(resetMaterials matNum(\w*) mat(\w*) matType(\d) naowhite\)\)\)\(nd TRF[^R]* TRF [^R]* ([^n]*)\(nd')
+    headerPattern = re.compile(r'\((RSG|RDS) \d+ \d+\)')
+    bytesHeaderPattern = re.compile(headerPattern.pattern.encode('ascii'))
 
     def updateGrandStates(self, message):
         """
-        Only Message whose length is over 10k will be parsed.
+        Full scenes are parsed, deltas are applied to the scene model of the last full scene.
+        The message may be str or bytes-like.
         """
         self.logger.debug(message)
-        if(message.find("naosoccerfield", 1000, 1500) > 0):
-            try:
-                ballMatch = self.ballPattern.search(message)
-                if (ballMatch is not None):
-                    hmsg = self.parseLocation(ballMatch.group(1))
-                    self.ballLocation = self.parseHomogenousMatrix(hmsg)
-
-                    it = self.playerPattern.finditer(message)
-                    for match in it:
-                        hmsg = self.parseLocation(match.group(1))
-                        blocation = self.parseHomogenousMatrix(hmsg)
-                        hmsg = self.parseLocation(match.group(5))
-                        hlocation = self.parseHomogenousMatrix(hmsg)
-
-                        key = ""
-                        if(match.group(3).strip() == 'Left' and match.group(2).isdigit()):
-                            key = "left_" + str(match.group(2))
-                        elif(match.group(3).strip() == 'Right' and match.group(2).isdigit()):
-                            key = "right_" + str(match.group(2))
-                        if(key != ""):
-                            self.playersHeadLocations[key] = hlocation
-                            self.playersBodyLocations[key] = blocation
-
-                        self.lastReadTime = time.time()
-                # else:
-                #    self.logger.error("Can't find ball")
-            except AttributeError as e:
-                self.logger.exception("Monintor parse error" + repr(e))
-                self.logger.error("message:" + message)
-
-    def parseLocation(self, message):
-        """
-        TRF (SLT 1 0 0 0 0 1 0 0 0 0 1 0 0 0 0.0417605 1)
-        """
-        message = message.strip()
-        # self.logger.info(message)
-        submessage = message[8:-1].strip()
-        return submessage
-
-    def parseHomogenousMatrix(self, matrix):
-        slist = str(matrix).split(" ")
-        return [float(slist[12]), float(slist[13]), float(slist[14])]
+        headerPattern = self.headerPattern if isinstance(message, str) else self.bytesHeaderPattern
+        header = headerPattern.search(message)
+        if(header is None):
+            return
+        try:
+            if(header.group(1) in ('RSG', b'RSG')):
+                ballLocation, players = self.sceneParser.parse(message, header.end())
+            elif(self.sceneParser.applyDelta(message, header.end())):
+                ballLocation, players = self.sceneParser.ball, self.sceneParser.players
+            else:
+                self.needFullState = True
+                return
+            if (ballLocation is not None):
+                self.ball[:] = ballLocation
+                # A player who left the scene is no longer valid
+                self.valid[:] = False
+                for (team, playerNumber), (hlocation, blocation) in players.items():
+                    if(playerNumber < 1 or playerNumber > self.UNUMS):
+                        continue
+                    player = self.players[team, playerNumber - 1]
+                    player[self.HEAD] = hlocation
+                    player[self.BODY] = blocation
+                    self.valid[team, playerNumber - 1] = True
+
+                    self.localReadTime = time.time()
+            # else:
+            #    self.logger.error("Can't find ball")
+        except (IndexError, ValueError) as e:
+            self.logger.exception("Monintor parse error" + repr(e))
+            self.logger.error("message:" + frameText(message))
+            self.sceneParser.reset()
+            self.needFullState = True
+
+    def clearPlayers(self):
+        """
+        Forget the players and the scene model when the monitor connection is reset,
+        they are valid again with the next full scene.
+        """
+        self.valid[:] = False
+        self.sceneParser.reset()
+        self.needFullState = True
+
+    def takeFullStateRequest(self):
+        """
+        Return True once after the scene model got out of sync,
+        then the caller sends (reqfullstate) to the monitor port.
+        """
+        request = self.needFullState
+        self.needFullState = False
+        return request
+
+    def getWorld(self):
+        """
+        return copies of players, valid and ball arrays
+        """
+        if self.sharedName is not None:
+            world = self.__getSharedWorld()
+            if world is None:
+                return np.zeros_like(self.players), np.zeros_like(self.valid), np.zeros_like(self.ball)
+            return world.readWorld()
+        return self.players.copy(), self.valid.copy(), self.ball.copy()
+
+    def hasPlayer(self, team=0, playerNumber=1, since=None):
+        """
+        return True if the player was seen in the monitor scene,
+        read at time.time() since or later if since is given.
+        """
+        if(playerNumber < 1 or playerNumber > self.UNUMS):
+            return False
+        if(since is not None and self.lastReadTime < since):
+            return False
+        if self.sharedName is not None:
+            world = self.__getSharedWorld()
+            return world is not None and world.getPlayer(team, playerNumber) is not None
+        return bool(self.valid[team, playerNumber - 1])
 
     def getPitch(self, team=0, playerNumber=1):
         """
         return pitch between head and body
         if team zero means leftTeam, while one means rightTeam.
         """
-        if(team == 0):
-            key = "left_" + str(playerNumber)
-        else:
-            key = "right_" + str(playerNumber)
-
-        hlocation = self.playersHeadLocations.get(key)
-        blocation = self.playersBodyLocations.get(key)
-        if(blocation is not None and hlocation is not None):
-            length = np.sqrt((hlocation[0]-blocation[0])**2 + (hlocation[1]-blocation[1])**2)
-            if(length > 0.165):
-                # self.logger.error("length is longer than 165:" + str(length))
-                length = 0.165
-            pitch = math.degrees(math.asin(length/0.165))
-            return pitch
-        else:
-            self.logger.error("not found key:" + key)
-            raise NotFoundPlayerException("not found key:" + key)
+        hlocation, blocation = self.__getPlayer(team, playerNumber)
+        length = math.hypot(hlocation[0] - blocation[0], hlocation[1] - blocation[1])
+        if(length > self.HEAD_LENGTH):
+            # self.logger.error("length is longer than 165:" + str(length))
+            length = self.HEAD_LENGTH
+        return math.degrees(math.asin(length / self.HEAD_LENGTH))
 
     def getPlayerLocation(self, team=0, playerNumber=1):
         """
+        return head location
         if team zero means leftTeam, while one means rightTeam.
         """
-        if(team == 0):
-            key = "left_" + str(playerNumber)
-        else:
-            key = "right_" + str(playerNumber)
-
-        location = self.playersHeadLocations.get(key)
-        if(location is not None):
-            return copy.copy(location)
-        else:
-            # time.sleep(1)
-            self.logger.error("not found key:" + key)
-            raise NotFoundPlayerException("not found key:" + key)
-            # return None
+        return self.__getPlayer(team, playerNumber)[0]
+
+    def __getPlayer(self, team, playerNumber):
+        """
+        return head location, body location as lists
+        """
+        if self.sharedName is not None:
+            world = self.__getSharedWorld()
+            player = world.getPlayer(team, playerNumber) if world is not None else None
+            if player is not None:
+                return player
+        elif(1 <= playerNumber <= self.UNUMS and self.valid[team, playerNumber - 1]):
+            return self.players[team, playerNumber - 1].tolist()
+
+        key = self.playerKey(team, playerNumber)
+        self.logger.error("not found key:" + key)
+        raise NotFoundPlayerException("not found key:" + key)
 
     def getBallLocation(self):
-        return copy.copy(self.ballLocation)
+        if self.sharedName is not None:
+            world = self.__getSharedWorld()
+            if world is not None:
+                return world.getBallLocation()
+        return self.ball.tolist()
+
+    """
+    Batched queries over all players, (2, 11) arrays with nan for players never seen.
+    """
+    def getPitches(self):
+        players, valid, ball = self.getWorld()
+        offset = players[:, :, self.HEAD, :2] - players[:, :, self.BODY, :2]
+        length = np.minimum(np.hypot(offset[..., 0], offset[..., 1]), self.HEAD_LENGTH)
+        return np.where(valid, np.degrees(np.arcsin(length / self.HEAD_LENGTH)), np.nan)
+
+    def getBallDistances(self):
+        """
+        distances on the ground between the ball and the bodies
+        """
+        players, valid, ball = self.getWorld()
+        offset = players[:, :, self.BODY, :2] - ball[:2]
+        return np.where(valid, np.hypot(offset[..., 0], offset[..., 1]), np.nan)
+
+    def getHeights(self):
+        """
+        heights of the heads
+        """
+        players, valid, ball = self.getWorld()
+        return np.where(valid, players[:, :, self.HEAD, 2], np.nan)
+
+    def getPlayerLocations(self, teams, playerNumbers):
+        """
+        (N, 3) head locations of the players teams[i], playerNumbers[i].
+        """
+        players, valid, ball = self.getWorld()
+        teams = np.asarray(teams)
+        indices = np.asarray(playerNumbers) - 1
+        if np.any(indices < 0) or np.any(indices >= self.UNUMS) or not np.all(valid[teams, indices]):
+            raise NotFoundPlayerException("not found players:" + str(list(zip(teams.tolist(), (indices + 1).tolist()))))
+        return players[teams, indices, self.HEAD]
+
+    @staticmethod
+    def playerKey(team, playerNumber):
+        if(team == 0):
+            return "left_" + str(playerNumber)
+        return "right_" + str(playerNumber)
+
+    """
+    Dict and list views of the arrays, keyed by "left_1" ... "right_11"
+    """
+    @property
+    def ballLocation(self):
+        return self.ball.tolist()
+
+    @property
+    def playersHeadLocations(self):
+        return self.__locations(self.HEAD)
+
+    @property
+    def playersBodyLocations(self):
+        return self.__locations(self.BODY)
+
+    def __locations(self, part):
+        return {self.playerKey(team, index + 1): self.players[team, index, part].tolist()
+                for team, index in zip(*np.nonzero(self.valid))}
 
     def getAllPlayersLocation(self):
         return self.playersBodyLocations
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+from train_kick.env.PerceptorParser import JOINTS, JOINT_SLICE, SPEED_SLICE
+
+"""
+The 20 action joints are the joints without neck and toes,
+in the order of the action parameters(laj1 ... raj4).
+"""
+ACTION_JOINTS = slice(2, 22)
+ACTION_JOINT_NAMES = JOINTS[ACTION_JOINTS]
+
+
+def actionJoints(states):
+    """
+    Angles of the action joints in states(70,) or (N, 70), a view.
+    """
+    return states[..., JOINT_SLICE][..., ACTION_JOINTS]
+
+
+def actionSpeeds(states):
+    """
+    Speeds of the action joints in states(70,) or (N, 70), a view.
+    """
+    return states[..., SPEED_SLICE][..., ACTION_JOINTS]
+
+
+def pose(**angles):
+    """
+    Target angles(degrees) of the action joints, joints which aren't given are zero.
+    """
+    target = np.zeros(len(ACTION_JOINT_NAMES))
+    for name, angle in angles.items():
+        target[ACTION_JOINT_NAMES.index(name)] = angle
+    return target
+
+
+class JointController:
+    """
+    PD controller from target joint angles to the action parameters of NeoRobot.action().
+    action = clip(kp * (target - angle) - kd * speed, -1, 1) for all joints in one expression,
+    for one robot(20,) or a batch of robots(N, 20).
+
+    kp 1/30 is the continuous form of the former reset thresholds, 1/3 at 10 degrees and full speed
+    from 30 degrees. One action parameter turns a joint by about 8 degrees per cycle,
+    so a quarter of the error is closed in every cycle without overshooting.
+    """
+
+    POSES = {
+        'zero': pose(),
+        'stand': pose(laj1=-90, raj1=-90, llj3=1.84, rlj3=1.84),
+        'kickReady': pose(laj1=-90, raj1=-90, llj3=30, llj4=-60, llj5=30, rlj3=30, rlj4=-60, rlj5=30),
+    }
+    """
+    Tolerance(degrees) of reached(), the shoulder pitches hang loose.
+    """
+    TOLERANCE = np.maximum(pose(laj1=5, raj1=5), 3)
+
+    def __init__(self, kp=1 / 30, kd=0.0):
+        self.kp = kp
+        self.kd = kd
+
+    @classmethod
+    def target(cls, name):
+        return cls.POSES[name]
+
+    def action(self, joints, target, speeds=None, out=None):
+        """
+        Action parameters which drive joints(20,) or (N, 20) to target, a pose name or angles.
+        """
+        if isinstance(target, str):
+            target = self.POSES[target]
+        out = np.multiply(np.subtract(target, joints, out=out), self.kp, out=out)
+        if speeds is not None and self.kd:
+            out -= self.kd * speeds
+        return np.minimum(np.maximum(out, -1, out=out), 1, out=out)
+
+    def reached(self, joints, target, tolerance=None):
+        """
+        True if all joints are within tolerance of target, (N,) for a batch.
+        """
+        if isinstance(target, str):
+            target = self.POSES[target]
+        if tolerance is None:
+            tolerance = self.TOLERANCE
+        return np.all(np.abs(np.subtract(joints, target)) <= tolerance, axis=-1)
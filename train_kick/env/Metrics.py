@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+
+import json
+import os
+import threading
+import time
+
+from train_kick.env.Logger import Logger
+
+
+class Histogram:
+    """
+    Fixed-size histogram of durations in nanoseconds.
+    Durations below 16ns have their own buckets, above every power of two is split
+    into 8 buckets, so a percentile is accurate to 12.5% and recording is a few integer operations.
+    """
+    SIZE = 16 + 40 * 8
+
+    def __init__(self):
+        self.counts = [0] * self.SIZE
+        self.total = 0
+        self.maximum = 0
+
+    def record(self, ns):
+        if ns < 16:
+            index = max(ns, 0)
+        else:
+            bits = ns.bit_length()
+            index = min(16 + (bits - 5) * 8 + (ns >> (bits - 4)) - 8, self.SIZE - 1)
+        self.counts[index] += 1
+        self.total += ns
+        if ns > self.maximum:
+            self.maximum = ns
+
+    @staticmethod
+    def lowerBound(index):
+        if index < 16:
+            return index
+        bits, mantissa = divmod(index - 16, 8)
+        return (mantissa + 8) << (bits + 1)
+
+    def percentile(self, counts, fraction):
+        rank = fraction * sum(counts)
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if count and seen >= rank:
+                return self.lowerBound(index)
+        return 0
+
+    def take(self):
+        """
+        Return the summary in microseconds and start a new window.
+        """
+        counts, total, maximum = self.counts, self.total, self.maximum
+        self.counts = [0] * self.SIZE
+        self.total = 0
+        self.maximum = 0
+        count = sum(counts)
+        if count == 0:
+            return None
+        return {"count": count, "mean": round(total / count / 1000, 3),
+                "p50": round(self.percentile(counts, 0.5) / 1000, 3),
+                "p99": round(self.percentile(counts, 0.99) / 1000, 3),
+                "max": round(maximum / 1000, 3)}
+
+
+class Metrics:
+    """
+    Latency histograms of one actor, e.g. metrics.record("update", begin) with
+    begin = time.perf_counter_ns().
+
+    The hot paths hold a Metrics or None and only read the clock if they hold one:
+        begin = perf_counter_ns() if metrics else 0
+        ...
+        if metrics: metrics.record("update", begin)
+    so disabled instrumentation costs two truth tests.
+    Metrics are created by get() only after startExport(), which writes the p50/p99 of
+    every actor of the process as one json line per interval into the metrics directory.
+    """
+    logger = Logger.getLogger("Metrics")
+    enabled = False
+    actors = {}
+    actorsLock = threading.Lock()
+    exporter = None
+
+    def __init__(self, name):
+        self.name = name
+        self.histograms = {}
+
+    @classmethod
+    def get(cls, name):
+        """
+        Return the Metrics of the actor name, None if metrics are disabled.
+        A reconnected actor gets the Metrics of its former connection.
+        """
+        if not cls.enabled:
+            return None
+        with cls.actorsLock:
+            if name not in cls.actors:
+                cls.actors[name] = Metrics(name)
+            return cls.actors[name]
+
+    def record(self, key, begin):
+        self.recordDuration(key, time.perf_counter_ns() - begin)
+
+    def recordDuration(self, key, ns):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms.setdefault(key, Histogram())
+        histogram.record(ns)
+
+    def take(self):
+        summary = {}
+        for key, histogram in list(self.histograms.items()):
+            window = histogram.take()
+            if window is not None:
+                summary[key] = window
+        return summary
+
+    @classmethod
+    def startExport(cls, directory, interval=10):
+        """
+        Enable metrics in this process and export them to directory/metrics_<pid>.jsonl every interval seconds.
+        """
+        if cls.exporter is not None:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "metrics_" + str(os.getpid()) + ".jsonl")
+        cls.enabled = True
+
+        def export():
+            while True:
+                time.sleep(interval)
+                cls.export(path)
+
+        cls.exporter = threading.Thread(target=export, name="MetricsExporter", daemon=True)
+        cls.exporter.start()
+        cls.logger.info("export metrics to " + path + " every " + str(interval) + "s")
+
+    @classmethod
+    def export(cls, path):
+        with cls.actorsLock:
+            actors = list(cls.actors.values())
+        lines = []
+        now = round(time.time(), 3)
+        for actor in actors:
+            summary = actor.take()
+            if summary:
+                lines.append(json.dumps({"time": now, "actor": actor.name, "us": summary}) + "\n")
+        if lines:
+            with open(path, "a") as f:
+                f.writelines(lines)
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+import multiprocessing
+import socket
+import struct
+import time
+
+from train_kick.env.Logger import Logger
+from train_kick.env.FrameReader import FrameReader
+from train_kick.env.GrandEnvs import GrandEnvs
+from train_kick.env.SharedWorld import SharedWorld, sharedName
+from train_kick.env.Watchdog import connectWithBackoff
+
+
+class MonitorFeed(multiprocessing.Process):
+    """
+    The only monitor client of one server. Every scene is parsed once
+    and published into a SharedWorld, which GrandEnvs(sharedName(mport)) of all actors read,
+    so the actors don't need own monitor connections.
+    """
+    logger = Logger.getLogger("MonitorFeed")
+
+    def __init__(self, server="127.0.0.1", mport=3200):
+        super(MonitorFeed, self).__init__(name="MonitorFeed_" + str(mport), daemon=True)
+        self.server = server
+        self.mport = mport
+        self.world = SharedWorld(sharedName(mport), create=True)
+
+    def run(self):
+        """
+        A lost connection, e.g. of a server which the ServerPool restarts, publishes a world without players
+        and is connected again with backoff, the next scene is requested in full.
+        """
+        grandEnvs = GrandEnvs()
+        address = str(self.server) + ":" + str(self.mport)
+        while True:
+            connectWithBackoff(self.__connect, lambda: None, None, self.logger, address)
+            self.logger.info("monitor feed of " + address + " started")
+            try:
+                self.__serve(grandEnvs)
+            except (socket.error, ConnectionError) as e:
+                self.logger.error("monitor feed of " + address + " lost " + repr(e))
+            finally:
+                self.msock.close()
+            # The actors must not acknowledge players from the scenes of a lost connection
+            grandEnvs.clearPlayers()
+            self.world.publish(grandEnvs.players, grandEnvs.valid, grandEnvs.ball, time.time())
+
+    def __connect(self):
+        self.msock = socket.create_connection((self.server, self.mport))
+
+    def __serve(self, grandEnvs):
+        reader = FrameReader(self.msock, 65536)
+        while True:
+            if grandEnvs.takeFullStateRequest():
+                self.__monitorSend("(reqfullstate)")
+            readTime = grandEnvs.lastReadTime
+            grandEnvs.updateGrandStates(reader.readFrame())
+            if grandEnvs.lastReadTime != readTime:
+                self.world.publishGrandEnvs(grandEnvs)
+
+    def __monitorSend(self, message):
+        msg = bytes(message, 'ascii')
+        self.msock.sendall(struct.pack("!I", len(msg)) + msg)
+
+    def close(self):
+        if self.is_alive():
+            self.terminate()
+            self.join(1)
+        self.world.close()
+        self.world.unlink()
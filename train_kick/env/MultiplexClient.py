@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+
+import selectors
+import socket
+import struct
+import time
+
+from train_kick.env.Logger import Logger
+from train_kick.env.FrameReader import frameBytes
+from train_kick.env.Watchdog import connectWithBackoff
+
+
+class AgentGroup:
+    """
+    This class owns the connections of many robots in one process.
+    All agent and monitor sockets are multiplexed by one selector in the calling thread,
+    so no thread is needed for sending or receiving.
+    """
+    logger = Logger.getLogger("AgentGroup")
+    """
+    The selector must only be used by the thread which steps the group,
+    so robots of a group are reconnected in that thread.
+    """
+    threadSafe = False
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.connections = []
+
+    def createConnection(self, threadName, robot, syncMode=True, latestOnly=False):
+        """
+        The connections of a group are always stepped by syncCycle().
+        """
+        return MultiplexConnection(threadName, robot, self, latestOnly)
+
+    def register(self, con):
+        self.connections.append(con)
+        self.selector.register(con.sock, selectors.EVENT_READ, (con, False))
+        if con.mport is not None:
+            self.selector.register(con.msock, selectors.EVENT_READ, (con, True))
+
+    def unregister(self, con):
+        if con in self.connections:
+            self.connections.remove(con)
+            self.selector.unregister(con.sock)
+            if con.mport is not None:
+                self.selector.unregister(con.msock)
+
+    def setWriting(self, con, isMonitor, writing):
+        """
+        A socket is selected for writing while it has outgoing bytes which didn't fit its send buffer.
+        """
+        if con not in self.connections:
+            return
+        sock = con.msock if isMonitor else con.sock
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if writing else selectors.EVENT_READ
+        if self.selector.get_key(sock).events != events:
+            self.selector.modify(sock, events, (con, isMonitor))
+
+    def poll(self, timeout=0):
+        """
+        Send the outgoing bytes of every socket which is writable,
+        read every socket which is ready and dispatch the complete messages.
+        """
+        for key, mask in self.selector.select(timeout):
+            con, isMonitor = key.data
+            if mask & selectors.EVENT_WRITE:
+                con.onWritable(isMonitor)
+            if mask & selectors.EVENT_READ and not con.isDead():
+                con.onReadable(isMonitor)
+
+    def syncCycle(self, timeout=1.0, caller=None):
+        """
+        Send the buffered messages of all connections as one batch with (syn),
+        then block until every active connection has received its next perceptor message.
+        Connections which never received a message are only waited for if they are the caller.
+        """
+        counts = [(con, con.messageCount) for con in self.connections
+                  if con.messageCount > 0 or con is caller]
+        for con in list(self.connections):
+            try:
+                con.flush()
+            except OSError as e:
+                self.logger.error(con.threadName + " send failed " + repr(e))
+                con.error = e
+                self.unregister(con)
+
+        deadline = time.time() + timeout
+        while any(con.messageCount <= count and not con.isDead() for con, count in counts):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self.logger.warning("no perceptor message in " + str(timeout) + "s")
+                return False
+            self.poll(remaining)
+        return True
+
+    def close(self):
+        for con in list(self.connections):
+            con.close()
+        self.selector.close()
+
+
+class MultiplexConnection:
+    """
+    This class has the surface of AgentConnection, but the sockets are read by an AgentGroup.
+    Messages are only sent when the group steps, as with AgentConnection in agent sync mode.
+    """
+    logger = Logger.getLogger("MultiplexConnection")
+
+    serverDefaultIP = "127.0.0.1"
+    agentDefaultPort = 3100
+    monitorDefaultPort = 3200
+
+    def __init__(self, threadName, robot, group, latestOnly=False):
+        self.threadName = threadName
+        self.robot = robot
+        self.group = group
+        self.syncMode = True
+        self.latestOnly = latestOnly
+        self.skippedFrames = 0
+        self.send_buffer = b""
+        self.monitor_send_buffer = b""
+        self.receive_buffer = bytearray()
+        self.monitor_receive_buffer = bytearray()
+        """
+        The sockets are non-blocking, the frames which they didn't take yet are sent when the group polls.
+        """
+        self.outgoing_buffer = bytearray()
+        self.monitor_outgoing_buffer = bytearray()
+        self.messageCount = 0
+        self.lastReadTime = time.time()
+        self.error = None
+
+    def __str__(self):
+        return "Server IP:" + self.server + " Server agent port:" + str(
+            self.port)
+
+    def connectServers(self,
+                       server=serverDefaultIP,
+                       port=agentDefaultPort,
+                       mport=monitorDefaultPort,
+                       retries=None):
+        """
+        Try to connect retries times(forever if None) with exponential backoff.
+        Return True if connected.
+        """
+        self.server = server
+        self.port = port
+        self.mport = mport
+
+        if (not connectWithBackoff(self.__connect, self.__closeSockets, retries, self.logger,
+                                   str(self.server) + ":" + str(self.port))):
+            return False
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setblocking(False)
+        self.group.register(self)
+        return True
+
+    def __connect(self):
+        self.sock = socket.create_connection((self.server, self.port))
+        if (self.mport is not None):
+            self.msock = socket.create_connection((self.server, self.mport))
+            self.msock.setblocking(False)
+
+    def __closeSockets(self):
+        for name in ('sock', 'msock'):
+            if(hasattr(self, name)):
+                getattr(self, name).close()
+                delattr(self, name)
+
+    def start(self):
+        """
+        Nothing to start, the group reads the sockets.
+        """
+        pass
+
+    def close(self):
+        self.group.unregister(self)
+        if(hasattr(self, 'sock')):
+            self.sock.close()
+        if(hasattr(self, 'msock')):
+            self.msock.close()
+
+    def sendMessage(self, message):
+        """
+        Messages are appended until flush(), so no effector command which the ActionEncoder
+        left out of a later message is lost.
+        """
+        self.send_buffer += frameBytes(message)
+
+    def sendMonitorMessage(self, message):
+        """
+        Trainer commands are appended, all of a cycle are sent in one frame by flush().
+        """
+        self.monitor_send_buffer += frameBytes(message)
+
+    def syncCycle(self, timeout=1.0):
+        return self.group.syncCycle(timeout, self)
+
+    def flush(self):
+        self.logger.debug("Send content:%s(syn)", self.send_buffer)
+        self.__socketSend(False, self.send_buffer + b"(syn)")
+        self.send_buffer = b""
+
+        if (self.mport is None):
+            return
+        if (self.monitor_send_buffer):
+            self.__socketSend(True, self.monitor_send_buffer)
+            self.monitor_send_buffer = b""
+        elif (self.robot.grandEnvs.takeFullStateRequest()):
+            self.__socketSend(True, b"(reqfullstate)")
+
+    def onReadable(self, isMonitor):
+        if isMonitor:
+            sock, buffer = self.msock, self.monitor_receive_buffer
+        else:
+            sock, buffer = self.sock, self.receive_buffer
+
+        try:
+            data = sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            data = None
+            self.error = e
+        if not data:
+            self.logger.error(self.threadName + " connection closed by server")
+            if self.error is None:
+                self.error = ConnectionError("connection closed by server")
+            self.group.unregister(self)
+            return
+
+        buffer.extend(data)
+        latest = None
+        while len(buffer) >= 4:
+            length = struct.unpack_from("!I", buffer)[0]
+            if len(buffer) < 4 + length:
+                break
+            message = bytes(buffer[4:4 + length])
+            del buffer[:4 + length]
+            if isMonitor:
+                self.robot.updateGrandStates(message)
+            elif self.latestOnly:
+                if latest is not None:
+                    self.skippedFrames += 1
+                latest = message
+                self.messageCount += 1
+            else:
+                self.robot.update(message)
+                self.messageCount += 1
+                self.lastReadTime = time.time()
+        if latest is not None:
+            self.robot.update(latest)
+            self.lastReadTime = time.time()
+
+    def onWritable(self, isMonitor):
+        try:
+            self.__sendOutgoing(isMonitor)
+        except OSError as e:
+            self.logger.error(self.threadName + " send failed " + repr(e))
+            self.error = e
+            self.group.unregister(self)
+
+    def isDead(self):
+        return self.error is not None
+
+    def observationAge(self):
+        """
+        Seconds since the perceptor message of the current robot states was received.
+        """
+        return time.time() - self.lastReadTime
+
+    def __socketSend(self, isMonitor, msg):
+        """
+        Queue the frame behind the outgoing bytes and send as much as the socket takes without blocking.
+        """
+        metrics = self.robot.metrics
+        begin = time.perf_counter_ns() if metrics else 0
+        outgoing = self.monitor_outgoing_buffer if isMonitor else self.outgoing_buffer
+        pending = len(outgoing) > 0
+        outgoing.extend(struct.pack("!I", len(msg)) + msg)
+        # If bytes were pending, the socket is selected for writing and the group sends them in order
+        if not pending:
+            self.__sendOutgoing(isMonitor)
+        if metrics:
+            metrics.record("send", begin)
+
+    def __sendOutgoing(self, isMonitor):
+        if isMonitor:
+            sock, outgoing = self.msock, self.monitor_outgoing_buffer
+        else:
+            sock, outgoing = self.sock, self.outgoing_buffer
+        try:
+            sent = sock.send(outgoing)
+        except BlockingIOError:
+            sent = 0
+        del outgoing[:sent]
+        self.group.setWriting(self, isMonitor, len(outgoing) > 0)
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+import re
+
+"""
+Layout of the robot state vector, in the same order as NeoRobot.getAllStates().
+GYR 3 + ACC 3 + Joints 24 + rf 6 + lf 6 + Speed 24 + Reset 1 + location 3 = 70
+"""
+JOINTS = ('hj1', 'hj2', 'laj1', 'laj2', 'laj3', 'laj4', 'llj1', 'llj2', 'llj3',
+          'llj4', 'llj5', 'llj6', 'rlj1', 'rlj2', 'rlj3', 'rlj4', 'rlj5', 'rlj6',
+          'raj1', 'raj2', 'raj3', 'raj4', 'rlj7', 'llj7')
+
+GYR_SLICE = slice(0, 3)
+ACC_SLICE = slice(3, 6)
+JOINT_SLICE = slice(6, 30)
+RF_SLICE = slice(30, 36)
+LF_SLICE = slice(36, 42)
+SPEED_SLICE = slice(42, 66)
+RESET_INDEX = 66
+LOCATION_SLICE = slice(67, 70)
+STATE_SIZE = 70
+
+
+class PerceptorParser:
+    """
+    Single pass parser for the perceptor message of the agent port.
+    Every perceptor found in the message is mapped to its fixed slots of the
+    state vector through a precomputed table, then all numbers are converted
+    and written into the buffer with one assignment.
+    """
+
+    """
+    (HJ (n hj1) (ax -0.00))
+    (GYR (n torso) (rt 0.03 0.00 0.00))
+    (ACC (n torso) (a -0.00 -0.00 0.04))
+    (FRP (n lf) (c -0.00 -0.01 -0.01) (f 0.00 -0.00 22.60))
+    """
+    pattern = re.compile(r'\((HJ|GYR|ACC|FRP) \(n (\w+)\) \(\w+ ([^()]*)\)(?: \(f ([^()]*)\))?\)')
+    """
+    The same pattern for bytes, bytearray and memoryview messages, which need no decoding.
+    """
+    bytesPattern = re.compile(pattern.pattern.encode('ascii'))
+
+    """
+    (time (now 46.84))(GS (unum 1) (team left) (t 6.84) (pm PlayOn))
+    Simulation time and game time, the first (t ...) of a message is the one of GS.
+    """
+    timePattern = re.compile(r'\(time \(now ([^()]*)\)\)')
+    gameTimePattern = re.compile(r'\(t ([^()\s]*)\)')
+    bytesTimePattern = re.compile(timePattern.pattern.encode('ascii'))
+    bytesGameTimePattern = re.compile(gameTimePattern.pattern.encode('ascii'))
+
+    SLOTS = {('HJ', name): (JOINT_SLICE.start + i,) for i, name in enumerate(JOINTS)}
+    SLOTS[('GYR', 'torso')] = tuple(range(GYR_SLICE.start, GYR_SLICE.stop))
+    SLOTS[('ACC', 'torso')] = tuple(range(ACC_SLICE.start, ACC_SLICE.stop))
+    SLOTS[('FRP', 'rf')] = tuple(range(RF_SLICE.start, RF_SLICE.stop))
+    SLOTS[('FRP', 'lf')] = tuple(range(LF_SLICE.start, LF_SLICE.stop))
+    SLOTS.update({(kind.encode('ascii'), name.encode('ascii')): slot for (kind, name), slot in SLOTS.items()})
+    JOINT_KINDS = ('HJ', b'HJ')
+
+    def parse(self, message, out):
+        """
+        Write the perceptors of message(str or bytes-like) into out, which must be at least 42 long.
+        Both of force resistances(lf, rf) are not always in the message,
+        so they are reset to zero before parsing.
+        Return the number of joints found in the message.
+        """
+        indices = []
+        tokens = []
+        joints = 0
+        pattern = self.pattern if isinstance(message, str) else self.bytesPattern
+        for kind, name, values, forces in pattern.findall(message):
+            slot = self.SLOTS.get((kind, name))
+            if slot is None:
+                continue
+            fields = values.split()
+            if forces:
+                fields += forces.split()
+            if len(fields) != len(slot):
+                continue
+            if kind in self.JOINT_KINDS:
+                joints += 1
+            indices.extend(slot)
+            tokens.extend(fields)
+
+        out[RF_SLICE.start:LF_SLICE.stop] = 0
+        if indices:
+            out[indices] = tokens
+        return joints
+
+    def parseTime(self, message):
+        """
+        Return the simulation time and the game time of message, None if they are missing.
+        """
+        if isinstance(message, str):
+            now = self.timePattern.search(message)
+            gameTime = self.gameTimePattern.search(message)
+        else:
+            now = self.bytesTimePattern.search(message)
+            gameTime = self.bytesGameTimePattern.search(message)
+        return (float(now.group(1)) if now else None,
+                float(gameTime.group(1)) if gameTime else None)
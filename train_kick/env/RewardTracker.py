@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+
+class RewardTracker:
+    """
+    Rolling mean of the returns and lengths of the last window episodes.
+    Episodes are pushed as they end, the sums are kept incrementally in a ring buffer,
+    so add() and mean() are O(1) however long the run is.
+    The sums are recomputed once per lap of the ring, so float errors don't accumulate.
+    """
+
+    def __init__(self, window=100):
+        self.window = window
+        self.rewards = np.zeros(window)
+        self.lengths = np.zeros(window, dtype=np.int64)
+        self.rewardSum = 0.0
+        self.lengthSum = 0
+        self.episodes = 0
+        self.steps = 0
+
+    def add(self, reward, length):
+        index = self.episodes % self.window
+        if self.episodes >= self.window:
+            self.rewardSum -= self.rewards[index]
+            self.lengthSum -= int(self.lengths[index])
+        self.rewards[index] = reward
+        self.lengths[index] = length
+        self.rewardSum += reward
+        self.lengthSum += length
+        self.episodes += 1
+        self.steps += length
+        if index == self.window - 1:
+            self.rewardSum = float(self.rewards.sum())
+
+    def addInfos(self, infos):
+        """
+        Add the episodes ended in a step of a VecEnv, the 'episode' entries of Monitor and TrainKickVecEnv.
+        """
+        for info in infos:
+            episode = info.get('episode')
+            if episode is not None:
+                self.add(episode['r'], episode['l'])
+
+    def count(self):
+        """
+        Number of episodes in the window.
+        """
+        return min(self.episodes, self.window)
+
+    def mean(self):
+        """
+        Mean return of the last window episodes, nan before the first one.
+        """
+        if self.episodes == 0:
+            return float('nan')
+        return self.rewardSum / self.count()
+
+    def meanLength(self):
+        if self.episodes == 0:
+            return float('nan')
+        return self.lengthSum / self.count()
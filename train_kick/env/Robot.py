@@ -5,10 +5,20 @@ import time
 import re
 from enum import Enum, unique
 
+import numpy as np
+
 from train_kick.env.Logger import Logger
 from train_kick.env.TCPClient import AgentConnection
 from train_kick.env.GrandEnvs import GrandEnvs
+from train_kick.env.ActionEncoder import ActionEncoder
+from train_kick.env.Metrics import Metrics
+from train_kick.env.StreamLog import StreamRecorder, AGENT, MONITOR
 from train_kick.env.GrandEnvs import NotFoundPlayerException
+from train_kick.env.FrameReader import frameText
+from train_kick.env.SharedWorld import sharedName
+from train_kick.env.PerceptorParser import PerceptorParser, STATE_SIZE, RESET_INDEX
+from train_kick.env.PerceptorParser import GYR_SLICE, ACC_SLICE, JOINT_SLICE, RF_SLICE, LF_SLICE
+from train_kick.env.PerceptorParser import SPEED_SLICE, LOCATION_SLICE
 
 """
 This is the robot basic model for all kinds of models in RoboCup
@@ -46,6 +56,36 @@ class NeoRobot:
     The range of effectors will be various in different kinds of robots.
     """
     EFFECTOR_RANGE = [7] * 24
+    """
+    The 20 action parameters drive the effectors without head and toes.
+    With suppressEffectors all effectors are sent again every REFRESH_COMMANDS commands.
+    """
+    ACTION_COLUMNS = range(2, 22)
+    REFRESH_COMMANDS = 50
+    """
+    Seconds of one simulation cycle
+    """
+    CYCLE = 0.02
+
+    """
+    Joint attributes in the order of PerceptorParser.JOINTS.
+    (HJ (n hj1) (ax -0.00)) ... (HJ (n hj2) (ax -0.00)) Neck
+    (HJ (n laj1) (ax 0.00)) ... (HJ (n laj4) (ax 0.00)) Left Shoulder Pitch, Yaw, Roll, Arm Yaw
+    (HJ (n llj1) (ax 0.00)) ... (HJ (n llj6) (ax -0.00)) Left Hip YawPitch, Roll, Pitch, Knee, Foot Pitch, Roll
+    (HJ (n rlj1) (ax 0.00)) ... (HJ (n rlj6) (ax 0.00)) Right Hip YawPitch, Roll, Pitch, Knee, Foot Pitch, Roll
+    (HJ (n raj1) (ax 0.00)) ... (HJ (n raj4) (ax -0.00)) Right Shoulder Pitch, Yaw, Roll, Arm Yaw
+    (HJ (n rlj7) (ax 0.00)) (HJ (n llj7) (ax 0.00)) Only for Nao Toe robot, zero for others
+    """
+    JOINT_ATTRIBUTES = [
+        'neckYaw', 'neckPitch', 'leftShoulderPitch', 'leftShoulderYaw',
+        'leftShoulderRoll', 'leftArmYaw', 'leftHipYawPitch', 'leftHipRoll',
+        'leftHipPitch', 'leftKneePitch', 'leftFootPitch', 'leftFootRoll',
+        'rightHipYawPitch', 'rightHipRoll', 'rightHipPitch', 'rightKneePitch',
+        'rightFootPitch', 'rightFootRoll', 'rightShoulderPitch',
+        'rightShoulderYaw', 'rightShoulderRoll', 'rightArmYaw', 'rightToe',
+        'leftToe'
+    ]
+    SPEED_ATTRIBUTES = ['speed' + name[0].upper() + name[1:] for name in JOINT_ATTRIBUTES]
 
     # (GYR (n torso) (rt 0.03 0.00 0.00))
     # (ACC (n torso) (a -0.00 -0.00 0.04))
@@ -65,7 +105,8 @@ class NeoRobot:
         r'\(FRP\s\(n\srf\)\s\(c\s(\-?\d+\.?\d+?)\s(\-?\d+\.?\d+?)\s(\-?\d+\.?\d+?)\)\s\(f\s(\-?\d+\.?\d+?)\s(\-?\d+\.?\d+?)\s(\-?\d+\.?\d+?)\)\)'
     )
 
-    def __init__(self, team, playerNumber, env_id=1, locationX=1, locationY=1, robotType=NeoTypes.NAO):
+    def __init__(self, team, playerNumber, env_id=1, locationX=1, locationY=1, robotType=NeoTypes.NAO,
+                 suppressEffectors=False):
         self.logger.info("init robot " + team + ":" + str(playerNumber))
 
         # Instance Attribute
@@ -76,129 +117,107 @@ class NeoRobot:
         self.locationX = locationX
         self.locationY = locationY
         self.grandEnvs = GrandEnvs()
+        self.parser = PerceptorParser()
+        """
+        Latency histograms of this actor, None if metrics are disabled
+        """
+        self.metrics = Metrics.get(self.name)
+        """
+        Recorder of the received frames of this actor, None if recording is disabled
+        """
+        self.recorder = StreamRecorder.get(self.name)
+        """
+        suppressEffectors omits the effectors whose speed didn't change from the commands,
+        lastCommand holds the sent speeds of the ActionEncoder.
         """
-        (GYR (n torso) (rt 0.00 0.00 0.00)) GyroRatePerceptor
-        (ACC (n torso) (a -0.00 -0.00 9.81)) Accelerometer
-        """
-        self.GYR = [.0, .0, .0]
-        self.ACC = [.0, .0, .0]
-        """
-        (HJ (n hj1) (ax -0.00))
-        (HJ (n hj2) (ax -0.00))
-        """
-        self.neckYaw = .0
-        self.neckPitch = .0
-
-        self.speedNeckYaw = .0
-        self.speedNeckPitch = .0
-        '''
-        (HJ (n laj1) (ax 0.00)) Left Shoulder Pitch
-        (HJ (n laj2) (ax 0.00)) Left Shoulder Yaw
-        (HJ (n laj3) (ax 0.00)) Left Shoulder Roll
-        (HJ (n laj4) (ax 0.00)) Left Arm Yaw
-        '''
-        self.leftShoulderPitch = .0
-        self.leftShoulderYaw = .0
-        self.leftShoulderRoll = .0
-        self.leftArmYaw = .0
-
-        self.speedLeftShoulderPitch = .0
-        self.speedLeftShoulderYaw = .0
-        self.speedLeftShoulderRoll = .0
-        self.speedLeftArmYaw = .0
-        """
-        (HJ (n llj1) (ax 0.00)) Left Hip YawPitch
-        (HJ (n llj2) (ax 0.00)) Left Hip Yaw
-        (HJ (n llj3) (ax 1.84)) Left Hip Roll
-        (HJ (n llj4) (ax 0.00)) Left Knee Pitch
-        (HJ (n llj5) (ax 0.00)) Left Foot Yaw
-        (HJ (n llj6) (ax -0.00)) Left Foot Roll
-        """
-        self.leftHipYawPitch = .0
-        self.leftHipRoll = .0
-        self.leftHipPitch = .0
-        self.leftKneePitch = .0
-        self.leftFootPitch = .0
-        self.leftFootRoll = .0
-
-        self.speedLeftHipYawPitch = .0
-        self.speedLeftHipRoll = .0
-        self.speedLeftHipPitch = .0
-        self.speedLeftKneePitch = .0
-        self.speedLeftFootPitch = .0
-        self.speedLeftFootRoll = .0
-        """
-        (HJ (n rlj1) (ax 0.00)) Right Hip YawPitch
-        (HJ (n rlj2) (ax 0.00)) Right Hip Roll
-        (HJ (n rlj3) (ax 1.84)) Right Hip Pitch
-        (HJ (n rlj4) (ax 0.00)) Right Knee Pitch
-        (HJ (n rlj5) (ax 0.00)) Right Foot Pitch
-        (HJ (n rlj6) (ax 0.00)) Right Foot Roll
-        """
-        self.rightHipYawPitch = .0
-        self.rightHipRoll = .0
-        self.rightHipPitch = .0
-        self.rightKneePitch = .0
-        self.rightFootPitch = .0
-        self.rightFootRoll = .0
-
-        self.speedRightHipYawPitch = .0
-        self.speedRightHipRoll = .0
-        self.speedRightHipPitch = .0
-        self.speedRightKneePitch = .0
-        self.speedRightFootPitch = .0
-        self.speedRightFootRoll = .0
-        """
-        (HJ (n raj1) (ax 0.00)) Right Shoulder Pitch
-        (HJ (n raj2) (ax 0.00)) Right Shoulder Yaw
-        (HJ (n raj3) (ax 0.00)) Right Shoulder Roll
-        (HJ (n raj4) (ax -0.00)) Right Arm Yaw
-        """
-        self.rightShoulderPitch = .0
-        self.rightShoulderYaw = .0
-        self.rightShoulderRoll = .0
-        self.rightArmYaw = .0
-
-        self.speedRightShoulderPitch = .0
-        self.speedRightShoulderYaw = .0
-        self.speedRightShoulderRoll = .0
-        self.speedRightArmYaw = .0
-        """
-        Only for Nao Toe robot
-        """
-        self.rightToe = None
-        self.leftToe = None
-
-        self.speedRightToe = .0
-        self.speedLeftToe = .0
-        """
-        (FRP (n rf) (c 0.00 -0.01 -0.01) (f -0.00 -0.00 22.60))
-        (FRP (n lf) (c -0.00 -0.01 -0.01) (f 0.00 -0.00 22.60))
-        """
-        self.rightForceResistance = [.0, .0, .0, .0, .0, .0]
-        self.leftForceResistance = [.0, .0, .0, .0, .0, .0]
-
-    def joinGame(self, ip="192.168.0.16", port=3100, mport=3200):
-        self.con = AgentConnection(id, self.name, self)
-        self.con.connectServers(ip, port, mport)
+        self.encoder = ActionEncoder(self.EFFECTOR, self.EFFECTOR_RANGE, self.ACTION_COLUMNS)
+        self.lastCommand = np.full(len(self.EFFECTOR), -1, dtype=np.intp) if suppressEffectors else None
+        self.commands = 0
+        """
+        All states live in one vector with the layout of getAllStates(),
+        the attributes(GYR, neckYaw, speedNeckYaw, ...) are views on it.
+        """
+        self.states = np.zeros(STATE_SIZE)
+        self.lastJoints = np.zeros(JOINT_SLICE.stop - JOINT_SLICE.start)
+        """
+        A message is parsed into the scratch vector first, the states only take a complete parse.
+        """
+        self.scratch = np.zeros(LF_SLICE.stop)
+        """
+        Simulation time(time (now ...)) and game time(GS (t ...)) of the current states, -1 before the first message.
+        missedCycles counts the cycles whose perceptor message was never parsed.
+        """
+        self.simTime = -1
+        self.gameTime = -1
+        self.missedCycles = 0
+
+    def joinGame(self, ip="192.168.0.16", port=3100, mport=3200, syncMode=False, group=None, sharedMonitor=False,
+                 latestOnly=False, timeout=10, retries=None):
+        """
+        If group(AgentGroup or AgentLoop) is given, the connection is served by it instead of own threads.
+        If sharedMonitor is True, the locations are read from the MonitorFeed of the server
+        and no own monitor connection is opened.
+        If latestOnly is True, perceptor messages outdated by a newer one are skipped.
+        The servers are tried retries times(forever if None).
+        Return False if they couldn't be connected or a step of the join wasn't acknowledged within timeout seconds.
+        """
+        if (sharedMonitor):
+            self.grandEnvs = GrandEnvs(sharedName(mport))
+            mport = None
+        if (group is not None):
+            self.con = group.createConnection(self.name, self, syncMode, latestOnly)
+        else:
+            self.con = AgentConnection(id, self.name, self, syncMode, latestOnly)
+        if (not self.con.connectServers(ip, port, mport, retries)):
+            return False
         self.con.start()
         """
         Init robot in the game with game commands.
+        The server acknowledges the scene with the first perceptor message,
+        and the init with the player in a monitor scene read after the init was sent,
+        a shared world may still hold the player of a former connection.
         """
-
-        self.con.sendMessage(self.robotType.value)
-
-        time.sleep(1)
-        self.con.sendMessage("(init (unum " + str(self.playerNumber) +
-                             ")(teamname " + self.team + "))")
-        time.sleep(1)
-        self.con.sendMessage("(beam " + str(self.locationX) + " " + str(self.locationY) + " 0.0)")
-        time.sleep(1)
-        self.con.sendMessage("(playMode PlayOn)")
-        time.sleep(1)
+        if(self.team == "sydney1"):
+            team = 0
+        else:
+            team = 1
+        begin = time.time()
+        joined = self.__handshake(self.robotType.value, timeout)
+        initTime = time.time()
+        joined = self.__handshake("(init (unum " + str(self.playerNumber) + ")(teamname " + self.team + "))", timeout,
+                                  lambda: self.grandEnvs.hasPlayer(team, self.playerNumber, initTime)) and joined
+        joined = self.__handshake("(beam " + str(self.locationX) + " " + str(self.locationY) + " 0.0)",
+                                  timeout) and joined
+        joined = self.__handshake("(playMode PlayOn)", timeout) and joined
+        self.logger.info(self.name + " joined in " + str(round(time.time() - begin, 3)) + "s")
+        return joined
+
+    def __handshake(self, message, timeout, acknowledged=None):
+        """
+        Send message and wait until the next perceptor message arrives and acknowledged() is True.
+        Without agent sync mode the sending thread picks the message up in the next cycle,
+        so the perceptor message of the cycle after it is waited for.
+        """
+        count = self.con.messageCount + 1
+        self.con.sendMessage(message)
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if (remaining <= 0):
+                self.logger.error(self.name + " no acknowledgement of " + message + " in " + str(timeout) + "s")
+                return False
+            if (self.con.syncMode):
+                received = self.con.syncCycle(remaining)
+            else:
+                received = self.con.waitMessage(count, remaining)
+                count = self.con.messageCount
+            if (received and (acknowledged is None or acknowledged())):
+                return True
 
     def close(self):
         self.con.close()
+        if self.recorder:
+            self.recorder.flush()
 
     def hasFalled(self):
         if ((abs(self.ACC[0]) > 7
@@ -213,7 +232,59 @@ class NeoRobot:
     #     return ball_loc
 
     def update(self, message):
-
+        """
+        Parse the perceptor message(str or bytes-like) in one pass into the states vector,
+        the speeds are the difference of joints against the previous frame.
+        A message without joints or with a malformed number is logged and skipped.
+        """
+        begin = time.perf_counter_ns() if self.metrics else 0
+        if self.recorder:
+            self.recorder.record(AGENT, message)
+        states = self.states
+        scratch = self.scratch
+        scratch[:] = states[:LF_SLICE.stop]
+        try:
+            joints = self.parser.parse(message, scratch)
+            if joints == 0:
+                self.logger.error("perceptor parse error, message:" + frameText(message))
+                return
+            self.__updateTime(message)
+        except ValueError as e:
+            self.logger.error("perceptor parse error " + repr(e) + ", message:" + frameText(message))
+            return
+        self.lastJoints[:] = states[JOINT_SLICE]
+        states[:LF_SLICE.stop] = scratch
+        np.subtract(states[JOINT_SLICE], self.lastJoints, out=states[SPEED_SLICE])
+        if self.metrics:
+            self.metrics.record("update", begin)
+
+    def updateGrandStates(self, message):
+        """
+        Update the grand envs by a monitor message, the transports call it for the monitor stream.
+        """
+        begin = time.perf_counter_ns() if self.metrics else 0
+        if self.recorder:
+            self.recorder.record(MONITOR, message)
+        self.grandEnvs.updateGrandStates(message)
+        if self.metrics:
+            self.metrics.record("monitorUpdate", begin)
+
+    def __updateTime(self, message):
+        now, gameTime = self.parser.parseTime(message)
+        if now is not None:
+            if self.simTime >= 0:
+                cycles = round((now - self.simTime) / self.CYCLE)
+                if cycles > 1:
+                    self.missedCycles += cycles - 1
+            self.simTime = now
+        if gameTime is not None:
+            self.gameTime = gameTime
+
+    def updateRegex(self, message):
+        """
+        The former regex based parser, kept as reference for update().
+        """
+        message = frameText(message)
         try:
             match1 = NeoRobot.gyrPattern.search(message)
             match2 = NeoRobot.accPattern.search(message)
@@ -331,7 +402,8 @@ class NeoRobot:
 
     def actionToMessage(self, effectors):
         """
-        The number of effectors must be 24, or the order of arrays will be wrong
+        The number of effectors must be 24, or the order of arrays will be wrong.
+        Former formatting of the commands, action() uses the ActionEncoder.
         """
         message = ""
         for i in range(24):
@@ -343,96 +415,65 @@ class NeoRobot:
 
     def action(self, effectors):
         """
-        Change effectors to right foramt with 24 parameters adding head and toe
+        Send the commands of the 20 action parameters, head and toe effectors are zero.
         """
-        effectors2 = [.0, .0]
-        effectors2.extend(effectors)
-        effectors2.extend([.0, .0])
-        message = self.actionToMessage(effectors2)
-        self.con.sendMessage(message)
+        begin = time.perf_counter_ns() if self.metrics else 0
+        self.con.sendMessage(self.encoder.encode(effectors, self.__lastCommand()))
+        if self.metrics:
+            self.metrics.record("action", begin)
+
+    @staticmethod
+    def actionBatch(robots, actions):
+        """
+        Encode the actions(N, 20) of N robots at once and send them.
+        The robots must have the same suppressEffectors.
+        """
+        if len(robots) == 0:
+            return
+        metrics = robots[0].metrics
+        begin = time.perf_counter_ns() if metrics else 0
+        last = None
+        if robots[0].lastCommand is not None:
+            last = np.stack([robot.__lastCommand() for robot in robots])
+        messages = robots[0].encoder.encodeBatch(actions, last)
+        for i, robot in enumerate(robots):
+            if last is not None:
+                robot.lastCommand[:] = last[i]
+            robot.con.sendMessage(messages[i])
+        if metrics:
+            # The batch is shared by its robots
+            duration = (time.perf_counter_ns() - begin) // len(robots)
+            for robot in robots:
+                robot.metrics.recordDuration("action", duration)
+
+    def __lastCommand(self):
+        """
+        Count the command, and forget the sent speeds if all effectors are due again.
+        """
+        self.commands += 1
+        if self.lastCommand is not None and self.commands % self.REFRESH_COMMANDS == 0:
+            self.lastCommand[:] = -1
+        return self.lastCommand
 
-    def getAllStates(self, reset=0):
+    def getAllStates(self, reset=0, out=None):
         """
         GYR 3 + ACC 3 + 22 States + Toe 2 + rl 6 + lf 6 = 42
         Speed 24 + Reset sate 1 + location 3 = 70
+        The states are copied once into out, a new array is returned if out is None.
         """
-        states = [
-            self.GYR[0], self.GYR[1], self.GYR[2], self.ACC[0], self.ACC[1],
-            self.ACC[2]
-        ]
-        states += [self.neckYaw, self.neckPitch]
-        states += [
-            self.leftShoulderPitch, self.leftShoulderYaw,
-            self.leftShoulderRoll, self.leftArmYaw
-        ]
-        states += [
-            self.leftHipYawPitch, self.leftHipRoll, self.leftHipPitch,
-            self.leftKneePitch, self.leftFootPitch, self.leftFootRoll
-        ]
-        states += [
-            self.rightHipYawPitch, self.rightHipRoll, self.rightHipPitch,
-            self.rightKneePitch, self.rightFootPitch, self.rightFootRoll
-        ]
-        states += [
-            self.rightShoulderPitch, self.rightShoulderYaw,
-            self.rightShoulderRoll, self.rightArmYaw
-        ]
-
-        if (self.rightToe is not None and self.leftToe is not None):
-            states += [self.rightToe] + [self.leftToe]
-        else:
-            states += [0] + [0]
-        """
-        Append rf and lf into states
-        """
-        states += [
-            self.rightForceResistance[0], self.rightForceResistance[1],
-            self.rightForceResistance[2], self.rightForceResistance[3],
-            self.rightForceResistance[4], self.rightForceResistance[5]
-        ]
-        states += [
-            self.leftForceResistance[0], self.leftForceResistance[1],
-            self.leftForceResistance[2], self.leftForceResistance[3],
-            self.leftForceResistance[4], self.leftForceResistance[5]
-        ]
-
-        """
-        Speed
-        """
-        states += [self.speedNeckYaw, self.speedNeckPitch]
-        states += [
-            self.speedLeftShoulderPitch, self.speedLeftShoulderYaw,
-            self.speedLeftShoulderRoll, self.speedLeftArmYaw
-        ]
-        states += [
-            self.speedLeftHipYawPitch, self.speedLeftHipRoll, self.speedLeftHipPitch,
-            self.speedLeftKneePitch, self.speedLeftFootPitch, self.speedLeftFootRoll
-        ]
-        states += [
-            self.speedRightHipYawPitch, self.speedRightHipRoll, self.speedRightHipPitch,
-            self.speedRightKneePitch, self.speedRightFootPitch, self.speedRightFootRoll
-        ]
-        states += [
-            self.speedRightShoulderPitch, self.speedRightShoulderYaw,
-            self.speedRightShoulderRoll, self.speedRightArmYaw
-        ]
-
-        if (self.rightToe is not None and self.leftToe is not None):
-            states += [self.speedRightToe] + [self.speedLeftToe]
-        else:
-            states += [0] + [0]
-
+        if out is None:
+            out = np.empty(STATE_SIZE)
+        out[:] = self.states
         """
         reset
         """
-        states += [reset]
+        out[RESET_INDEX] = reset
         """
         locationX, Y, Z
         """
-        location = self.__getRobotLocation()
-        states += [location[0], location[1], location[2]]
+        out[LOCATION_SLICE] = self.__getRobotLocation()
 
-        return states
+        return out
 
     def getRobotPitch(self):
         """
@@ -470,3 +511,31 @@ class NeoRobot:
 
     def __str__(self):
         return self.name
+
+
+def stateProperty(index):
+    """
+    Attribute view on one element or one slice of NeoRobot.states
+    """
+    def getState(self):
+        return self.states[index]
+
+    def setState(self, value):
+        self.states[index] = value
+
+    return property(getState, setState)
+
+
+"""
+(GYR (n torso) (rt 0.00 0.00 0.00)) GyroRatePerceptor
+(ACC (n torso) (a -0.00 -0.00 9.81)) Accelerometer
+(FRP (n rf) (c 0.00 -0.01 -0.01) (f -0.00 -0.00 22.60))
+(FRP (n lf) (c -0.00 -0.01 -0.01) (f 0.00 -0.00 22.60))
+"""
+NeoRobot.GYR = stateProperty(GYR_SLICE)
+NeoRobot.ACC = stateProperty(ACC_SLICE)
+NeoRobot.rightForceResistance = stateProperty(RF_SLICE)
+NeoRobot.leftForceResistance = stateProperty(LF_SLICE)
+for i in range(len(NeoRobot.JOINT_ATTRIBUTES)):
+    setattr(NeoRobot, NeoRobot.JOINT_ATTRIBUTES[i], stateProperty(JOINT_SLICE.start + i))
+    setattr(NeoRobot, NeoRobot.SPEED_ATTRIBUTES[i], stateProperty(SPEED_SLICE.start + i))
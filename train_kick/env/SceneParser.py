@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+
+import re
+
+from train_kick.env.Logger import Logger
+
+
+class SceneParser:
+    """
+    Parser for the scene graph of (reqfullstate) monitor messages.
+    (nd TRF (SLT <16 numbers of the homogenous matrix>)(nd StaticMesh (load models/soccerball.obj) ...))
+
+    The first message is parsed as S-expression in one pass to learn which (SLT ...) matrix
+    belongs to the ball and to the body and head of each player(naobody, naohead meshes).
+    The layout of the scene graph is stable between frames, so the following messages take a
+    fast path: the message is split at every (SLT and only the learned matrices are converted.
+    Messages are tokenized as bytes, they are never decoded.
+    If the number of matrices or the meshes around the learned ones differ,
+    the message is parsed again in full.
+
+    Delta messages (RDS 0 1) describe the same nodes in the same order, but only the
+    transforms which changed carry a (SLT ...), e.g. (nd (nd (SLT ...))(nd)).
+    They are applied to the scene model of the last full message by the preorder number of the nodes.
+    A delta is about a third of the bytes of a full scene, but applying one is only about 20% faster
+    than the fast path of a full scene(~48us against ~61us on the benchmark corpus): locating the nodes
+    needs a split at every (nd, which costs half of it. The gain of deltas is mostly in the bytes sent.
+    """
+    logger = Logger.getLogger("SceneParser")
+
+    """
+    Tokens of the full parse: (nd, (SLT, (load models/...), matNum1 matLeft, ( and )
+    """
+    tokenPattern = re.compile(rb'(\(nd\b)|(\(SLT\b)|\(load models/([^()\s]*)\)|matNum(\d+) mat(Left|Right)|(\()|(\))')
+
+    def __init__(self):
+        self.matrices = None
+        self.anchors = []
+        self.ballIndex = None
+        self.playerIndices = {}
+        """
+        Number of nodes and {preorder number: (key, 0 head or 1 body)} of the learned layout,
+        the key of the ball is None.
+        """
+        self.nodeCount = None
+        self.trackedNodes = {}
+        """
+        The scene model, updated by full and delta messages
+        """
+        self.ball = None
+        self.players = {}
+        self.deltas = 0
+        self.fullParses = 0
+        self.fastParses = 0
+
+    def parse(self, message, start=0):
+        """
+        Parse message(bytes-like or str) from start.
+        return ball location or None, {(team, playerNumber): (head location, body location)}
+        team zero means leftTeam, while one means rightTeam.
+        """
+        message = self.__bytes(message)
+        parts = message.split(b'(SLT')
+        if self.__matchLayout(parts):
+            self.fastParses += 1
+        else:
+            self.__learnLayout(message, start, parts)
+            self.fullParses += 1
+
+        ball = None
+        if self.ballIndex is not None:
+            ball = self.translation(parts[self.ballIndex])
+        players = {}
+        for key, (headIndex, bodyIndex) in self.playerIndices.items():
+            players[key] = [self.translation(parts[headIndex]), self.translation(parts[bodyIndex])]
+        self.ball = ball
+        self.players = players
+        return ball, players
+
+    def reset(self):
+        """
+        Forget the learned layout, the next message is parsed in full
+        and deltas are refused until then.
+        """
+        self.matrices = None
+        self.nodeCount = None
+
+    def applyDelta(self, message, start=0):
+        """
+        Apply a delta message(bytes-like or str) from start to the scene model.
+        Return False if there is no model yet or the message doesn't describe
+        the same number of nodes, then a full state is needed.
+        """
+        if self.nodeCount is None:
+            return False
+        message = self.__bytes(message)
+        """
+        parts[n + 1] follows the (nd of the node n in preorder,
+        it starts with the matrix if the transform of the node changed.
+        """
+        parts = message.split(b'(nd')
+        if len(parts) - 1 != self.nodeCount:
+            self.logger.warning("delta describes " + str(len(parts) - 1) + " nodes, the scene has " +
+                                str(self.nodeCount))
+            return False
+
+        for node, (key, part) in self.trackedNodes.items():
+            matrix = parts[node + 1].lstrip()
+            if not matrix.startswith(b'(SLT'):
+                continue
+            if key is None:
+                self.ball = self.translation(matrix[4:])
+            else:
+                self.players[key][part] = self.translation(matrix[4:])
+        self.deltas += 1
+        return True
+
+    @staticmethod
+    def __bytes(message):
+        """
+        bytes and bytearray are split as they are, a memoryview of the reader buffer is copied once.
+        The header before start holds no (nd or (SLT, so the message isn't cut at start.
+        """
+        if isinstance(message, (bytes, bytearray)):
+            return message
+        if isinstance(message, str):
+            return message.encode('ascii')
+        return bytes(message)
+
+    def __matchLayout(self, parts):
+        """
+        The layout is the same if the number of matrices is, and every learned mesh
+        and player material is still found after the same matrix.
+        """
+        if len(parts) != self.matrices:
+            return False
+        for index, anchor in self.anchors:
+            if anchor not in parts[index]:
+                return False
+        return True
+
+    def __learnLayout(self, message, start, parts):
+        """
+        Full S-expression parse. parts[i] starts with the i-th matrix, which belongs
+        to the innermost open node. The meshes and materials after it are the anchors of the layout.
+        """
+        nodes = []
+        nodeIds = []
+        nodeCount = 0
+        isNode = []
+        matrix = 0
+        mesh = None
+        lastPlayer = None
+        ballIndex = None
+        anchors = []
+        ballNode = None
+        bodies = {}
+        heads = {}
+        for match in self.tokenPattern.finditer(message, start):
+            nd, slt, load, num, team, openParen, closeParen = match.groups()
+            if nd:
+                nodes.append(None)
+                nodeIds.append(nodeCount)
+                nodeCount += 1
+                isNode.append(True)
+            elif slt:
+                isNode.append(False)
+                matrix += 1
+                if nodes:
+                    nodes[-1] = matrix
+            elif load:
+                mesh = load
+                if mesh.startswith(b'soccerball') and len(nodes) >= 2:
+                    ballIndex = nodes[-2]
+                    ballNode = nodeIds[-2]
+                    anchors.append((matrix, match.group(0)))
+                elif mesh.startswith(b'naohead') and len(nodes) >= 2 and lastPlayer is not None:
+                    heads[lastPlayer] = (nodes[-2], nodeIds[-2])
+                    anchors.append((matrix, match.group(0)))
+            elif num:
+                if mesh is not None and mesh.startswith(b'naobody') and len(nodes) >= 3:
+                    lastPlayer = (0 if team == b'Left' else 1, int(num))
+                    bodies[lastPlayer] = (nodes[-3], nodeIds[-3])
+                    anchors.append((matrix, match.group(0)))
+            elif openParen:
+                isNode.append(False)
+            elif closeParen and isNode:
+                if isNode.pop():
+                    nodes.pop()
+                    nodeIds.pop()
+
+        self.matrices = len(parts)
+        self.anchors = anchors
+        self.ballIndex = ballIndex
+        self.playerIndices = {}
+        self.trackedNodes = {} if ballNode is None else {ballNode: (None, 0)}
+        for key, (body, bodyNode) in bodies.items():
+            if key in heads and heads[key][0] is not None and body is not None:
+                head, headNode = heads[key]
+                self.playerIndices[key] = (head, body)
+                self.trackedNodes[headNode] = (key, 0)
+                self.trackedNodes[bodyNode] = (key, 1)
+        self.nodeCount = nodeCount
+        self.logger.debug("scene layout learned, matrices:" + str(matrix) +
+                          " players:" + str(len(self.playerIndices)))
+
+    def translation(self, part):
+        """
+        SLT is column-major, the translation is in the fourth column.
+        """
+        slist = part.split(None, 16)
+        return [float(slist[12]), float(slist[13]), float(slist[14])]
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+
+from train_kick.env.Logger import Logger
+
+
+class ServerPool:
+    """
+    This class launches and owns the simspark servers of a training run.
+    Server j listens on agent port port + j and monitor port mport + j.
+    All servers are started at once, a server is ready as soon as both of its ports
+    accept connections, instead of sleeping a fixed time per server.
+    """
+    logger = Logger.getLogger("ServerPool")
+
+    def __init__(self, servers=1, ip="127.0.0.1", port=3100, mport=3200, logDir="./logs/",
+                 command=("simspark",), maxRestarts=3):
+        self.servers = servers
+        self.ip = ip
+        self.port = port
+        self.mport = mport
+        self.logDir = logDir
+        self.command = list(command)
+        self.maxRestarts = maxRestarts
+        self.processes = [None] * servers
+        self.logFiles = [None] * servers
+        self.restarts = [0] * servers
+        self.lock = threading.Lock()
+        self.isStopped = False
+        self.watcher = None
+
+    def ports(self, index):
+        return self.port + index, self.mport + index
+
+    def pids(self):
+        return [process.pid if process is not None else None for process in self.processes]
+
+    def start(self):
+        os.makedirs(self.logDir, exist_ok=True)
+        for index in range(self.servers):
+            self.__launch(index)
+
+    def __launch(self, index):
+        port, mport = self.ports(index)
+        if self.__accepts(port) or self.__accepts(mport):
+            self.logger.warning("port " + str(port) + " or " + str(mport) + " is already in use")
+        args = self.command + ["--agent-port", str(port), "--server-port", str(mport)]
+        if self.logFiles[index] is None:
+            self.logFiles[index] = open(os.path.join(self.logDir, "server" + str(index) + ".log"), "ab")
+        """
+        Every server gets its own session, so close() can signal its whole process group.
+        """
+        self.processes[index] = subprocess.Popen(args, stdout=self.logFiles[index], stderr=subprocess.STDOUT,
+                                                 start_new_session=True)
+        self.logger.info(" ".join(args) + " pid:" + str(self.processes[index].pid))
+
+    def __accepts(self, port):
+        try:
+            with socket.create_connection((self.ip, port), timeout=0.5):
+                return True
+        except OSError:
+            return False
+
+    def waitReady(self, timeout=60, interval=0.1):
+        """
+        Probe the ports of all servers until they accept connections,
+        servers which exit meanwhile are restarted.
+        Return True if all servers are ready within timeout.
+        """
+        deadline = time.time() + timeout
+        waiting = set(range(self.servers))
+        while waiting:
+            for index in sorted(waiting):
+                if self.__checkProcess(index) is False:
+                    self.logger.error("server " + str(index) + " is not running")
+                    return False
+                port, mport = self.ports(index)
+                if self.__accepts(port) and self.__accepts(mport):
+                    self.logger.info("server " + str(index) + " is ready after " +
+                                     str(round(timeout - deadline + time.time(), 2)) + "s")
+                    waiting.discard(index)
+            if not waiting:
+                break
+            if time.time() > deadline:
+                self.logger.error("servers " + str(sorted(waiting)) + " are not ready in " + str(timeout) + "s")
+                return False
+            time.sleep(interval)
+        return True
+
+    def __checkProcess(self, index):
+        """
+        Restart the server if its process exited.
+        Return False if it isn't running, None if it was restarted and True if it is running.
+        """
+        with self.lock:
+            process = self.processes[index]
+            if self.isStopped or process is None:
+                return False
+            code = process.poll()
+            if code is None:
+                return True
+            if self.restarts[index] >= self.maxRestarts:
+                self.logger.error("server " + str(index) + " exited with " + str(code) + ", giving up")
+                self.processes[index] = None
+                return False
+            self.restarts[index] += 1
+            self.logger.warning("server " + str(index) + " exited with " + str(code) + ", restart " +
+                                str(self.restarts[index]) + "/" + str(self.maxRestarts))
+            self.__launch(index)
+            return None
+
+    def startWatcher(self, interval=5):
+        """
+        Restart crashed servers in the background.
+        """
+        def watch():
+            while not self.isStopped:
+                for index in range(self.servers):
+                    self.__checkProcess(index)
+                time.sleep(interval)
+
+        self.watcher = threading.Thread(target=watch, name="ServerPoolWatcher", daemon=True)
+        self.watcher.start()
+
+    def close(self, timeout=5):
+        with self.lock:
+            self.isStopped = True
+            processes = [process for process in self.processes if process is not None]
+            for process in processes:
+                self.__signal(process, signal.SIGTERM)
+
+            deadline = time.time() + timeout
+            for process in processes:
+                try:
+                    process.wait(max(0, deadline - time.time()))
+                except subprocess.TimeoutExpired:
+                    self.logger.warning("server pid:" + str(process.pid) + " doesn't stop, kill it")
+                    self.__signal(process, signal.SIGKILL)
+                    process.wait()
+            self.processes = [None] * self.servers
+
+            for logFile in self.logFiles:
+                if logFile is not None:
+                    logFile.close()
+            self.logFiles = [None] * self.servers
+
+    def __signal(self, process, sig):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
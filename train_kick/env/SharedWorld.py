@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+
+import time
+
+import numpy as np
+from multiprocessing import shared_memory
+
+
+def sharedName(mport):
+    """
+    Name of the shared block of the server with monitor port mport.
+    """
+    return "trainkick_monitor_" + str(mport)
+
+
+class SharedWorld:
+    """
+    Ball and player locations of one server in a multiprocessing.shared_memory block.
+    It is written by one MonitorFeed and read lock-free by every actor process:
+    the sequence counter is odd while the writer is busy, a reader retries
+    if the counter was odd or changed while it copied (seqlock).
+
+    sequence 1 + readTime 1 + players (2 teams, 11 unums, head/body, xyz) + valid (2, 11) + ball 3
+    """
+    TEAMS = 2
+    UNUMS = 11
+    HEAD = 0
+    BODY = 1
+    SIZE = 8 * (1 + 1 + TEAMS * UNUMS * 2 * 3 + TEAMS * UNUMS + 3)
+    RETRIES = 100
+
+    def __init__(self, name, create=False):
+        if create:
+            try:
+                self.shm = shared_memory.SharedMemory(name, create=True, size=self.SIZE)
+            except FileExistsError:
+                # left over by a run which crashed
+                stale = shared_memory.SharedMemory(name)
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(name, create=True, size=self.SIZE)
+        else:
+            self.shm = shared_memory.SharedMemory(name)
+
+        data = np.ndarray((self.SIZE // 8,), dtype=np.float64, buffer=self.shm.buf)
+        self.data = data
+        self.sequence = np.ndarray((1,), dtype=np.uint64, buffer=self.shm.buf)
+        self.readTime = data[1:2]
+        offset = 2
+        self.players = data[offset:offset + self.TEAMS * self.UNUMS * 6].reshape(self.TEAMS, self.UNUMS, 2, 3)
+        offset += self.TEAMS * self.UNUMS * 6
+        self.valid = data[offset:offset + self.TEAMS * self.UNUMS].reshape(self.TEAMS, self.UNUMS)
+        offset += self.TEAMS * self.UNUMS
+        self.ball = data[offset:offset + 3]
+        if create:
+            data[:] = 0
+            self.readTime[0] = -1
+
+    def publish(self, players, valid, ball, readTime):
+        self.sequence[0] += 1
+        self.players[:] = players
+        self.valid[:] = valid
+        self.ball[:] = ball
+        self.readTime[0] = readTime
+        self.sequence[0] += 1
+
+    def publishGrandEnvs(self, grandEnvs):
+        self.publish(grandEnvs.players, grandEnvs.valid, grandEnvs.ball, grandEnvs.lastReadTime)
+
+    def read(self, *arrays):
+        """
+        Return a consistent copy of array, which is one of the arrays of this block,
+        or a list of copies of several arrays which are consistent with each other.
+        """
+        copies = [array.copy() for array in arrays]
+        for i in range(self.RETRIES):
+            sequence = int(self.sequence[0])
+            if sequence % 2 == 0:
+                for copy, array in zip(copies, arrays):
+                    copy[...] = array
+                if int(self.sequence[0]) == sequence:
+                    break
+            time.sleep(0)
+        return copies[0] if len(copies) == 1 else copies
+
+    def readWorld(self):
+        """
+        Return consistent copies of players, valid(as bool) and ball.
+        """
+        data = self.read(self.data[2:])
+        players = self.TEAMS * self.UNUMS * 6
+        valid = players + self.TEAMS * self.UNUMS
+        return (data[:players].reshape(self.TEAMS, self.UNUMS, 2, 3),
+                data[players:valid].reshape(self.TEAMS, self.UNUMS) > 0,
+                data[valid:valid + 3])
+
+    def getPlayer(self, team, playerNumber):
+        """
+        Return (head location, body location) or None if the player was never seen.
+        """
+        if playerNumber < 1 or playerNumber > self.UNUMS:
+            return None
+        # The flag is copied in the same read, so it belongs to the same frame as the locations
+        player, valid = self.read(self.players[team, playerNumber - 1], self.valid[team, playerNumber - 1:playerNumber])
+        if valid[0] == 0:
+            return None
+        return player[self.HEAD].tolist(), player[self.BODY].tolist()
+
+    def getBallLocation(self):
+        return self.read(self.ball).tolist()
+
+    def getReadTime(self):
+        return float(self.readTime[0])
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
@@ -0,0 +1,450 @@
+#!/usr/bin/python3
+
+import argparse
+import math
+import re
+import selectors
+import socket
+import struct
+import threading
+import time
+
+from train_kick.env.Logger import Logger
+from train_kick.env.PerceptorParser import JOINTS
+
+
+def slt(x, y, z):
+    return "(SLT 1 0 0 0 -0 1 0 0 0 0 1 0 %.4g %.4g %.4g 1)" % (x, y, z)
+
+
+class ScenePart:
+    """
+    A subtree of the scene graph, e.g. the ball or the head of a player.
+    tree is (offset, mesh, children): transform nodes have an offset to the location of the part,
+    or a fixed translation if it is a tuple ('fixed', x, y, z), mesh nodes have offset None.
+    The full and the delta texts are format templates, only the translations are filled in.
+    """
+
+    def __init__(self, tree, location):
+        self.offsets = []
+        full, changed, unchanged = self.__compile(tree)
+        self.full = full
+        self.changed = changed
+        self.unchanged = unchanged
+        self.location = tuple(location)
+        self.moved = True
+
+    def __compile(self, node):
+        offset, mesh, children = node
+        full = []
+        changed = []
+        unchanged = []
+        for child in children:
+            parts = self.__compile(child)
+            full.append(parts[0])
+            changed.append(parts[1])
+            unchanged.append(parts[2])
+        if offset is None:
+            return ("(nd StaticMesh (setVisible 1) " + mesh + ")", "(nd)", "(nd)")
+        if offset[0] == 'fixed':
+            matrix = slt(*offset[1:]).replace('{', '{{').replace('}', '}}')
+            return ("(nd TRF " + matrix + "".join(full) + ")", "(nd" + "".join(changed) + ")",
+                    "(nd" + "".join(unchanged) + ")")
+        slot = "{" + str(len(self.offsets)) + "}"
+        self.offsets.append(offset)
+        return ("(nd TRF " + slot + "".join(full) + ")", "(nd " + slot + "".join(changed) + ")",
+                "(nd" + "".join(unchanged) + ")")
+
+    def moveTo(self, location):
+        location = tuple(location)
+        if location != self.location:
+            self.location = location
+            self.moved = True
+
+    def matrices(self):
+        x, y, z = self.location
+        return [slt(x + dx, y + dy, z + dz) for dx, dy, dz in self.offsets]
+
+    def renderFull(self):
+        return self.full.format(*self.matrices())
+
+    def renderDelta(self):
+        if self.moved:
+            return self.changed.format(*self.matrices())
+        return self.unchanged
+
+
+class Player:
+    """
+    A robot in the scene, its parts follow the body location.
+    The body and head subtrees are laid out as in the scenes of simspark, so the SceneParser finds them.
+    """
+    BODY_HEIGHT = 0.36
+    HEAD_HEIGHT = 0.525
+    LIMBS = ('naoneck', 'naoshoulderl', 'naoupperarml', 'naoelbowl', 'naolowerarml',
+             'naoshoulderr', 'naoupperarmr', 'naoelbowr', 'naolowerarmr', 'naohipl', 'naothighl',
+             'naoshankl', 'naoankle', 'naofootl', 'naohipr', 'naothighr', 'naoshankr', 'naofootr')
+
+    def __init__(self, unum, side, x, y, limbs=True):
+        self.unum = unum
+        self.side = side
+        materials = "(resetMaterials matNum" + str(unum) + " mat" + side + " matType0 naowhite)"
+        body = ((0, 0, 0), None, [(('fixed', 0, 0, 0), None,
+                                   [(None, "(load models/naobody0.obj) (sSc 0.1 0.1 0.1)" + materials, [])])])
+        headMesh = (None, "(load models/naohead.obj) (sSc 0.1 0.1 0.1)" + materials, [])
+        head = ((0, 0, 0.09), None, [((0, 0, 0.1), None, [((0, 0, 0.165), None, [headMesh])])])
+        self.parts = [ScenePart(body, (x, y, self.BODY_HEIGHT)), ScenePart(head, (x, y, self.BODY_HEIGHT))]
+        if limbs:
+            for i, limb in enumerate(self.LIMBS):
+                offset = (0.05 * math.cos(i), 0.05 * math.sin(i), 0.4 - 0.02 * i - self.BODY_HEIGHT)
+                mesh = (None, "(load models/" + limb + ".obj) (sSc 0.1 0.1 0.1)" + materials, [])
+                self.parts.append(ScenePart((offset, None, [mesh]), (x, y, self.BODY_HEIGHT)))
+        self.moveTo(x, y)
+
+    def moveTo(self, x, y):
+        for part in self.parts:
+            part.moveTo((x, y, self.BODY_HEIGHT))
+
+
+class AgentClient:
+    """
+    Agent connection of the stand-in server. The joints follow the effector speeds.
+    """
+    EFFECTORS = {name.replace('j', 'e', 1): i for i, name in enumerate(JOINTS)}
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.hasScene = False
+        self.synced = False
+        self.player = None
+        self.side = None
+        self.joints = [0.0] * len(JOINTS)
+        self.speeds = [0.0] * len(JOINTS)
+        self.recording = 0
+
+
+class MonitorClient:
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.needFullState = True
+
+
+class StandInServer:
+    """
+    A stand-in for simspark without physics, which speaks its protocol
+    (4-byte length prefix) on the agent and the monitor port.
+    Agents send (scene), (init (unum)(teamname)), (beam), (syn) and effector commands,
+    they get a perceptor message every cycle with the time, the game state and their joints,
+    which follow the effector speeds. Monitors get the scene graph with the ball and all players
+    as a full message, then as deltas, a full message again after (reqfullstate).
+    The trainer commands (agent (unum)(team)(move|pos)) and (ball (pos)) move the objects.
+
+    cycle is the wall clock duration of a cycle of 0.02 simulation seconds, 0 runs as fast as possible.
+    In sync mode, like $agentSyncMode of simspark, a cycle waits until every agent sent (syn).
+    Perceptor and monitor messages can be replayed from recordings instead, one message per line.
+
+    Like simspark a server takes two teams of 11 players, more agents are spread over the servers
+    of a ServerPool with command=("python", "-m", "train_kick.env.StandInServer").
+    """
+    logger = Logger.getLogger("StandInServer")
+
+    STEP = 0.02
+    MAX_UNUM = 11
+    initPattern = re.compile(r'\(init \(unum (\d+)\)\s*\(teamname ([^()\s]+)\)\)')
+    beamPattern = re.compile(r'\(beam ([^()]*)\)')
+    effectorPattern = re.compile(r'\((\w+) (-?[\d.]+(?:e-?\d+)?)\)')
+    agentCommandPattern = re.compile(r'\(agent \(unum (\d+)\)\s*\(team (Left|Right)\)\s*\((?:move|pos) ([^()]*)\)')
+    ballCommandPattern = re.compile(r'\(ball \(pos ([^()]*)\)')
+    timePattern = re.compile(r'\(now [^()]*\)')
+
+    def __init__(self, port=3100, mport=3200, cycle=0.02, syncMode=False, limbs=True,
+                 perceptorRecording=None, monitorRecording=None, host="127.0.0.1"):
+        self.port = port
+        self.mport = mport
+        self.cycle = cycle
+        self.syncMode = syncMode
+        self.limbs = limbs
+        self.host = host
+        self.perceptors = self.__loadRecording(perceptorRecording)
+        self.scenes = self.__loadRecording(monitorRecording)
+
+        self.selector = selectors.DefaultSelector()
+        self.agents = []
+        self.monitors = []
+        self.teams = []
+        self.players = {}
+        self.ball = ScenePart(((0, 0, 0), None, [(None, "(load models/soccerball.obj) (sSc 0.042 0.042 0.042)"
+                                                        "(resetMaterials soccerball_rcs-soccerball.png)", [])]),
+                              (0, 0, 0.042))
+        self.field = [ScenePart((('fixed', 0.5 * i - 5, 10, 0), None,
+                                 [(None, "(load StdUnitBox) (sSc 1 0.01 0.01) (sMat matLine)", [])]), (0, 0, 0))
+                      for i in range(20)]
+        self.structureChanged = True
+        self.simTime = 0.0
+        self.cycles = 0
+        self.stats = {"perceptors": 0, "fullScenes": 0, "deltaScenes": 0, "bytesSent": 0}
+        self.isStopped = False
+        self.thread = None
+
+    def __loadRecording(self, path):
+        if path is None:
+            return None
+        with open(path) as f:
+            return [line.strip().encode('ascii') for line in f if line.strip()]
+
+    def listen(self):
+        for port, isMonitor in ((self.port, False), (self.mport, True)):
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((self.host, port))
+            server.listen(128)
+            server.setblocking(False)
+            self.selector.register(server, selectors.EVENT_READ, ("accept", isMonitor))
+        self.logger.info("stand-in server on " + str(self.port) + "/" + str(self.mport) +
+                         " cycle:" + str(self.cycle) + " sync:" + str(self.syncMode))
+
+    def start(self):
+        """
+        Listen and serve in a background thread.
+        """
+        self.listen()
+        self.thread = threading.Thread(target=self.serve, name="StandInServer", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.isStopped = True
+        if self.thread is not None:
+            self.thread.join(1)
+        for key in list(self.selector.get_map().values()):
+            key.fileobj.close()
+        self.selector.close()
+
+    def serve(self):
+        nextCycle = time.perf_counter()
+        while not self.isStopped:
+            now = time.perf_counter()
+            if now >= nextCycle and self.__ready():
+                self.__step()
+                nextCycle = max(nextCycle + self.__cycle(), now)
+            if self.__ready():
+                timeout = max(0.0, nextCycle - time.perf_counter())
+            else:
+                timeout = 0.1
+            for key, mask in self.selector.select(timeout):
+                kind, client = key.data
+                if kind == "accept":
+                    self.__accept(key.fileobj, client)
+                else:
+                    self.__read(client, kind == "monitor")
+
+    def __cycle(self):
+        """
+        As fast as possible only runs as fast as the agents in sync mode, without agents it is real time.
+        """
+        if self.cycle > 0:
+            return self.cycle
+        if self.syncMode and not any(agent.hasScene for agent in self.agents):
+            return self.STEP
+        return 0
+
+    def __ready(self):
+        """
+        In sync mode the cycle waits for (syn) of all connected agents, also of those which didn't send
+        their scene yet, or a joining agent whose scene arrives after the (syn) of the others misses the cycle.
+        """
+        if not self.syncMode:
+            return True
+        return all(agent.synced for agent in self.agents)
+
+    def __accept(self, server, isMonitor):
+        sock, address = server.accept()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if isMonitor:
+            client = MonitorClient(sock)
+            self.monitors.append(client)
+            self.selector.register(sock, selectors.EVENT_READ, ("monitor", client))
+        else:
+            client = AgentClient(sock)
+            self.agents.append(client)
+            self.selector.register(sock, selectors.EVENT_READ, ("agent", client))
+
+    def __drop(self, client, isMonitor):
+        self.selector.unregister(client.sock)
+        client.sock.close()
+        if isMonitor:
+            self.monitors.remove(client)
+            return
+        self.agents.remove(client)
+        if client.player is not None:
+            del self.players[(client.player.side, client.player.unum)]
+            self.structureChanged = True
+
+    def __read(self, client, isMonitor):
+        try:
+            data = client.sock.recv(65536)
+        except OSError:
+            data = None
+        if not data:
+            self.__drop(client, isMonitor)
+            return
+        buffer = client.buffer
+        buffer.extend(data)
+        while len(buffer) >= 4:
+            length = struct.unpack_from("!I", buffer)[0]
+            if len(buffer) < 4 + length:
+                break
+            message = bytes(buffer[4:4 + length]).decode('ascii', 'replace')
+            del buffer[:4 + length]
+            if isMonitor:
+                self.__monitorMessage(client, message)
+            else:
+                self.__agentMessage(client, message)
+
+    def __agentMessage(self, agent, message):
+        if message.startswith("(scene"):
+            # The client sends (init ...) and (syn) in the same frame
+            agent.hasScene = True
+        init = self.initPattern.search(message)
+        if init is not None and agent.player is None:
+            self.__initPlayer(agent, int(init.group(1)), init.group(2))
+        beam = self.beamPattern.search(message)
+        if beam is not None and agent.player is not None:
+            x, y = [float(v) for v in beam.group(1).split()[:2]]
+            agent.player.moveTo(x, y)
+        for name, value in self.effectorPattern.findall(message):
+            index = AgentClient.EFFECTORS.get(name)
+            if index is not None:
+                agent.speeds[index] = float(value)
+        if "(syn)" in message:
+            agent.synced = True
+
+    def __initPlayer(self, agent, unum, teamname):
+        if teamname not in self.teams:
+            if len(self.teams) == 2:
+                self.logger.error("third team " + teamname + " refused")
+                return
+            self.teams.append(teamname)
+        side = 'Left' if self.teams.index(teamname) == 0 else 'Right'
+        if unum == 0:
+            unum = 1 + max([p.unum for p in self.players.values() if p.side == side] + [0])
+        if unum > self.MAX_UNUM or (side, unum) in self.players:
+            self.logger.error("player " + side + " " + str(unum) + " refused")
+            return
+        agent.player = Player(unum, side, -unum, -5 if side == 'Left' else 5, self.limbs)
+        agent.side = side.lower()
+        self.players[(side, unum)] = agent.player
+        self.structureChanged = True
+
+    def __monitorMessage(self, monitor, message):
+        if "(reqfullstate)" in message:
+            monitor.needFullState = True
+        for unum, side, values in self.agentCommandPattern.findall(message):
+            player = self.players.get((side, int(unum)))
+            if player is not None:
+                x, y = [float(v) for v in values.split()[:2]]
+                player.moveTo(x, y)
+        for values in self.ballCommandPattern.findall(message):
+            self.ball.moveTo([float(v) for v in values.split()[:3]])
+
+    def __step(self):
+        self.cycles += 1
+        self.simTime += self.STEP
+        for agent in list(self.agents):
+            agent.synced = False
+            if not agent.hasScene:
+                continue
+            joints = agent.joints
+            for i, speed in enumerate(agent.speeds):
+                if speed:
+                    joints[i] = max(-120.0, min(120.0, joints[i] + math.degrees(speed) * self.STEP))
+            self.__send(agent, self.__perceptor(agent), False)
+            self.stats["perceptors"] += 1
+        if self.monitors:
+            self.__sendScene()
+
+    def __perceptor(self, agent):
+        if self.perceptors is not None:
+            message = self.perceptors[agent.recording % len(self.perceptors)]
+            agent.recording += 1
+            now = "(now %.2f)" % self.simTime
+            return self.timePattern.sub(lambda match: now, message.decode('ascii')).encode('ascii')
+        player = agent.player
+        gameState = "(GS (t %.2f) (pm PlayOn))" % self.simTime
+        if player is not None:
+            gameState = "(GS (unum %d) (team %s) (t %.2f) (pm PlayOn))" % (player.unum, agent.side, self.simTime)
+        parts = ["(time (now %.2f))" % self.simTime, gameState,
+                 "(GYR (n torso) (rt 0.00 0.00 0.00))(ACC (n torso) (a 0.00 0.00 9.81))"]
+        parts.extend(["(HJ (n %s) (ax %.2f))" % (name, angle) for name, angle in zip(JOINTS, agent.joints)])
+        parts.append("(FRP (n lf) (c 0.00 0.00 -0.01) (f 0.00 0.00 22.60))"
+                     "(FRP (n rf) (c 0.00 0.00 -0.01) (f 0.00 0.00 22.60))")
+        return "".join(parts).encode('ascii')
+
+    def __sceneParts(self):
+        parts = list(self.field)
+        parts.append(self.ball)
+        for key in sorted(self.players):
+            parts.extend(self.players[key].parts)
+        return parts
+
+    def __sendScene(self):
+        if self.scenes is not None:
+            scene = self.scenes[self.cycles % len(self.scenes)]
+            for monitor in list(self.monitors):
+                self.__send(monitor, scene, True)
+                self.stats["fullScenes"] += 1
+            return
+
+        parts = self.__sceneParts()
+        state = "(time %.2f)(half 1)(score_left 0)(score_right 0)(play_mode 2)" % self.simTime
+        full = None
+        delta = None
+        for monitor in list(self.monitors):
+            if monitor.needFullState or self.structureChanged:
+                if full is None:
+                    full = ("((FieldLength 30)(FieldWidth 20)(FieldHeight 40)(GoalWidth 2.1)(GoalDepth 0.6)"
+                            "(GoalHeight 0.8)(BallRadius 0.042)" + state + ")(RSG 0 1)(" +
+                            "".join(part.renderFull() for part in parts) + ")").encode('ascii')
+                self.__send(monitor, full, True)
+                monitor.needFullState = False
+                self.stats["fullScenes"] += 1
+            else:
+                if delta is None:
+                    delta = ("(" + state + ")(RDS 0 1)(" +
+                             "".join(part.renderDelta() for part in parts) + ")").encode('ascii')
+                self.__send(monitor, delta, True)
+                self.stats["deltaScenes"] += 1
+        for part in parts:
+            part.moved = False
+        self.structureChanged = False
+
+    def __send(self, client, message, isMonitor):
+        try:
+            client.sock.sendall(struct.pack("!I", len(message)) + message)
+            self.stats["bytesSent"] += 4 + len(message)
+        except OSError:
+            self.__drop(client, isMonitor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="simspark stand-in server without physics")
+    parser.add_argument("--agent-port", type=int, default=3100)
+    parser.add_argument("--server-port", type=int, default=3200)
+    parser.add_argument("--cycle", type=float, default=0.02, help="seconds per cycle, 0 as fast as possible")
+    parser.add_argument("--sync", action="store_true", help="wait for (syn) of all agents every cycle")
+    parser.add_argument("--no-limbs", action="store_true", help="only body and head nodes per player")
+    parser.add_argument("--perceptors", help="replay perceptor messages from this file")
+    parser.add_argument("--scenes", help="replay monitor messages from this file")
+    args = parser.parse_args()
+    server = StandInServer(args.agent_port, args.server_port, args.cycle, args.sync, not args.no_limbs,
+                           args.perceptors, args.scenes)
+    server.listen()
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
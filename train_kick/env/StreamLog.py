@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+
+import atexit
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from train_kick.env.Logger import Logger
+
+"""
+Layout of a stream log:
+    MAGIC, then chunks of CHUNK_HEADER(b'CHNK', compressed length, raw length) + zlib data.
+A raw chunk is a sequence of records RECORD_HEADER(monotonic ns, stream, length) + frame.
+"""
+MAGIC = b"TKLOG\x00\x00\x01"
+CHUNK_HEADER = struct.Struct("!4sII")
+CHUNK_TAG = b"CHNK"
+RECORD_HEADER = struct.Struct("!qBI")
+AGENT = 0
+MONITOR = 1
+STREAM_NAMES = {"agent": AGENT, "monitor": MONITOR}
+
+
+class StreamRecorder:
+    """
+    Opt-in recorder of the frames one actor receives, appended to a chunk-compressed
+    log per actor, see StreamLog to read it.
+
+    NeoRobot records every frame it parses, of all transports, by
+        if self.recorder: self.recorder.record(AGENT, message)
+    so a disabled recorder costs a truth test. Frames which latestOnly skipped are never parsed
+    and not recorded, a replay gives the same states as the recorded run.
+    Records are buffered and compressed in chunks of chunkSize bytes, a chunk is also written
+    when it is older than flushInterval seconds, so a crash loses at most that much.
+    """
+    logger = Logger.getLogger("StreamRecorder")
+    directory = None
+    recorders = {}
+    recordersLock = threading.Lock()
+
+    def __init__(self, path, chunkSize=1 << 18, flushInterval=1.0, level=1):
+        self.path = path
+        self.chunkSize = chunkSize
+        self.flushInterval = int(flushInterval * 1e9)
+        self.level = level
+        self.chunk = bytearray()
+        self.chunkBegin = 0
+        self.frames = 0
+        self.bytesWritten = 0
+        self.lock = threading.Lock()
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    @classmethod
+    def startRecording(cls, directory):
+        """
+        Record the streams of every actor of this process into directory/<actor>.tklog.
+        """
+        if cls.directory is not None:
+            return
+        os.makedirs(directory, exist_ok=True)
+        cls.directory = directory
+        atexit.register(cls.closeAll)
+        cls.logger.info("record the streams of all actors to " + directory)
+
+    @classmethod
+    def get(cls, name):
+        """
+        Return the recorder of the actor name, None if recording is disabled.
+        A reconnected actor appends to the log of its former connection.
+        """
+        if cls.directory is None:
+            return None
+        with cls.recordersLock:
+            if name not in cls.recorders:
+                fileName = "".join(c if c.isalnum() or c in "-_" else "_" for c in name) + ".tklog"
+                cls.recorders[name] = StreamRecorder(os.path.join(cls.directory, fileName))
+            return cls.recorders[name]
+
+    @classmethod
+    def closeAll(cls):
+        with cls.recordersLock:
+            recorders = list(cls.recorders.values())
+        for recorder in recorders:
+            recorder.close()
+
+    def record(self, stream, frame):
+        """
+        Append a frame(bytes-like or str) of stream AGENT or MONITOR, the frame is copied.
+        """
+        if isinstance(frame, str):
+            frame = frame.encode('ascii')
+        now = time.monotonic_ns()
+        with self.lock:
+            chunk = self.chunk
+            if not chunk:
+                self.chunkBegin = now
+            chunk += RECORD_HEADER.pack(now, stream, len(frame))
+            chunk += frame
+            self.frames += 1
+            if len(chunk) >= self.chunkSize or now - self.chunkBegin >= self.flushInterval:
+                self.__writeChunk()
+
+    def flush(self):
+        with self.lock:
+            self.__writeChunk()
+
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.__writeChunk()
+            self.file.close()
+
+    def __writeChunk(self):
+        if not self.chunk or self.file.closed:
+            return
+        data = zlib.compress(self.chunk, self.level)
+        self.file.write(CHUNK_HEADER.pack(CHUNK_TAG, len(data), len(self.chunk)))
+        self.file.write(data)
+        self.file.flush()
+        self.bytesWritten += CHUNK_HEADER.size + len(data)
+        self.chunk = bytearray()
+
+
+class StreamLog:
+    """
+    Memory-mapped reader of a log of StreamRecorder.
+    Chunks are decompressed one at a time while iterating, the frames are memoryviews
+    of the chunk, only valid until the next chunk is read.
+    A chunk which was cut off by a crash ends the log.
+    """
+    logger = Logger.getLogger("StreamLog")
+    """
+    Gaps between records longer than MAX_GAP seconds, e.g. between the runs appended to one log
+    or while an actor reconnected, aren't replayed at pace.
+    """
+    MAX_GAP = 1.0
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        if self.view[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(path + " is no stream log")
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+    def chunks(self):
+        offset = len(MAGIC)
+        size = len(self.view)
+        while offset + CHUNK_HEADER.size <= size:
+            tag, length, rawLength = CHUNK_HEADER.unpack_from(self.view, offset)
+            offset += CHUNK_HEADER.size
+            if tag != CHUNK_TAG or offset + length > size:
+                self.logger.warning(self.path + " truncated at " + str(offset - CHUNK_HEADER.size))
+                return
+            yield zlib.decompress(self.view[offset:offset + length], bufsize=rawLength)
+            offset += length
+
+    def frames(self, stream=None):
+        """
+        Yield (monotonic ns, stream, frame) of all records, or only those of stream.
+        """
+        for chunk in self.chunks():
+            view = memoryview(chunk)
+            offset = 0
+            while offset < len(chunk):
+                timestamp, recordStream, length = RECORD_HEADER.unpack_from(chunk, offset)
+                offset += RECORD_HEADER.size
+                if stream is None or recordStream == stream:
+                    yield timestamp, recordStream, view[offset:offset + length]
+                offset += length
+
+    def replay(self, robot, speed=None):
+        """
+        Feed the frames into robot.update and robot.updateGrandStates,
+        at speed times the recorded pace, as fast as possible if speed is None.
+        Return the number of frames.
+        """
+        count = 0
+        begin = None
+        last = None
+        maxGap = int(self.MAX_GAP * 1e9)
+        for timestamp, stream, frame in self.frames():
+            if speed is not None:
+                # A log appended by another run or a gap of a reconnect starts a new clock
+                if last is None or not 0 <= timestamp - last <= maxGap:
+                    begin = (timestamp, time.monotonic_ns())
+                last = timestamp
+                delay = (timestamp - begin[0]) / speed - (time.monotonic_ns() - begin[1])
+                if delay > 0:
+                    time.sleep(delay / 1e9)
+            if stream == AGENT:
+                robot.update(frame)
+            else:
+                robot.updateGrandStates(frame)
+            count += 1
+        return count
+
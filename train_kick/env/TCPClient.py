@@ -1,11 +1,14 @@
 #!/usr/bin/python3
 
+import select
 import socket
 import threading
 import time
 import struct
 
 from train_kick.env.Logger import Logger
+from train_kick.env.FrameReader import FrameReader, frameBytes
+from train_kick.env.Watchdog import connectWithBackoff
 
 
 class AgentConnection(threading.Thread):
@@ -18,15 +21,36 @@ class AgentConnection(threading.Thread):
     agentDefaultPort = 3100
     monitorDefaultPort = 3200
 
-    def __init__(self, id, threadName, robot):
+    def __init__(self, id, threadName, robot, syncMode=False, latestOnly=False):
         super(AgentConnection, self).__init__()
         self.setName(threadName + "_w")
+        self.daemon = True
 
         self.id = id
         self.threadName = threadName
-        self.isStopped = False
-        self.send_buffer = ""
+        """
+        The receiving threads share the stop event, so close() stops them as well.
+        """
+        self.stopEvent = threading.Event()
+        self.error = None
+        """
+        In agent sync mode the server only moves on when every agent has sent (syn),
+        messages are sent by syncCycle() instead of the timer loop in run().
+        """
+        self.syncMode = syncMode
+        """
+        In latest only mode the receiver drops the perceptor messages which are
+        already outdated by a newer one in the socket, so a slow robot doesn't lag behind.
+        """
+        self.latestOnly = latestOnly
+        """
+        Messages and trainer commands are appended until the next cycle sends them, so no effector command
+        which the ActionEncoder left out of a later message is lost. The timer loop in run() takes them
+        from another thread than the robot adds them, so the buffers are swapped under sendLock.
+        """
+        self.send_buffer = b""
         self.monitor_send_buffer = ""
+        self.sendLock = threading.Lock()
 
         self.robot = robot
 
@@ -34,78 +58,97 @@ class AgentConnection(threading.Thread):
         return "Server IP:" + self.server + " Server agent port:" + str(
             self.port)
 
+    @property
+    def isStopped(self):
+        return self.stopEvent.is_set()
+
     def connectServers(self,
                        server=serverDefaultIP,
                        port=agentDefaultPort,
-                       mport=monitorDefaultPort):
+                       mport=monitorDefaultPort,
+                       retries=None):
+        """
+        Try to connect retries times(forever if None) with exponential backoff.
+        Return True if connected.
+        """
         self.server = server
         self.port = port
         self.mport = mport
-
-        cstatus = True
-        while(cstatus):
-            try:
-                address = (self.server, self.port)
-                maddress = (self.server, self.mport)
-                self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.sock.connect(address)
-
-                self.msock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.msock.connect(maddress)
-
-                self.rethread = ReceivingThread(self.threadName + "_r", self.sock,
-                                                self.isStopped, self.robot)
-                self.rethread.start()
-
-                # For monitor thread
-                self.mrethread = MonitorReceivingThread(self.threadName + "_r_m",
-                                                        self.msock, self.isStopped, self.robot)
-                self.mrethread.start()
-
-                cstatus = False
-            except socket.error as e:
-                self.logger.exception("socket.error" + repr(e))
-                self.logger.error(str(self.server) + ":" + str(self.port))
-                self.close()
-                time.sleep(30)
-                self.isStopped = False
+        return connectWithBackoff(self.__connect, self.close, retries, self.logger,
+                                  str(self.server) + ":" + str(self.port))
+
+    def __connect(self):
+        self.stopEvent = threading.Event()
+        address = (self.server, self.port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.connect(address)
+
+        self.rethread = ReceivingThread(self.threadName + "_r", self.sock,
+                                        self.stopEvent, self.robot, self.latestOnly)
+        self.rethread.start()
+
+        # No monitor connection if mport is None, e.g. the robot reads a shared MonitorFeed
+        if (self.mport is not None):
+            maddress = (self.server, self.mport)
+            self.msock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.msock.connect(maddress)
+
+            # For monitor thread
+            self.mrethread = MonitorReceivingThread(self.threadName + "_r_m",
+                                                    self.msock, self.stopEvent, self.robot)
+            self.mrethread.start()
 
     def close(self):
-        self.isStopped = True
-        time.sleep(1)
+        """
+        Shutting the sockets down wakes the receiving threads up, which then see the stop event.
+        """
+        self.stopEvent.set()
+        for name in ('sock', 'msock'):
+            if(hasattr(self, name)):
+                try:
+                    getattr(self, name).shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        for name in ('rethread', 'mrethread'):
+            if(hasattr(self, name) and getattr(self, name).is_alive()):
+                getattr(self, name).join(1)
         if(hasattr(self, 'rethread')):
-            self.rethread.close()
-
-        if(hasattr(self, 'mrethread')):
-            self.mrethread.close()
+            self.logger.info("receive stats:" + str(self.receiveStats()))
 
-        time.sleep(1)
         if(hasattr(self, 'sock')):
             self.sock.close()
         if(hasattr(self, 'msock')):
             self.msock.close()
 
+    def isDead(self):
+        """
+        True if a socket failed or a receiving thread ended without being stopped.
+        """
+        if (self.error is not None):
+            return True
+        for name in ('rethread', 'mrethread'):
+            if(hasattr(self, name) and getattr(self, name).error is not None):
+                return True
+        return False
+
     def run(self):
+        if (self.syncMode):
+            self.logger.info("agent sync mode, messages are sent by syncCycle")
+            return
         try:
             self.logger.info("begin to send message...")
             next_time = time.time() + 0.02
             while (not self.isStopped):
-                if (self.send_buffer != ""):
-                    self.logger.debug("Send content:" + self.send_buffer)
-                    self.__socketSend(self.send_buffer+"(syn)")
-                    self.send_buffer = ""
+                message = self.__takeSendBuffer()
+                if (message):
+                    self.logger.debug("Send content:%s", message)
+                    self.__socketSend(message + b"(syn)")
                 else:
                     self.logger.debug("Send content:(syn)")
-                    self.__socketSend("(syn)")
+                    self.__socketSend(b"(syn)")
 
                 # send monitor message
-                if (self.monitor_send_buffer != ""):
-                    self.logger.debug("Send monitor content:" + self.monitor_send_buffer)
-                    self.__monitorSend(self.monitor_send_buffer)
-                    self.monitor_send_buffer = ""
-                else:
-                    self.logger.debug("Send monitor content: (reqfullstate)")
-                    self.__monitorSend("(reqfullstate)")
+                self.__sendMonitorBuffer()
 
                 after_action = time.time()
                 sleeptime = next_time - after_action
@@ -122,19 +165,93 @@ class AgentConnection(threading.Thread):
                     time.sleep(0.015)
 
         except socket.error as e:
-            self.logger.exception("socket.error" + repr(e))
-            self.sock.close()
-            exit(1)
+            if (not self.isStopped):
+                self.logger.error(self.threadName + " socket.error" + repr(e))
+                self.error = e
+
+    def syncCycle(self, timeout=1.0):
+        """
+        Send the buffered message with (syn) and block until the perceptor message
+        of the next cycle arrives. Return False if nothing came within timeout.
+        """
+        count = self.rethread.messageCount
+        message = self.__takeSendBuffer()
+        self.logger.debug("Send content:%s(syn)", message)
+        try:
+            self.__socketSend(message + b"(syn)")
+            self.__sendMonitorBuffer()
+        except socket.error as e:
+            self.logger.error(self.threadName + " socket.error" + repr(e))
+            self.error = e
+            return False
+
+        if (not self.rethread.waitMessage(count, timeout)):
+            self.logger.warning("no perceptor message in " + str(timeout) + "s")
+            return False
+        return True
+
+    def receiveStats(self):
+        """
+        Bytes, frames, buffer grows and skipped frames of the agent and monitor receivers.
+        """
+        stats = {"agent": self.rethread.reader.stats()}
+        if(hasattr(self, 'mrethread')):
+            stats["monitor"] = self.mrethread.reader.stats()
+        return stats
+
+    @property
+    def messageCount(self):
+        return self.rethread.messageCount
+
+    def waitMessage(self, count, timeout=None):
+        """
+        Block until more than count perceptor messages have been received.
+        """
+        return self.rethread.waitMessage(count, timeout)
+
+    @property
+    def skippedFrames(self):
+        return self.rethread.reader.framesSkipped
+
+    def observationAge(self):
+        """
+        Seconds since the perceptor message of the current robot states was received.
+        """
+        return time.time() - self.rethread.lastReadTime
 
     def sendMessage(self, message):
-        self.send_buffer = message
+        with self.sendLock:
+            self.send_buffer += frameBytes(message)
 
     def sendMonitorMessage(self, message):
-        self.monitor_send_buffer = message
+        with self.sendLock:
+            self.monitor_send_buffer += message
 
-    def __socketSend(self, message):
-        msg = bytes(message, 'ascii')
+    def __takeSendBuffer(self):
+        with self.sendLock:
+            message = self.send_buffer
+            self.send_buffer = b""
+        return message
+
+    def __socketSend(self, msg):
+        metrics = self.robot.metrics
+        begin = time.perf_counter_ns() if metrics else 0
         self.sock.send(struct.pack("!I", len(msg)) + msg)
+        if metrics:
+            metrics.record("send", begin)
+
+    def __sendMonitorBuffer(self):
+        if (self.mport is None):
+            return
+        with self.sendLock:
+            message = self.monitor_send_buffer
+            self.monitor_send_buffer = ""
+        if (message != ""):
+            self.logger.debug("Send monitor content:" + message)
+            self.__monitorSend(message)
+        elif (self.robot.grandEnvs.takeFullStateRequest()):
+            self.logger.debug("Send monitor content: (reqfullstate)")
+            self.__monitorSend("(reqfullstate)")
 
     def __monitorSend(self, message):
         msg = bytes(message, 'ascii')
@@ -145,35 +262,66 @@ class ReceivingThread(threading.Thread):
 
     logger = Logger.getLogger("ReceivingThread")
 
-    def __init__(self, name, sock, isStopped, robot):
+    def __init__(self, name, sock, stopEvent, robot, latestOnly=False):
         super(ReceivingThread, self).__init__()
         self.setName(name)
+        self.daemon = True
 
         self.name = name
         self.sock = sock
-        self.isStopped = isStopped
+        self.stopEvent = stopEvent
+        self.error = None
         self.logger.info(name + " receive init")
 
         self.robot = robot
+        self.reader = FrameReader(sock)
+        self.latestOnly = latestOnly
         self.lastReadTime = time.time()
+        self.messageCount = 0
+        self.messageCondition = threading.Condition()
 
     def run(self):
-        while (not self.isStopped):
-            message = self.readMessage()
-            # self.logger.info("Receive:"+message)
-
-            self.udpateRobot(message)
-            self.lastReadTime = time.time()
+        try:
+            while (not self.stopEvent.is_set()):
+                if (not waitReadable(self.sock)):
+                    continue
+                metrics = self.robot.metrics
+                begin = time.perf_counter_ns() if metrics else 0
+                message = self.readMessage()
+                if metrics:
+                    metrics.record("read", begin)
+                # self.logger.info("Receive:"+message)
+
+                self.udpateRobot(message)
+                self.lastReadTime = time.time()
+                with self.messageCondition:
+                    self.messageCount += 1
+                    self.messageCondition.notify_all()
+        except (OSError, ValueError) as e:
+            if (not self.stopEvent.is_set()):
+                self.logger.error(self.name + " receive error" + repr(e))
+                with self.messageCondition:
+                    self.error = e
+                    self.messageCondition.notify_all()
 
     def close(self):
-        self.isStopped = True
+        self.stopEvent.set()
+
+    def waitMessage(self, count, timeout=None):
+        """
+        Block until more than count messages have been received or the connection failed.
+        """
+        with self.messageCondition:
+            self.messageCondition.wait_for(lambda: self.messageCount > count or self.error is not None, timeout)
+            return self.messageCount > count
 
     def readMessage(self):
-        length_no = self.sock.recv(4, socket.MSG_WAITALL)
-        length = struct.unpack("!I", length_no)
-        msg = self.sock.recv(length[0], socket.MSG_WAITALL)
-        message = msg.decode('ascii')
-        return message
+        """
+        The message is a memoryview of the reader buffer, it's only valid until the next read.
+        """
+        if (self.latestOnly):
+            return self.reader.readLatestFrame()
+        return self.reader.readFrame()
 
     def udpateRobot(self, message):
         self.logger.debug(message)
@@ -185,39 +333,55 @@ class MonitorReceivingThread(threading.Thread):
 
     logger = Logger.getLogger("MonitorReceivingThread")
 
-    def __init__(self, name, sock, isStopped, robot):
+    def __init__(self, name, sock, stopEvent, robot):
         super(MonitorReceivingThread, self).__init__()
         self.logger.info(name + " receive init")
 
         self.setName(name)
+        self.daemon = True
         self.name = name
         self.sock = sock
-        self.isStopped = isStopped
+        self.stopEvent = stopEvent
+        self.error = None
         self.robot = robot
+        self.reader = FrameReader(sock, 65536)
 
         self.lastReadTime = time.time()
 
     def run(self):
-        while (not self.isStopped):
-            message = self.readMessage()
-            # self.logger.info("Receive:"+message)
-
-            self.udpateGrandStates(message)
-            self.lastReadTime = time.time()
+        try:
+            while (not self.stopEvent.is_set()):
+                if (not waitReadable(self.sock)):
+                    continue
+                message = self.readMessage()
+                # self.logger.info("Receive:"+message)
+
+                self.udpateGrandStates(message)
+                self.lastReadTime = time.time()
+        except (OSError, ValueError) as e:
+            if (not self.stopEvent.is_set()):
+                self.logger.error(self.name + " receive error" + repr(e))
+                self.error = e
 
     def close(self):
-        self.isStopped = True
+        self.stopEvent.set()
 
     def readMessage(self):
-        length_no = self.sock.recv(4, socket.MSG_WAITALL)
-        length = struct.unpack("!I", length_no)
-        msg = self.sock.recv(length[0], socket.MSG_WAITALL)
-        message = msg.decode('ascii')
-        return message
+        """
+        The message is a memoryview of the reader buffer, it's only valid until the next read.
+        """
+        return self.reader.readFrame()
 
     def udpateGrandStates(self, message):
         self.logger.debug(message)
-        self.robot.grandEnvs.updateGrandStates(message)
+        self.robot.updateGrandStates(message)
         # self.logger.debug(GrandEnvs.getPlayerLocation(0, 1))
         # self.logger.debug("ball: " + str(GrandEnvs.ballLocation))
         # self.logger.debug("players: " + str(GrandEnvs.getAllPlayersLocation()))
+
+
+def waitReadable(sock, timeout=0.1):
+    """
+    Wait until sock is readable, the receiving threads check their stop event in between.
+    """
+    return bool(select.select([sock], [], [], timeout)[0])
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+
+import time
+
+from train_kick.env.Logger import Logger
+
+"""
+Delays between connection attempts grow from MIN_BACKOFF to MAX_BACKOFF seconds,
+the transports and the Watchdog share this policy.
+"""
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 8
+
+
+def backoffDelay(failures, minBackoff=MIN_BACKOFF, maxBackoff=MAX_BACKOFF):
+    """
+    Delay after failures failed attempts in a row, doubling from minBackoff up to maxBackoff.
+    """
+    return min(minBackoff * 2 ** (failures - 1), maxBackoff)
+
+
+def connectWithBackoff(connect, cleanup, retries, logger, address):
+    """
+    Call connect() until it doesn't raise OSError, retries times(forever if None),
+    cleanup() is called after every failed attempt. Return True if connected.
+    """
+    attempt = 0
+    while True:
+        try:
+            connect()
+            return True
+        except OSError as e:
+            logger.error("socket.error" + repr(e) + " " + address)
+            cleanup()
+            attempt += 1
+            if (retries is not None and attempt >= retries):
+                return False
+            time.sleep(backoffDelay(attempt))
+
+
+class Watchdog:
+    """
+    Health of the connection of one actor.
+    A connection is unhealthy if its socket failed or no perceptor message arrived
+    for silentTimeout seconds, which is a few cycles of 20ms.
+    Reconnection attempts are spaced by a bounded exponential backoff.
+    """
+    logger = Logger.getLogger("Watchdog")
+
+    def __init__(self, silentTimeout=0.2, minBackoff=MIN_BACKOFF, maxBackoff=MAX_BACKOFF):
+        self.silentTimeout = silentTimeout
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+        self.failures = 0
+        self.nextAttempt = 0
+        self.reconnects = 0
+
+    def isHealthy(self, con):
+        if (con.isDead()):
+            return False
+        age = con.observationAge()
+        if (age > self.silentTimeout):
+            self.logger.warning("no perceptor message for " + str(round(age, 3)) + "s")
+            return False
+        return True
+
+    def due(self):
+        """
+        True if the next reconnection attempt may start.
+        """
+        return time.time() >= self.nextAttempt
+
+    def failed(self):
+        """
+        Count a failed attempt and return the delay until the next one.
+        """
+        self.failures += 1
+        delay = backoffDelay(self.failures, self.minBackoff, self.maxBackoff)
+        self.nextAttempt = time.time() + delay
+        return delay
+
+    def succeeded(self):
+        self.failures = 0
+        self.nextAttempt = 0
+        self.reconnects += 1